@@ -3,6 +3,7 @@ import toml
 from typing import List
 from datetime import datetime
 from utils import persistence
+from lps.core import columnar
 
 
 class GlobalConfig:
@@ -25,6 +26,14 @@ class GlobalConfig:
         self.EPSG = self.valid_int(parsed_toml["setup"]["epsg"], "epsg")
         self.SEED = self.valid_int(parsed_toml["setup"]["seed"], "seed")
         self.VERBOSE = self.valid_bool(parsed_toml["setup"]["verbose"], "verbose")
+        self.WORKERS = self.valid_positive_int(parsed_toml["setup"].get("workers", 1), "workers")
+        self.STREAM = self.valid_bool(parsed_toml["setup"].get("stream", False), "stream")
+        self.CHUNK_SIZE = self.valid_positive_int(parsed_toml["setup"].get("chunk_size", 100000), "chunk_size")
+        self.GZIP_LEVEL = self.valid_gzip_level(parsed_toml["setup"].get("gzip_level", 9))
+        self.GZIP_THREADS = self.valid_positive_int(parsed_toml["setup"].get("gzip_threads", 1), "gzip_threads")
+        self.PREFETCH_THREADS = self.valid_positive_int(
+            parsed_toml["setup"].get("prefetch_threads", 4), "prefetch_threads"
+        )
 
         # Paths
         self.data_location = self.valid_path(parsed_toml["paths"]["data_dir"], "data_dir")
@@ -34,6 +43,15 @@ class GlobalConfig:
         self.attributes_name = parsed_toml["paths"]["attributes_name"]
         self.XMLPATHATTRIBS = os.path.join(self.OUTPATH, self.attributes_name)
 
+        # Tables
+        tables = parsed_toml.get("tables", {})
+        self.TABLE_FORMATS = {
+            table: self.valid_table_format(tables.get(table, "csv"), table)
+            for table in ("activities", "legs", "attributes")
+        }
+        self.PARTITION = self.valid_bool(tables.get("partition", False), "partition")
+        self.ROW_GROUP_SIZE = self.valid_positive_int(tables.get("row_group_size", 100000), "row_group_size")
+
         # Records to include in output and log:
         self.RECORDS = {
             'config': self.SOURCE,
@@ -44,8 +62,17 @@ class GlobalConfig:
             'sample': self.SAMPLE,
             'crs': self.EPSG,
             'seed': self.SEED,
+            'workers': self.WORKERS,
+            'stream': self.STREAM,
+            'chunk_size': self.CHUNK_SIZE,
+            'gzip_level': self.GZIP_LEVEL,
+            'gzip_threads': self.GZIP_THREADS,
+            'prefetch_threads': self.PREFETCH_THREADS,
             'plans_name': self.XMLPATH,
             'attributes_name': self.XMLPATHATTRIBS,
+            'table_formats': self.TABLE_FORMATS,
+            'partition': self.PARTITION,
+            'row_group_size': self.ROW_GROUP_SIZE,
         }
 
     def print_records(self):
@@ -120,6 +147,51 @@ class GlobalConfig:
             )
         return inp
 
+    @staticmethod
+    def valid_positive_int(inp: int, field_name: str) -> int:
+        """
+        :param inp: positive integer expected
+        :param field_name: Field name to use in exception
+        :return: int
+        """
+        if not isinstance(inp, int) or inp < 1:
+            raise Exception(
+                f'Specified {field_name}: ({inp}) expected to be positive integer'
+            )
+        return inp
+
+    @staticmethod
+    def valid_gzip_level(inp: int) -> int:
+        """
+        Raise exception if specified gzip compression level is not an integer in [0, 9].
+        :param inp: integer expected
+        :return: int
+        """
+        if not isinstance(inp, int) or not 0 <= inp <= 9:
+            raise Exception(
+                f'Specified gzip_level: ({inp}) expected to be integer from 0 to 9'
+            )
+        return inp
+
+    @staticmethod
+    def valid_table_format(inp: str, field_name: str) -> str:
+        """
+        Raise exception if specified table format is unknown, or requires pyarrow and pyarrow is
+        not installed.
+        :param inp: one of csv, parquet or arrow
+        :param field_name: Field name to use in exception
+        :return: str
+        """
+        if inp not in columnar.FORMATS:
+            raise Exception(
+                f'Specified {field_name} format: ({inp}) expected to be one of {list(columnar.FORMATS)}'
+            )
+        if inp != 'csv' and not columnar.pyarrow_available():
+            raise Exception(
+                f'Specified {field_name} format: ({inp}) requires pyarrow to be installed'
+            )
+        return inp
+
     @staticmethod
     def valid_bool(inp: bool, field_name: str) -> bool:
         """
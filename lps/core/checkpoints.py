@@ -0,0 +1,124 @@
+import glob
+import hashlib
+import os
+
+from lps.core import matrices, zones
+from lps.core.population import Population
+from utils import aws_s3_ftns, persistence
+
+"""
+Per source population checkpoints, so that a failed build can be resumed without resampling
+completed sources. Checkpoints are saved to a 'checkpoints' directory in the output location,
+keyed on a hash of the source configuration (including seed, sample and the state of input files
+and directories, local or S3).
+Checkpoints are not saved for S3 output locations.
+"""
+
+CHECKPOINT_DIR = 'checkpoints'
+IGNORE = {'RECORDS', 'VERBOSE', 'WORKERS', 'OUTPATH', 'XMLPATH', 'XMLPATHATTRIBS'}  # do not change sampling
+DERIVED = zones.CACHE_SUFFIXES + matrices.CACHE_SUFFIXES  # caches written alongside inputs by builds
+
+
+def config_key(config):
+    """
+    Hash of source configuration: all (upper case) config values, other than those which do not
+    change the sampled population, plus the state of input files and directories (config values
+    named *PATH).
+    :param config: source Config
+    :return: str
+    """
+    names = {name for name in dir(config) if name.isupper() and name not in IGNORE}
+    digest = hashlib.sha1()
+    for name in sorted(names):
+        value = getattr(config, name)
+        digest.update('{}={!r}\n'.format(name, value).encode('utf-8'))
+        if name.endswith('PATH') and isinstance(value, str):
+            for state in input_state(value):
+                digest.update('{}.state={!r}\n'.format(name, state).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def input_state(location):
+    """
+    State of an input file or directory (all files within), as modified times and sizes of local
+    files or ETags of S3 objects. Shapefiles include their sidecar (.dbf, .shx etc.) files. Caches
+    derived from inputs (zone indices and stores, demand matrices) are excluded, as builds write them.
+    :param location: local or S3 path
+    :return: list of tuples, empty if location does not exist
+    """
+    if persistence.is_s3_location(location):
+        bucket, key = aws_s3_ftns.parse_bucket_and_key_path(location.rstrip('/'))
+        head = persistence.s3_head(location)
+        if head is not None and not persistence.is_shp(location):
+            return [(key, head['ETag'])]
+        prefix = key + '/' if head is None else os.path.splitext(key)[0] + '.'
+        return [
+            (obj['Key'], obj['ETag']) for obj in aws_s3_ftns.get_matching_s3_objects(bucket, prefix)
+            if not obj['Key'].endswith(DERIVED)
+        ]
+
+    if os.path.isdir(location):
+        paths = [os.path.join(root, name) for root, _, names in os.walk(location) for name in names]
+    elif persistence.is_shp(location):
+        paths = glob.glob(glob.escape(os.path.splitext(location)[0]) + '.*')
+    elif os.path.isfile(location):
+        paths = [location]
+    else:
+        return []
+    states = []
+    for path in sorted(path for path in paths if not path.endswith(DERIVED)):
+        stat = os.stat(path)
+        states.append((os.path.relpath(path, location), stat.st_mtime, stat.st_size))
+    return states
+
+
+def checkpoint_path(config, key='*'):
+    """
+    :param config: source Config
+    :param key: config key
+    :return: str, or None for S3 output locations
+    """
+    if persistence.is_s3_location(config.OUTPATH):
+        return None
+    return os.path.join(config.OUTPATH, CHECKPOINT_DIR, '{}.{}.population.npz'.format(config.SOURCE, key))
+
+
+def load(config):
+    """
+    Load checkpointed population for given source config, if a valid checkpoint exists.
+    :param config: source Config
+    :return: Population, or None
+    """
+    path = checkpoint_path(config, config_key(config))
+    if not path or not os.path.exists(path):
+        return None
+    try:
+        return Population.load(path)
+    except (OSError, ValueError, KeyError, EOFError):
+        print('\t> ignoring invalid checkpoint {}'.format(path))
+        return None
+
+
+def save(population, config):
+    """
+    Save checkpoint of source population, written to a temporary file first so that partially
+    written checkpoints are never read. Checkpoints of previous configurations of the source are removed.
+    :param population: Population
+    :param config: source Config
+    :return: str path, or None if not saved
+    """
+    path = checkpoint_path(config, config_key(config))
+    if not path:
+        return None
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp.npz'
+        population.save(temp_path)
+        os.replace(temp_path, path)
+        for stale in glob.glob(checkpoint_path(config)):
+            if stale != path:
+                os.remove(stale)
+    except OSError:
+        print('\t> unable to save checkpoint to {}'.format(path))
+        return None
+    return path
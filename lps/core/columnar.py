@@ -0,0 +1,181 @@
+import os
+from contextlib import ExitStack
+
+from utils import persistence
+
+"""
+Columnar (Parquet and Arrow IPC) table outputs, as alternatives to csv. Requires pyarrow, which
+is imported only when a columnar format is used. Categorical (pandas) columns are written as
+dictionary encoded columns. Tables can be partitioned by a column (eg source), as hive style
+directories (table.parquet/source=lopops/part-0.parquet), without the partition column.
+
+Arrow tables are written in the IPC stream format (.arrows), which (unlike the IPC file format)
+allows dictionaries to change between record batches, so that tables can be written in chunks.
+"""
+
+FORMATS = {
+    'csv': '.csv',
+    'parquet': '.parquet',
+    'arrow': '.arrows',
+}
+
+
+def pyarrow_available():
+    try:
+        import pyarrow  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def table_location(location, fmt):
+    """
+    Replace extension of table location with extension of given format.
+    :param location: local or S3 path, eg outputs/activities.csv
+    :param fmt: str, key of FORMATS
+    :return: str
+    """
+    root, _ = os.path.splitext(location)
+    return root + FORMATS[fmt]
+
+
+def to_arrow(df):
+    """
+    Convert DataFrame to Arrow table. Named indices (eg attributes uid) are kept as columns,
+    unnamed (row number) indices are dropped.
+    :param df: Pandas DataFrame
+    :return: pyarrow Table
+    """
+    import pyarrow as pa
+    if df.index.name is not None:
+        df = df.reset_index()
+    return pa.Table.from_pandas(df, preserve_index=False)
+
+
+def stable_schema(schema):
+    """
+    Widen dictionary indices to int32, as pandas uses the smallest code type for the number of
+    categories, which can differ between chunks.
+    :param schema: pyarrow Schema
+    :return: pyarrow Schema
+    """
+    import pyarrow as pa
+    fields = []
+    for field in schema:
+        if pa.types.is_dictionary(field.type):
+            field = field.with_type(pa.dictionary(pa.int32(), field.type.value_type))
+        fields.append(field)
+    return pa.schema(fields)
+
+
+def union_schema(schemas):
+    """
+    Combine schemas of tables with the same columns, taking the first non-null type of each column
+    (columns of missing values in one table have null type).
+    :param schemas: iterable of pyarrow Schema
+    :return: pyarrow Schema
+    """
+    import pyarrow as pa
+    fields = {}
+    for schema in schemas:
+        for field in schema:
+            if field.name not in fields or pa.types.is_null(fields[field.name].type):
+                fields[field.name] = field
+    return pa.schema(list(fields.values()))
+
+
+class TableSink:
+    """
+    Incremental Parquet or Arrow IPC table writer. Each DataFrame written is appended to the
+    output (as parquet row groups or arrow record batches of at most row_group_size rows), so
+    DataFrames must have the same columns and types. Outputs are opened with
+    persistence.open_output, so can be local or S3. Use as a context manager:
+
+        with TableSink(location, 'parquet', partition_by='source') as sink:
+            sink.write(df)
+    """
+
+    def __init__(self, location, fmt, partition_by=None, row_group_size=100000, schema=None):
+        """
+        :param location: local or S3 path of output file (or directory if partitioned)
+        :param fmt: 'parquet' or 'arrow'
+        :param partition_by: optional column name to partition output by
+        :param row_group_size: maximum rows per parquet row group or arrow record batch
+        :param schema: optional pyarrow Schema of output, by default that of the first DataFrame written
+        """
+        if fmt not in ('parquet', 'arrow'):
+            raise ValueError('unsupported table format: {}'.format(fmt))
+        self.location = location
+        self.fmt = fmt
+        self.partition_by = partition_by
+        self.row_group_size = row_group_size
+        self.stack = None
+        self.schema = stable_schema(schema) if schema is not None else None
+        self.writers = {}  # partition value: writer
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.stack.__exit__(exc_type, exc_value, traceback)
+
+    def write(self, df):
+        """
+        Append DataFrame to output. Unless given, the output schema is taken from the first DataFrame
+        written (before partitioning, so that all partitions have the same schema).
+        :param df: Pandas DataFrame
+        """
+        import pyarrow as pa
+        table = to_arrow(df)
+        if self.schema is None:
+            self.schema = stable_schema(table.schema)
+        table = table.cast(self.schema)
+        if self.partition_by is None or self.partition_by not in df.columns:
+            self.write_part(None, table)
+            return
+        column = table.schema.get_field_index(self.partition_by)
+        for value in df[self.partition_by].dropna().unique():
+            part = table.filter(pa.array((df[self.partition_by] == value).values))
+            self.write_part(value, part.remove_column(column))
+
+    def write_part(self, value, table):
+        """
+        :param value: partition value, None if not partitioned
+        :param table: pyarrow Table
+        """
+        writer = self.writers.get(value)
+        if writer is None:
+            writer = self.open_writer(self.part_location(value), table.schema)
+            self.writers[value] = writer
+        if self.fmt == 'parquet':
+            writer.write_table(table, row_group_size=self.row_group_size)
+        else:
+            writer.write_table(table, max_chunksize=self.row_group_size)
+
+    def part_location(self, value):
+        """
+        :param value: partition value, None if not partitioned
+        :return: str
+        """
+        if value is None:
+            return self.location
+        name = '{}={}'.format(self.partition_by, value)
+        return os.path.join(self.location, name, 'part-0' + FORMATS[self.fmt])
+
+    def open_writer(self, location, schema):
+        """
+        Open output stream and writer, to be closed (writer first) on exit.
+        :param location: str
+        :param schema: pyarrow Schema
+        :return: pyarrow ParquetWriter or RecordBatchStreamWriter
+        """
+        import pyarrow as pa
+        stream = self.stack.enter_context(persistence.open_output(location))
+        if self.fmt == 'parquet':
+            import pyarrow.parquet as pq
+            writer = pq.ParquetWriter(stream, schema)
+        else:
+            writer = pa.ipc.new_stream(stream, schema)
+        self.stack.callback(writer.close)
+        return writer
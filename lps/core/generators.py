@@ -1,6 +1,5 @@
 from scipy.stats import truncnorm
 import numpy as np
-import random
 from datetime import time
 from shapely.geometry import Point
 
@@ -17,8 +16,13 @@ class UniformDistributionGen:
         else:
             raise NotImplemented('Unknown inputs')
 
-    def sample(self, n=1):
-        return random.choices(self.hours, k=n)
+    def sample(self, rng, n=1):
+        """
+        :param rng: numpy Generator
+        :param n: number of samples to be returned
+        :return: list of integers sampled from distribution
+        """
+        return [self.hours[i] for i in rng.integers(len(self.hours), size=n)]
 
 
 class NormDayDistributionGen:
@@ -29,16 +33,17 @@ class NormDayDistributionGen:
         self.hours = range(low, upp+1)
         self.dist = truncnorm((low - mean) / sd, (upp + 1 - mean) / sd, loc=mean, scale=sd)
 
-    def sample(self, n=None):
+    def sample(self, rng, n=None):
         """
-        Sample hour
+        Sample hour, by inverse transform of uniform samples from the given Generator
+        :param rng: numpy Generator
         :param n: number of samples to be returned
         :return: single integer or list of integers sampled from distribution
         """
         if n:
-            return [int(i) for i in self.dist.rvs(n)]
+            return [int(i) for i in self.dist.ppf(rng.random(n))]
         else:
-            return int(self.dist.rvs())
+            return int(self.dist.ppf(rng.random()))
 
 
 class FrequencyDistribution:
@@ -46,67 +51,139 @@ class FrequencyDistribution:
     Object for initiating and sampling from frequency weighted distributing
     """
     def __init__(self, dist, freq):
-        self.distribution = tuple(dist)
+        self.distribution = dist if isinstance(dist, np.ndarray) else tuple(dist)
         self.frequency = np.array(freq)
+        self.sampler = AliasSampler(self.frequency)
+
+    def sample(self, rng, n=1):
+        """
+        :param rng: numpy Generator
+        :param n: number of samples to be returned
+        :return: list of objects sampled from distribution
+        """
+        return [self.distribution[i] for i in self.sample_index(rng, n)]
+
+    def sample_array(self, rng, n=1):
+        """
+        :param rng: numpy Generator
+        :param n: number of samples to be returned
+        :return: numpy array of samples (distribution must be a numpy array)
+        """
+        return self.distribution[self.sample_index(rng, n)]
 
-    def sample(self, n=1):
+    def sample_index(self, rng, n=1):
         """
+        :param rng: numpy Generator
         :param n: number of samples to be returned
-        :return: single object or list of objects sampled from distribution
+        :return: numpy array of indices into distribution
         """
-        return random.choices(self.distribution, weights=self.frequency, k=n)
+        return self.sampler.sample(rng, n)
 
-    def sample_exclude(self, exclude, patience=10):
+    def sample_exclude(self, exclude, rng, patience=10):
         for attempt in range(patience):
-            provisional = self.sample()
+            provisional = self.sample(rng)
             if exclude not in provisional:
                 return provisional
         raise StopIteration('failed to find valid sample after {} attempts'.format(patience))
 
 
-def gen_minute(hour, steps=1):
+class AliasSampler:
+    """
+    Object for sampling indices from a weighted (categorical) distribution using Walker's alias
+    method. The alias table is built once (with numpy), after which each draw is O(1) regardless
+    of the number of categories.
+    """
+    def __init__(self, weights):
+        weights = np.asarray(weights, dtype=np.float64)
+        self.size = len(weights)
+        total = weights.sum()
+        self.prob = None
+        self.alias = None
+        if not total > 0:  # cannot be sampled from
+            return
+
+        prob = weights * (self.size / total)
+        alias = np.arange(self.size)
+        small = np.flatnonzero(prob < 1)
+        large = np.flatnonzero(prob >= 1)
+
+        # Fill the shortfall of all small bins at once from the surplus of large bins, in order.
+        # A large bin that gives more than its surplus becomes small and is filled in the next pass.
+        while len(small) and len(large):
+            shortfall = 1 - prob[small]
+            starts = np.cumsum(shortfall) - shortfall
+            donors = np.searchsorted(np.cumsum(prob[large] - 1), starts, side='right')
+            donors = np.minimum(donors, len(large) - 1)
+            alias[small] = large[donors]
+            prob[large] -= np.bincount(donors, weights=shortfall, minlength=len(large))
+            small = large[prob[large] < 1]
+            large = large[prob[large] >= 1]
+
+        prob[small] = 1  # remainders are rounding errors
+        prob[large] = 1
+        self.prob = prob
+        self.alias = alias
+
+    def sample(self, rng, n=1):
+        """
+        :param rng: numpy Generator
+        :param n: number of samples to be returned
+        :return: numpy array of indices
+        """
+        if not n:
+            return np.empty(0, dtype=np.int64)
+        if self.prob is None:
+            raise ValueError('cannot sample from distribution without positive weights')
+        index = rng.integers(self.size, size=n)
+        return np.where(rng.random(n) < self.prob[index], index, self.alias[index])
+
+
+def gen_minute(hour, rng, steps=1):
     """
     Return random time in given hour, based on minutes with given number of intervals
     :param hour: hour int
+    :param rng: numpy Generator
     :param steps: minute precision int (default: 5)
     :return: time object (hh:mm:00)
     """
     minutes = np.arange(0, 60, steps)
-    minute = int(random.choice(minutes))
+    minute = int(rng.choice(minutes))
     t = time(hour, minute, 0)
     return t
 
 
-def gen_minutes(hours, steps=1):
+def gen_minutes(hours, rng, steps=1):
     """
     Return random times in given hour, based on minutes with given number of intervals
     :param hours: hour integers in list for
+    :param rng: numpy Generator
     :param steps: minute precision int m(default: 5)
     :param k: number of times to return
     :return: time object (hh:mm:00)
     """
     k = len(hours)
     minutes = np.arange(0, 60, steps)
-    minutes = random.choices(minutes, k=k)
+    minutes = rng.choice(minutes, size=k)
     times = [None] * k
     for t, (hour, minute) in enumerate(zip(hours, minutes)):
-        times[t] = time(hour, minute, 0)
+        times[t] = time(int(hour), int(minute), 0)
     return times
 
 
-def gen_location(o, low=0, upp=500):
+def gen_location(o, rng, low=0, upp=500):
     """
     Generated a Point based on an input point and a given distance range. Distance
     is sampled from uniform distribution between lower and upper bounds. Direction
     is sampled randomly. Note that input bounds should be in appropriate units (m).
     :param o: Point
+    :param rng: numpy Generator
     :param low: int
     :param upp: int
     :return: Point
     """
     distance = np.arange(low, upp, 1)
-    distance = int(random.choice(distance))
-    angle = np.pi * np.random.uniform(0, 2)
+    distance = int(rng.choice(distance))
+    angle = np.pi * rng.uniform(0, 2)
     x = distance * np.cos(angle)
     y = distance * np.sin(angle)
     return Point(o.x + x, o.y + y)
@@ -0,0 +1,150 @@
+import os
+import glob
+import hashlib
+import numpy as np
+import pandas as pd
+
+from utils import persistence
+
+"""
+Cache for demand matrices. Source matrices (in any format) are parsed and filtered once, then
+persisted alongside the source as sparse (COO) numpy arrays of the non-zero cells:
+- o: int32 origin zone ids
+- d: int32 destination zone ids
+- freq: float32 demand
+Caches are keyed on a hash of the source file and a key describing the filter applied, so that
+changes to either are picked up. Caches are uncompressed .npy files, memory-mapped when loaded so
+that columns are copied straight from the page cache into the returned DataFrame.
+"""
+
+CACHE_VERSION = 1
+MATRIX_DTYPE = np.dtype([('o', np.int32), ('d', np.int32), ('freq', np.float32)])
+CACHE_SUFFIXES = ('.demand.npy', '.tmp')  # caches (and partially written caches) of demand
+
+
+def load_matrix(source_path, reader, key=''):
+    """
+    Load demand matrix for given source from cache, or read (and cache) it if missing or out of date.
+    S3 sources are read through the local S3 cache, with matrices cached alongside the cached copy.
+    :param source_path: path of source demand file
+    :param reader: function of source path returning (filtered) DataFrame with columns [o, d, freq]
+    :param key: str identifying the filtering applied by the reader, eg from filter_key
+    :return: Pandas DataFrame [o, d, freq] of non-zero demand cells
+    """
+    source_path = persistence.local_path(source_path)
+    path = cache_path(source_path, key, source_hash(source_path))
+    if os.path.exists(path):
+        try:
+            return from_records(np.load(path, mmap_mode='r'))
+        except (OSError, ValueError):
+            pass
+
+    matrix = to_sparse(reader(source_path))
+    try:
+        save_matrix(matrix, path)
+        remove_stale(source_path, key, path)
+    except OSError:
+        print('\t> unable to save demand cache to {}'.format(path))
+    return matrix
+
+
+def to_sparse(demand):
+    """
+    Drop zero demand cells and convert to compact types.
+    :param demand: Pandas DataFrame with columns [o, d, freq]
+    :return: Pandas DataFrame
+    """
+    demand = demand.loc[demand.freq != 0, ['o', 'd', 'freq']]
+    demand = demand.astype({'o': np.int32, 'd': np.int32, 'freq': np.float32}).reset_index(drop=True)
+    return demand.astype({'freq': np.float64})  # as per cached values
+
+
+def from_records(records):
+    """
+    Copy records into DataFrame columns (records are strided, and pandas consolidates columns of the
+    same type, so cannot be viewed without copying).
+    :param records: numpy structured array of MATRIX_DTYPE
+    :return: Pandas DataFrame (with demand as float64, to avoid loss of precision in totals)
+    """
+    return pd.DataFrame({
+        'o': np.array(records['o']),
+        'd': np.array(records['d']),
+        'freq': np.array(records['freq'], dtype=np.float64),
+    })
+
+
+def save_matrix(matrix, path):
+    """
+    Save matrix as numpy .npy file of MATRIX_DTYPE records, written to a temporary file first so
+    that partially written caches are never read.
+    :param matrix: Pandas DataFrame [o, d, freq]
+    :param path: str
+    :return: None
+    """
+    records = np.empty(len(matrix), dtype=MATRIX_DTYPE)
+    for name in MATRIX_DTYPE.names:
+        records[name] = matrix[name].values
+    temp_path = '{}.{}.tmp'.format(path, os.getpid())  # concurrent builds may write the same cache
+    try:
+        with open(temp_path, 'wb') as file:
+            np.save(file, records)
+        os.replace(temp_path, path)
+    finally:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+
+def remove_stale(source_path, key, current):
+    """
+    Remove caches of previous versions of the given source and key.
+    :param source_path: str
+    :param key: str
+    :param current: path of current cache
+    :return: None
+    """
+    for path in glob.glob(cache_path(source_path, key, '*')):
+        if path != current:
+            try:
+                os.remove(path)
+            except FileNotFoundError:  # removed by a concurrent build
+                pass
+
+
+def cache_path(source_path, key, digest):
+    """
+    Path of cache alongside given source.
+    :param source_path: str
+    :param key: str
+    :param digest: source hash
+    :return: str
+    """
+    root, _ = os.path.splitext(source_path)
+    return '{}.{}.{}.v{}.demand.npy'.format(root, key or 'all', digest, CACHE_VERSION)
+
+
+def source_hash(source_path, block_size=1 << 20):
+    """
+    Hash of source file contents.
+    :param source_path: str
+    :param block_size: int
+    :return: str
+    """
+    digest = hashlib.sha1()
+    with open(source_path, 'rb') as file:
+        for block in iter(lambda: file.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def filter_key(name, *filters):
+    """
+    Key identifying a named filter of given zone ids.
+    :param name: filter name
+    :param filters: sequences of zone ids
+    :return: str
+    """
+    digest = hashlib.sha1()
+    for zone_ids in filters:
+        digest.update(np.sort(np.asarray(zone_ids, dtype=np.int64)).tobytes())
+        digest.update(b'|')
+    return '{}-{}'.format(name, digest.hexdigest()[:8])
@@ -1,11 +1,32 @@
 import os
+import pickle
+import tempfile
+from contextlib import ExitStack
+import numpy as np
 import pandas as pd
 from halo import Halo
 from lxml import etree as et
-from shapely.geometry import Point
-import geopandas as gp
 
 from utils import persistence
+from lps.core.population import Population, format_seconds, minutes_duration, to_numpy
+from lps.core import projections, columnar
+
+
+ACT_COLUMNS = [
+    'source',
+    'uid', 'sequence', 'activity', 'x', 'y',
+    'start_time', 'end_time', 'start_time_mins', 'end_time_mins', 'duration_mins'
+]
+
+LEG_COLUMNS = [
+    'source',
+    'uid', 'sequence', 'mode',
+    'ox', 'oy', 'dx', 'dy',
+    'start_time', 'end_time', 'start_time_mins', 'end_time_mins',
+    'duration_mins', 'distance'
+]
+
+SUMMARY_COLUMNS = ['start_time_mins', 'end_time_mins', 'duration_mins']  # summarised by activity and mode
 
 
 class Tables:
@@ -22,86 +43,104 @@ class Tables:
 
     def build(self, population):
         """
+        Build activity, leg and attribute tables directly from population columns, with categorical
+        source, uid, activity, mode and time columns. As per Plan.activity_report, the final activity
+        of wrapped plans (ending with the same activity and location as they start) is not reported.
         TODO Fix x axis for start and end time plots - record Hour for simplicity?
-
-        :param activity: activity type name
-        :param duration: activity duration
-        :param start: activity start time
-        :param end: activity end time
+        :param population: Population
         :return: None
         """
-        # acts, legs = population.get_size()
-
-        act_columns = [
-            'source',
-            'uid', 'sequence', 'activity', 'x', 'y',
-            'start_time', 'end_time', 'start_time_mins', 'end_time_mins', 'duration_mins'
-        ]
-
-        leg_columns = [
-            'source',
-            'uid', 'sequence', 'mode',
-            'ox', 'oy', 'dx', 'dy',
-            'start_time', 'end_time', 'start_time_mins', 'end_time_mins',
-            'duration_mins', 'distance'
-        ]
-
-        activity_data = []
-        leg_data = []
-        attrib_data = []
-
-        with Halo(text='Building reports...', spinner='dots') as spinner:
-            for p, person in enumerate(population.agents):
-                attribs = person.attributes
-                attribs.update({'uid': person.uid})
-                attrib_data.extend([attribs])
-
-                for plan in person.plans:
-                    activity_data.extend(plan.activity_report())
-                    leg_data.extend(plan.leg_report())
-
-                    spinner.text = '{} plans added to table'.format(p)
-            spinner.succeed('reporting completed')
-
         with Halo(text='Building tables...', spinner='dots') as spinner:
-            self.activity_df = pd.DataFrame(activity_data, columns=act_columns)
-            self.leg_df = pd.DataFrame(leg_data, columns=leg_columns)
-            self.attrib_df = pd.DataFrame.from_dict(attrib_data)
+            plan_agents = np.repeat(np.arange(len(population.uids)), np.diff(population.agent_plans))
+            uids = pd.Categorical(np.array(population.uids, dtype=object))
+            plan_uids = uids.codes[plan_agents]
+            plan_sources = population.plan_sources.to_numpy()
+
+            # activities
+            plan_acts = to_numpy(population.plan_acts)
+            act_plans = np.repeat(np.arange(len(plan_acts) - 1), np.diff(plan_acts))
+            act_x = to_numpy(population.act_x).astype(np.float64)
+            act_y = to_numpy(population.act_y).astype(np.float64)
+            act_types = population.act_types.to_numpy()
+            reported = np.ones(len(act_plans), dtype=bool)
+            first, last = plan_acts[:-1], plan_acts[1:] - 1
+            has_acts = last >= first
+            first, last = first[has_acts], last[has_acts]
+            wrapped = (act_types[first] == act_types[last]) & same_location(
+                act_x[first], act_y[first], act_x[last], act_y[last]
+            )
+            reported[last[wrapped]] = False
+            rows = np.flatnonzero(reported)
+            start = to_numpy(population.act_start)[rows]
+            end = to_numpy(population.act_end)[rows]
+
+            self.activity_df = pd.DataFrame({
+                'source': categorical(plan_sources[act_plans[rows]], population.plan_sources.categories),
+                'uid': pd.Categorical.from_codes(plan_uids[act_plans[rows]], uids.categories),
+                'sequence': to_numpy(population.act_seq)[rows].astype(np.int64),
+                'activity': categorical(act_types[rows], population.act_types.categories),
+                'x': act_x[rows],
+                'y': act_y[rows],
+                'start_time': time_strings(start),
+                'end_time': time_strings(end),
+                'start_time_mins': start.astype(np.int64) // 60,
+                'end_time_mins': end.astype(np.int64) // 60,
+                'duration_mins': minutes_duration(start, end).astype(np.int64),
+            }, columns=ACT_COLUMNS)
+
+            # legs
+            leg_plans = np.repeat(np.arange(len(population.plan_legs) - 1), np.diff(population.plan_legs))
+            start = to_numpy(population.leg_start)
+            end = to_numpy(population.leg_end)
+
+            self.leg_df = pd.DataFrame({
+                'source': categorical(plan_sources[leg_plans], population.plan_sources.categories),
+                'uid': pd.Categorical.from_codes(plan_uids[leg_plans], uids.categories),
+                'sequence': to_numpy(population.leg_seq).astype(np.int64),
+                'mode': categorical(population.leg_modes.to_numpy(), population.leg_modes.categories),
+                'ox': to_numpy(population.leg_ox).astype(np.float64),
+                'oy': to_numpy(population.leg_oy).astype(np.float64),
+                'dx': to_numpy(population.leg_dx).astype(np.float64),
+                'dy': to_numpy(population.leg_dy).astype(np.float64),
+                'start_time': time_strings(start),
+                'end_time': time_strings(end),
+                'start_time_mins': start.astype(np.int64) // 60,
+                'end_time_mins': end.astype(np.int64) // 60,
+                'duration_mins': minutes_duration(start, end).astype(np.int64),
+                'distance': to_numpy(population.leg_dist).astype(np.float64),
+            }, columns=LEG_COLUMNS)
+
+            # attributes
+            attributes = {}
+            for key, values in population.attribute_values.items():
+                lookup = np.empty(len(values.categories) + 1, dtype=object)  # missing (-1) maps to last entry
+                for code, value in enumerate(values.categories):
+                    lookup[code] = value
+                lookup[-1] = np.nan
+                attributes[key] = pd.Series(lookup[values.to_numpy()]).infer_objects()
+            self.attrib_df = pd.DataFrame(attributes, columns=list(attributes))
+            self.attrib_df.index = pd.Index(population.uids, name='uid')
 
             assert len(self.activity_df)
             assert len(self.leg_df)
             assert len(self.attrib_df)
 
-            self.activity_df = self.activity_df.apply(pd.to_numeric, errors='ignore')
-            self.leg_df = self.leg_df.apply(pd.to_numeric, errors='ignore')
-            self.attrib_df = self.attrib_df.set_index('uid')
-
             spinner.succeed('output tables completed')
 
-        # with Halo(text='converting activity locations to WGS84...', spinner='dots') as spinner:
-            # TODO can this be done elsewhere? Currently assuming it's fastest as vector op on final table...
-            locations = list(zip(self.activity_df.x, self.activity_df.y))
-            gdf = gp.GeoDataFrame(geometry=[Point(xy) for xy in locations])
-            gdf.crs = {'init': 'epsg:{}'.format(self.config.EPSG)}
-            gdf = gdf.to_crs({'init': 'epsg:4326'})
-            self.activity_df.x = list(gdf.geometry.apply(lambda p: p.x))
-            self.activity_df.y = list(gdf.geometry.apply(lambda p: p.y))
+        with Halo(text='converting activity locations to WGS84...', spinner='dots') as spinner:
+            self.activity_df.x, self.activity_df.y = projections.transform(
+                self.activity_df.x.values, self.activity_df.y.values, self.config.EPSG
+            )
 
             spinner.text = 'converting leg origins to WGS84...'
-            locations = list(zip(self.leg_df.ox, self.leg_df.oy))
-            gdf = gp.GeoDataFrame(geometry=[Point(xy) for xy in locations])
-            gdf.crs = {'init': 'epsg:{}'.format(self.config.EPSG)}
-            gdf = gdf.to_crs({'init': 'epsg:4326'})
-            self.leg_df.ox = list(gdf.geometry.apply(lambda p: p.x))
-            self.leg_df.oy = list(gdf.geometry.apply(lambda p: p.y))
+            self.leg_df.ox, self.leg_df.oy = projections.transform(
+                self.leg_df.ox.values, self.leg_df.oy.values, self.config.EPSG
+            )
 
             spinner.text = 'converting leg destinations to WGS84...'
-            locations = list(zip(self.leg_df.dx, self.leg_df.dy))
-            gdf = gp.GeoDataFrame(geometry=[Point(xy) for xy in locations])
-            gdf.crs = {'init': 'epsg:{}'.format(self.config.EPSG)}
-            gdf = gdf.to_crs({'init': 'epsg:4326'})
-            self.leg_df.dx = list(gdf.geometry.apply(lambda p: p.x))
-            self.leg_df.dy = list(gdf.geometry.apply(lambda p: p.y))
+            self.leg_df.dx, self.leg_df.dy = projections.transform(
+                self.leg_df.dx.values, self.leg_df.dy.values, self.config.EPSG
+            )
             spinner.succeed('tables converted to WGS84')
 
     def describe(self, prefix):
@@ -111,8 +150,7 @@ class Tables:
         print('\nTotals:')
         print(self.activity_df.describe())
         print('\nGrouped by Activity Type:')
-        summarise(self.activity_df, prefix, 'activity', self.config.OUTPATH,
-                  'start_time_mins', 'end_time_mins', 'duration_mins')
+        summarise(self.activity_df, prefix, 'activity', self.config.OUTPATH, *SUMMARY_COLUMNS)
 
         print('\n=============================================================================')
         print('-------------------------------- Leg Summary --------------------------------')
@@ -120,8 +158,7 @@ class Tables:
         print('\nTotals:')
         print(self.leg_df.describe())
         print('\nGrouped by Mode:')
-        summarise(self.leg_df, prefix, 'mode', self.config.OUTPATH,
-                  'start_time_mins', 'end_time_mins', 'duration_mins')
+        summarise(self.leg_df, prefix, 'mode', self.config.OUTPATH, *SUMMARY_COLUMNS)
 
         print('\n=============================================================================')
         print('----------------------------- Attributes Summary ----------------------------')
@@ -130,9 +167,330 @@ class Tables:
         summarise_cats(self.attrib_df)
 
     def write(self, prefix, act_path='activities.csv', leg_path='legs.csv', attrib_path='attributes.csv'):
-        persistence.write_content(self.activity_df, location=os.path.join(self.config.OUTPATH, prefix + act_path))
-        persistence.write_content(self.leg_df, location=os.path.join(self.config.OUTPATH, prefix + leg_path))
-        persistence.write_content(self.attrib_df, location=os.path.join(self.config.OUTPATH, prefix + attrib_path))
+        """
+        Write tables, in the formats given by config.TABLE_FORMATS (csv, parquet or arrow).
+        :param prefix: output file name prefix
+        :return: None
+        """
+        write_table(self.activity_df, os.path.join(self.config.OUTPATH, prefix + act_path), 'activities', self.config)
+        write_table(self.leg_df, os.path.join(self.config.OUTPATH, prefix + leg_path), 'legs', self.config)
+        write_table(self.attrib_df, os.path.join(self.config.OUTPATH, prefix + attrib_path), 'attributes', self.config)
+
+
+class TablesWriter:
+    """
+    Incremental writer of flat tables of plans (in the formats given by config.TABLE_FORMATS).
+    Tables are built for each population chunk added, so that only a chunk of the tables is held
+    in memory. Activity and leg tables are appended to the outputs as they are built. Attribute
+    columns can differ between chunks (eg between sources), so attribute tables are spooled to a
+    temporary file and written with the union of columns on close. Row indices continue across
+    chunks, so that output matches Tables.write for the whole population. Summaries of the tables
+(see describe) are accumulated as chunks are added. Use as a context manager:
+
+        with TablesWriter(config) as writer:
+            writer.add_population(population)
+    """
+
+    def __init__(self, config, prefix='', act_path='activities.csv', leg_path='legs.csv',
+                 attrib_path='attributes.csv'):
+        self.config = config
+        self.act_location = os.path.join(config.OUTPATH, prefix + act_path)
+        self.leg_location = os.path.join(config.OUTPATH, prefix + leg_path)
+        self.attrib_location = os.path.join(config.OUTPATH, prefix + attrib_path)
+        self.attrib_columns = []
+        self.attrib_chunks = 0
+        self.act_summary = RunningSummary('activity', SUMMARY_COLUMNS)
+        self.leg_summary = RunningSummary('mode', SUMMARY_COLUMNS)
+        self.attrib_counts = {}  # column: value counts
+        self.count = 0
+        self.stack = None
+        self.act_sink = None
+        self.leg_sink = None
+        self.attrib_spool = None
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        self.act_sink = self.stack.enter_context(open_table(self.act_location, 'activities', self.config))
+        self.leg_sink = self.stack.enter_context(open_table(self.leg_location, 'legs', self.config))
+        self.attrib_spool = self.stack.enter_context(tempfile.TemporaryFile())
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        with self.stack:  # close outputs, even if writing attributes fails
+            if exc_type is None:
+                self.write_attributes()
+
+    def add_population(self, population):
+        """
+        Build tables for population, appending activities and legs to the outputs.
+        :param population: Population
+        """
+        if not len(population.uids):
+            return
+        tables = Tables(self.config, population)
+        self.act_summary.add(tables.activity_df)
+        self.leg_summary.add(tables.leg_df)
+        for column in tables.attrib_df.columns:
+            counts = tables.attrib_df[column].value_counts()
+            if column in self.attrib_counts:
+                counts = self.attrib_counts[column].add(counts, fill_value=0)
+            self.attrib_counts[column] = counts
+        self.act_sink.write(tables.activity_df)
+        self.leg_sink.write(tables.leg_df)
+
+        pickle.dump(tables.attrib_df, self.attrib_spool)
+        self.attrib_chunks += 1
+        self.attrib_columns.extend(c for c in tables.attrib_df.columns if c not in self.attrib_columns)
+        self.count += len(population.uids)
+
+    def write_attributes(self):
+        """
+        Write spooled attribute tables, with the union of attribute columns. Attribute types can
+        also differ between chunks, so for columnar formats the spooled chunks are first read to find
+        common column types (as for pd.concat) and the output schema, then each chunk is cast and
+        written in turn.
+        """
+        dtypes = None
+        schema = None
+        if self.config.TABLE_FORMATS['attributes'] != 'csv' and self.attrib_chunks:
+            dtypes = pd.concat([attrib_df.iloc[:0] for attrib_df in self.read_attributes()]).dtypes
+            schema = columnar.union_schema(
+                columnar.to_arrow(attrib_df.astype(dtypes)).schema for attrib_df in self.read_attributes()
+            )
+        with open_table(self.attrib_location, 'attributes', self.config, schema) as sink:
+            for attrib_df in self.read_attributes():
+                if dtypes is not None:
+                    attrib_df = attrib_df.astype(dtypes)
+                sink.write(attrib_df)
+
+    def read_attributes(self):
+        """
+        :return: generator of spooled attribute tables, with the union of attribute columns
+        """
+        self.attrib_spool.seek(0)
+        for _ in range(self.attrib_chunks):
+            yield pickle.load(self.attrib_spool).reindex(columns=self.attrib_columns)
+
+    def describe(self, prefix):
+        """
+        Print and write summaries of the tables written, as per Tables.describe. Summaries are
+        accumulated chunk by chunk, so quartiles are not reported.
+        :param prefix: output file name prefix
+        """
+        print('\n==============================================================================')
+        print('------------------------------ Activity Summary ------------------------------')
+        print('==============================================================================')
+        print('\nTotals:')
+        print(self.act_summary.totals())
+        print('\nGrouped by Activity Type:')
+        self.act_summary.write(prefix, self.config.OUTPATH)
+
+        print('\n=============================================================================')
+        print('-------------------------------- Leg Summary --------------------------------')
+        print('=============================================================================')
+        print('\nTotals:')
+        print(self.leg_summary.totals())
+        print('\nGrouped by Mode:')
+        self.leg_summary.write(prefix, self.config.OUTPATH)
+
+        print('\n=============================================================================')
+        print('----------------------------- Attributes Summary ----------------------------')
+        print('=============================================================================')
+        print('\nTotals:')
+        for column in self.attrib_columns:
+            print('\n{}:'.format(column))
+            print(self.attrib_counts[column].astype(np.int64).sort_values(ascending=False))
+
+
+class RunningSummary:
+    """
+    Summary statistics (count, mean, std, min and max) of table columns grouped by a column,
+    accumulated from chunks of the table so that the whole table is never held in memory.
+    """
+
+    def __init__(self, by, columns):
+        """
+        :param by: column to group by, eg activity
+        :param columns: list of numeric columns to summarise
+        """
+        self.by = by
+        self.columns = list(columns)
+        self.parts = []  # moments of each chunk, by group
+
+    def add(self, df):
+        """
+        :param df: Pandas DataFrame chunk of table
+        """
+        values = df.loc[:, self.columns].astype(np.float64)
+        keys = df[self.by].astype(object).values
+        grouped = values.groupby(keys)
+        self.parts.append(pd.concat({
+            'count': grouped.count(),
+            'sum': grouped.sum(),
+            'sumsq': (values ** 2).groupby(keys).sum(),
+            'min': grouped.min(),
+            'max': grouped.max(),
+        }, axis=1))
+
+    def moments(self):
+        """
+        :return: Pandas DataFrame of (statistic, column) moments by group
+        """
+        if not self.parts:
+            return pd.DataFrame(columns=pd.MultiIndex.from_product([['count', 'sum', 'sumsq', 'min', 'max'], self.columns]))
+        parts = pd.concat(self.parts)
+        moments = pd.concat({
+            'count': parts['count'].groupby(level=0).sum(),
+            'sum': parts['sum'].groupby(level=0).sum(),
+            'sumsq': parts['sumsq'].groupby(level=0).sum(),
+            'min': parts['min'].groupby(level=0).min(),
+            'max': parts['max'].groupby(level=0).max(),
+        }, axis=1)
+        moments.index.name = self.by
+        return moments
+
+    def describe(self, moments):
+        """
+        :param moments: Pandas DataFrame of (statistic, column) moments
+        :return: Pandas DataFrame of (column, statistic) summaries, as per DataFrame.describe
+        """
+        count = moments['count'].astype(np.float64)
+        mean = moments['sum'] / count
+        variance = (moments['sumsq'] - moments['sum'] * mean) / (count - 1)
+        std = np.sqrt(variance.clip(lower=0)).where(count > 1)
+        summary = pd.concat(
+            {'count': count, 'mean': mean, 'std': std, 'min': moments['min'], 'max': moments['max']}, axis=1
+        )
+        return summary.swaplevel(axis=1).loc[:, self.columns]
+
+    def totals(self):
+        """
+        :return: Pandas DataFrame of summary statistics (rows) of each column, for all groups
+        """
+        moments = self.moments()
+        totals = pd.concat({
+            'count': moments['count'].sum(),
+            'sum': moments['sum'].sum(),
+            'sumsq': moments['sumsq'].sum(),
+            'min': moments['min'].min(),
+            'max': moments['max'].max(),
+        })
+        return self.describe(pd.DataFrame([totals])).iloc[0].unstack().T
+
+    def write(self, prefix, path):
+        """
+        Write and print grouped summaries, as per summarise.
+        :param prefix: output file name prefix
+        :param path: output directory
+        """
+        df = self.describe(self.moments())
+        persistence.write_content(df, os.path.join(path, prefix + self.by + '_summary.csv'))
+        for column in self.columns:
+            print('\n{}:'.format(column))
+            print(df.loc[:, column])
+
+
+class CsvSink:
+    """
+    Incremental csv table writer, with the header written once and row indices continuing
+    across DataFrames written (unless named, eg attributes uid).
+    """
+
+    def __init__(self, location):
+        self.location = location
+        self.stack = None
+        self.stream = None
+        self.header = True
+        self.rows = 0
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        self.stream = self.stack.enter_context(persistence.open_output(self.location))
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.stack.__exit__(exc_type, exc_value, traceback)
+
+    def write(self, df):
+        """
+        Append DataFrame to output.
+        :param df: Pandas DataFrame
+        """
+        if df.index.name is None:
+            df.index += self.rows
+        self.stream.write(df.to_csv(header=self.header).encode())
+        self.header = False
+        self.rows += len(df)
+
+
+def open_table(location, table, config, schema=None):
+    """
+    Open incremental table writer, for format of table given by config.TABLE_FORMATS. Columnar
+    tables can be partitioned by source (config.PARTITION).
+    :param location: local or S3 csv path, extension is replaced for other formats
+    :param table: table name, one of activities, legs or attributes
+    :param config: GlobalConfig
+    :param schema: optional pyarrow Schema for columnar tables
+    :return: CsvSink or columnar.TableSink
+    """
+    fmt = config.TABLE_FORMATS[table]
+    if fmt == 'csv':
+        return CsvSink(location)
+    return columnar.TableSink(
+        columnar.table_location(location, fmt),
+        fmt,
+        partition_by='source' if config.PARTITION else None,
+        row_group_size=config.ROW_GROUP_SIZE,
+        schema=schema,
+    )
+
+
+def write_table(df, location, table, config):
+    """
+    Write table, for format of table given by config.TABLE_FORMATS.
+    :param df: Pandas DataFrame
+    :param location: local or S3 csv path, extension is replaced for other formats
+    :param table: table name, one of activities, legs or attributes
+    :param config: GlobalConfig
+    :return: None
+    """
+    if config.TABLE_FORMATS[table] == 'csv':
+        persistence.write_content(df, location=location)
+        return
+    with open_table(location, table, config) as sink:
+        sink.write(df)
+
+
+def categorical(codes, categories):
+    """
+    Build pandas categorical from codes, with only the categories used, in sorted order (so that
+    grouping is as for object columns).
+    :param codes: numpy array of codes (-1 for missing)
+    :param categories: list of unique values
+    :return: pandas Categorical
+    """
+    values = pd.Categorical.from_codes(codes, categories).remove_unused_categories()
+    return values.reorder_categories(sorted(values.categories))
+
+
+def time_strings(seconds):
+    """
+    Format seconds since midnight as categorical hh:mm:ss strings, formatting each unique time once.
+    :param seconds: numpy array
+    :return: pandas Categorical
+    """
+    unique, codes = np.unique(seconds, return_inverse=True)
+    return pd.Categorical.from_codes(codes.ravel(), [format_seconds(int(value)) for value in unique])
+
+
+def same_location(x1, y1, x2, y2):
+    """
+    Element wise location equality, treating missing (nan) locations as equal (as for missing points).
+    :return: numpy bool array
+    """
+    missing1 = np.isnan(x1)
+    missing2 = np.isnan(x2)
+    return ((x1 == x2) & (y1 == y2)) | (missing1 & missing2)
 
 
 def summarise(df, prefix, by, path, *cols):
@@ -150,61 +508,185 @@ def summarise_cats(df):
         print(df.loc[:, col].value_counts())
 
 
-def write_xml_plans(population, config):
-    population_xml = et.Element('population')
+class XMLWriter:
+    """
+    Base for incremental MATSim xml writers. Elements are streamed to the output location as they
+    are added (using lxml's incremental xmlfile), so the full xml tree is never held in memory.
+    Use as a context manager:
 
-    # Add some useful comments
-    population_xml.append(et.Comment('Input Records:'))
-    for source, logs in population.records.items():
-        population_xml.append(et.Comment(">>>>>>>>>>>Source: {}".format(source)))
-        for log, value in logs.items():
-            population_xml.append(et.Comment("{}: {}".format(log, value)))
+        with PlansWriter(path, records) as writer:
+            writer.add_agents(agents)
+    """
+
+    root = None
+    matsim_DOCTYPE = None
+    matsim_filename = None
+
+    def __init__(self, location, records=None, compresslevel=9, threads=1):
+        """
+        :param location: local or S3 path, gzip compressed if ending .gz
+        :param records: dict of source records, written as comments
+        :param compresslevel: gzip compression level
+        :param threads: number of gzip compression threads
+        """
+        self.location = location
+        self.records = records or {}
+        self.compresslevel = compresslevel
+        self.threads = threads
+        self.count = 0
+        self.stack = None
+        self.xf = None
+
+    def __enter__(self):
+        self.stack = ExitStack()
+        stream = self.stack.enter_context(persistence.open_output(self.location, self.compresslevel, self.threads))
+        self.xf = self.stack.enter_context(et.xmlfile(stream, encoding='UTF-8'))
+        self.xf.write_declaration()
+        self.xf.write_doctype('<!DOCTYPE {} SYSTEM "http://matsim.org/files/dtd/{}.dtd">'.format(
+            self.matsim_DOCTYPE, self.matsim_filename))
+        self.stack.enter_context(self.xf.element(self.root))
+        self.xf.write('\n')
+        self.write_records(self.records)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        return self.stack.__exit__(exc_type, exc_value, traceback)
+
+    def write_records(self, records):
+        """
+        Add some useful comments
+        :param records: dict of source records
+        """
+        self.xf.write(et.Comment('Input Records:'), '\n')
+        for source, logs in records.items():
+            self.xf.write(et.Comment(">>>>>>>>>>>Source: {}".format(source)), '\n')
+            for log, value in logs.items():
+                self.xf.write(et.Comment("{}: {}".format(log, value)), '\n')
 
-    with Halo(text='Building plans xml...', spinner='dots') as spinner:
-        for p, person in enumerate(population.agents):
-            person_xml = et.SubElement(population_xml, 'person', {'id': person.uid})
-            for plan in person.plans:
+    def write(self, element):
+        self.xf.write(element, pretty_print=True)
+        self.count += 1
+
+    def add_agents(self, agents):
+        for agent in agents:
+            self.add_agent(agent)
+
+    def add_agent(self, agent):
+        raise NotImplementedError
+
+
+class PlansWriter(XMLWriter):
+    """
+    Incremental MATSim population (plans) xml writer
+    """
+
+    root = 'population'
+    matsim_DOCTYPE = 'population'
+    matsim_filename = 'population_v5'
+
+    def add_agent(self, agent):
+        person_xml = et.Element('person', {'id': agent.uid})
+        for plan in agent.plans:
+            plan_xml = et.SubElement(person_xml, 'plan', {'selected': 'yes'})
+            for l in range(len(plan.legs)):
+                activity = plan.activities[l]
+                et.SubElement(plan_xml, 'act', {'type': activity.act,
+                                                'x': str(int(activity.point.x)),
+                                                'y': str(int(activity.point.y)),
+                                                'end_time': activity.end_time})
+                leg = plan.legs[l]
+                et.SubElement(plan_xml, 'leg', {'mode': leg.mode})
+            activity = plan.activities[-1]  # Deal with final activity
+            et.SubElement(plan_xml, 'act', {'type': activity.act,
+                                            'x': str(int(activity.point.x)),
+                                            'y': str(int(activity.point.y))})
+        self.write(person_xml)
+
+    def add_population(self, population):
+        """
+        Add all agents of a Population, reading directly from its columns (no Agent views are built).
+        :param population: Population
+        """
+        act_types = population.act_types
+        leg_modes = population.leg_modes
+        for index, uid in enumerate(population.uids):
+            person_xml = et.Element('person', {'id': uid})
+            for p in range(population.agent_plans[index], population.agent_plans[index + 1]):
                 plan_xml = et.SubElement(person_xml, 'plan', {'selected': 'yes'})
-                for l in range(len(plan.legs)):
-                    activity = plan.activities[l]
-                    activity_xml = et.SubElement(plan_xml, 'act', {'type': activity.act,
-                                                                   'x': str(int(activity.point.x)),
-                                                                   'y': str(int(activity.point.y)),
-                                                                   'end_time': activity.end_time})
-                    leg = plan.legs[l]
-                    leg_xml = et.SubElement(plan_xml, 'leg', {'mode': leg.mode})
-                activity = plan.activities[-1]  # Deal with final activity
-                activity_xml = et.SubElement(plan_xml, 'act', {'type': activity.act,
-                                                               'x': str(int(activity.point.x)),
-                                                               'y': str(int(activity.point.y))})
-            spinner.text = '{} plans added to xml'.format(p)
-        spinner.succeed('plans added to xml')
-
-    persistence.write_content(population_xml, location=config.XMLPATH, matsim_DOCTYPE='population',
-                              matsim_filename='population_v5')
+                first_act = population.plan_acts[p]
+                first_leg = population.plan_legs[p]
+                for l in range(population.plan_legs[p + 1] - first_leg):
+                    a = first_act + l
+                    et.SubElement(plan_xml, 'act', {'type': act_types[a],
+                                                    'x': str(int(population.act_x[a])),
+                                                    'y': str(int(population.act_y[a])),
+                                                    'end_time': format_seconds(population.act_end[a])})
+                    et.SubElement(plan_xml, 'leg', {'mode': leg_modes[first_leg + l]})
+                a = population.plan_acts[p + 1] - 1  # Deal with final activity
+                et.SubElement(plan_xml, 'act', {'type': act_types[a],
+                                                'x': str(int(population.act_x[a])),
+                                                'y': str(int(population.act_y[a]))})
+            self.write(person_xml)
+
+
+class AttributesWriter(XMLWriter):
+    """
+    Incremental MATSim object attributes xml writer
+    """
+
+    root = 'objectAttributes'
+    matsim_DOCTYPE = 'objectAttributes'
+    matsim_filename = 'objectattributes_v1'
+
+    def add_agent(self, agent):
+        self.add_attributes(agent.uid, agent.attributes)
+
+    def add_attributes(self, uid, attributes):
+        person_e = et.Element('object', {'id': uid})
+        for k, v in attributes.items():
+            attribute_e = et.SubElement(person_e, 'attribute', {'class': 'java.lang.String', 'name': k})
+            attribute_e.text = v
+        self.write(person_e)
+
+    def add_population(self, population):
+        """
+        Add attributes of all agents of a Population, reading directly from its columns.
+        :param population: Population
+        """
+        values = population.attribute_values
+        for index, uid in enumerate(population.uids):
+            keys = population.attribute_keys[index]
+            self.add_attributes(uid, {key: values[key][index] for key in keys})
+
+
+def write_xml_plans(population, config):
+    with Halo(text='Writing plans xml...', spinner='dots') as spinner:
+        with PlansWriter(config.XMLPATH, population.records, config.GZIP_LEVEL, config.GZIP_THREADS) as writer:
+            write_population(writer, population, spinner, 'plans')
+        spinner.succeed('{} plans written to {}'.format(writer.count, config.XMLPATH))
 
 
 def write_xml_attributes(population, config):
-    with Halo(text='Building attributes xml...', spinner='dots') as spinner:
-        attributes_xml = et.Element('objectAttributes')  # start forming xml
+    with Halo(text='Writing attributes xml...', spinner='dots') as spinner:
+        with AttributesWriter(config.XMLPATHATTRIBS, population.records,
+                              config.GZIP_LEVEL, config.GZIP_THREADS) as writer:
+            write_population(writer, population, spinner, 'people')
+        spinner.succeed('{} attributes written to {}'.format(writer.count, config.XMLPATHATTRIBS))
 
-        # Add some useful comments
-        attributes_xml.append(et.Comment('Input Records:'))
-        for source, logs in population.records.items():
-            attributes_xml.append(et.Comment(">>>>>>>>>>>Source: {}".format(source)))
-            for log, value in logs.items():
-                attributes_xml.append(et.Comment("{}: {}".format(log, value)))
-
-        for p, person in enumerate(population.agents):
-            person_e = et.SubElement(attributes_xml, 'object', {'id': person.uid})
-            for k, v in person.attributes.items():
-                attribute_e = et.SubElement(person_e, 'attribute', {'class': 'java.lang.String', 'name': k})
-                attribute_e.text = v
-            spinner.text = '{} people added to attributes xml'.format(p)
-        spinner.succeed('attributes added to xml')
-
-    persistence.write_content(attributes_xml, location=config.XMLPATHATTRIBS, matsim_DOCTYPE='objectAttributes',
-                              matsim_filename='objectattributes_v1')
+
+def write_population(writer, population, spinner, name):
+    """
+    Stream population to given writer, using population columns where available.
+    :param writer: XMLWriter
+    :param population: Population
+    :param spinner: Halo spinner
+    :param name: name of written objects for spinner text
+    """
+    spinner.text = 'writing {} {} to xml...'.format(population.get_size()[0], name)
+    if isinstance(population, Population):
+        writer.add_population(population)
+    else:
+        writer.add_agents(population.agents)
 
 
 def dict_to_row(dict, columns):
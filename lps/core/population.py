@@ -1,6 +1,7 @@
-
+import array
+import numpy as np
 from datetime import datetime as dt
-from lps.core import output
+from shapely.geometry import Point
 
 """
 Classes for holding Plan Information:
@@ -9,13 +10,64 @@ Classes for holding Plan Information:
         - Plan * n
             - Activity * n
             - Leg * n
+
+Population stores plans as columns (struct of arrays) rather than as a graph of objects:
+- agents: uid, attribute keys and values (categorical codes), offsets into plans
+- plans: source (categorical code), offsets into activities and legs
+- activities: sequence, type (categorical code), x, y (float32), start and end times (int32 seconds)
+- legs: sequence, mode (categorical code), origin and destination x, y (float32),
+  start and end times (int32 seconds), distance (float32)
+Agent, Plan, Activity and Leg objects are available as lazy (read only) views via Population.agents.
 """
 
+MISSING = -1
+POPULATION_VERSION = 1
+
+ARRAY_COLUMNS = [
+    'agent_plans', 'plan_acts', 'plan_legs',
+    'act_seq', 'act_x', 'act_y', 'act_start', 'act_end',
+    'leg_seq', 'leg_ox', 'leg_oy', 'leg_dx', 'leg_dy', 'leg_start', 'leg_end', 'leg_dist',
+]
+CATEGORY_COLUMNS = [  # (archive name, attribute)
+    ('attribute_keys', 'attribute_keys'),
+    ('plan_sources', 'plan_sources'),
+    ('act_types', 'act_types'),
+    ('leg_modes', 'leg_modes'),
+]
+
 
 class Population:
     def __init__(self):
 
-        self.agents = []
+        # agents
+        self.uids = []
+        self.agent_plans = array.array('q', [0])  # offsets into plans
+        self.attribute_keys = Categories()  # tuple of attribute names for each agent
+        self.attribute_values = {}  # attribute name: Categories (int32 codes)
+
+        # plans
+        self.plan_sources = Categories()
+        self.plan_acts = array.array('q', [0])  # offsets into activities
+        self.plan_legs = array.array('q', [0])  # offsets into legs
+
+        # activities
+        self.act_seq = array.array('i')
+        self.act_types = Categories()
+        self.act_x = array.array('f')
+        self.act_y = array.array('f')
+        self.act_start = array.array('i')
+        self.act_end = array.array('i')
+
+        # legs
+        self.leg_seq = array.array('i')
+        self.leg_modes = Categories()
+        self.leg_ox = array.array('f')
+        self.leg_oy = array.array('f')
+        self.leg_dx = array.array('f')
+        self.leg_dy = array.array('f')
+        self.leg_start = array.array('i')
+        self.leg_end = array.array('i')
+        self.leg_dist = array.array('f')
 
         self.num_people = None
         self.acts = None
@@ -23,27 +75,303 @@ class Population:
 
         self.records = {}
 
+    @property
+    def agents(self):
+        return Agents(self)
+
+    def add_agent(self, agent):
+        """
+        Add Agent object to population columns.
+        :param agent: Agent
+        :return: None
+        """
+        self.uids.append(agent.uid)
+        attributes = agent.attributes or {}
+        self.attribute_keys.append(tuple(attributes.keys()))
+        for key in attributes:
+            if key not in self.attribute_values:
+                self.attribute_values[key] = Categories.missing(len(self.uids) - 1, 'i')
+        for key, values in self.attribute_values.items():
+            if key in attributes:
+                values.append(attributes[key])
+            else:
+                values.codes.append(MISSING)
+
+        for plan in agent.plans:
+            self.plan_sources.append(plan.source)
+            for act in plan.activities:
+                self.act_seq.append(act.sequence)
+                self.act_types.append(act.act)
+                x, y = point_xy(act.point)
+                self.act_x.append(x)
+                self.act_y.append(y)
+                self.act_start.append(act.start_seconds)
+                self.act_end.append(act.end_seconds)
+            for leg in plan.legs:
+                self.leg_seq.append(leg.sequence)
+                self.leg_modes.append(leg.mode)
+                ox, oy = point_xy(leg.start_loc)
+                dx, dy = point_xy(leg.end_loc)
+                self.leg_ox.append(ox)
+                self.leg_oy.append(oy)
+                self.leg_dx.append(dx)
+                self.leg_dy.append(dy)
+                self.leg_start.append(leg.start_seconds)
+                self.leg_end.append(leg.end_seconds)
+                self.leg_dist.append(np.nan if leg.dist is None else leg.dist)
+            self.plan_acts.append(len(self.act_seq))
+            self.plan_legs.append(len(self.leg_seq))
+        self.agent_plans.append(len(self.plan_sources))
+
+    def add_plans(self, uids, attributes, source, act_counts, acts, leg_counts, legs):
+        """
+        Bulk add agents, each with a single plan, from columns. Categorical values may be given as
+        a single value for all rows.
+        :param uids: sequence of agent uids
+        :param attributes: dict of attribute name: value or sequence of values (one per agent)
+        :param source: plan source, or sequence of sources (one per agent)
+        :param act_counts: sequence of number of activities in each plan
+        :param acts: dict of activity columns (seq, act, x, y, start, end)
+        :param leg_counts: sequence of number of legs in each plan
+        :param legs: dict of leg columns (seq, mode, ox, oy, dx, dy, start, end, dist)
+        :return: None
+        """
+        num_agents = len(self.uids)
+        n = len(uids)
+        self.uids.extend(uids)
+        extend_array(self.agent_plans, self.agent_plans[-1] + np.arange(1, n + 1))
+        self.attribute_keys.repeat(tuple(attributes.keys()), n)
+        for key, values in self.attribute_values.items():
+            if key not in attributes:
+                values.codes.extend(array.array(values.codes.typecode, [MISSING]) * n)
+        for key, values in attributes.items():
+            if key not in self.attribute_values:
+                self.attribute_values[key] = Categories.missing(num_agents, 'i')
+            self.attribute_values[key].extend_values(values, n)
+
+        self.plan_sources.extend_values(source, n)
+        extend_array(self.plan_acts, self.plan_acts[-1] + np.cumsum(act_counts))
+        extend_array(self.plan_legs, self.plan_legs[-1] + np.cumsum(leg_counts))
+
+        extend_array(self.act_seq, acts['seq'])
+        self.act_types.extend_values(acts['act'], len(acts['seq']))
+        extend_array(self.act_x, acts['x'])
+        extend_array(self.act_y, acts['y'])
+        extend_array(self.act_start, acts['start'])
+        extend_array(self.act_end, acts['end'])
+
+        extend_array(self.leg_seq, legs['seq'])
+        self.leg_modes.extend_values(legs['mode'], len(legs['seq']))
+        extend_array(self.leg_ox, legs['ox'])
+        extend_array(self.leg_oy, legs['oy'])
+        extend_array(self.leg_dx, legs['dx'])
+        extend_array(self.leg_dy, legs['dy'])
+        extend_array(self.leg_start, legs['start'])
+        extend_array(self.leg_end, legs['end'])
+        extend_array(self.leg_dist, legs['dist'])
+
     def build_sub_categories(self):
-        for person in self.agents:
-            person.build_sub_categories()
+        """
+        Break down work and home activities into sub categories based on durations, applied
+        to all plans at once.
+        """
+        act_types = self.act_types.to_numpy()
+        durations = minutes_duration(self.act_start, self.act_end)
+        plan_index = np.repeat(np.arange(len(self.plan_sources)), np.diff(self.plan_acts))
+
+        # work
+        work_code = self.act_types.lookup.get('work')
+        if work_code is not None:
+            work = np.flatnonzero(act_types == work_code)
+            work_plans = plan_index[work]
+            plans, first, counts = np.unique(work_plans, return_index=True, return_counts=True)
+            totals = np.add.reduceat(durations[work], first) if len(work) else np.empty(0)
+            first_start = to_numpy(self.act_start)[work[first]] // 60
+            second_end = np.full(len(plans), 24 * 60)
+            paired = counts == 2
+            second_end[paired] = to_numpy(self.act_end)[work[first[paired] + 1]] // 60
+
+            day_shift = (totals > (7 * 60)) & ((6.5 * 60) < first_start) & (first_start < (11.5 * 60))
+            single = day_shift & (counts == 1)
+            split = day_shift & paired & (second_end < (20 * 60))
+
+            categories = np.where(
+                durations[work] > (7 * 60),
+                self.act_types.encode('work_7_p'),
+                np.where(
+                    durations[work] > (3 * 60),
+                    self.act_types.encode('work_3_7'),
+                    self.act_types.encode('work_0_3')
+                )
+            )
+            plan_single = np.repeat(single, counts)
+            plan_split = np.repeat(split, counts)
+            rank = np.arange(len(work)) - np.repeat(first, counts)
+            categories[plan_single] = self.act_types.encode('work_9to5')
+            categories[plan_split & (rank == 0)] = self.act_types.encode('work_9to5am')
+            categories[plan_split & (rank == 1)] = self.act_types.encode('work_9to5pm')
+            act_types[work] = categories
+
+        # home
+        home_code = self.act_types.lookup.get('home')
+        if home_code is not None:
+            home = act_types == home_code
+            act_types[home & (durations > (8 * 60))] = self.act_types.encode('home_8_p')
+            act_types[home & (durations <= (8 * 60))] = self.act_types.encode('home_0_8')
+
+        self.act_types.codes = array.array(self.act_types.codes.typecode, act_types.tobytes())
 
     def add_agents(self, other):
-        self.agents.extend(other.agents)
+        """
+        Add agents (and records) from other population.
+        :param other: Population
+        :return: None
+        """
+        if isinstance(other, Population):
+            self.extend_columns(other)
+        else:
+            for agent in other.agents:
+                self.add_agent(agent)
         self.records.update(other.records)
 
+    def extend_columns(self, other):
+        """
+        Append columns of other population.
+        :param other: Population
+        :return: None
+        """
+        num_agents = len(self.uids)
+        self.uids.extend(other.uids)
+        self.agent_plans.extend(shift(other.agent_plans, self.agent_plans[-1]))
+        self.attribute_keys.extend_categories(other.attribute_keys)
+        for key, values in self.attribute_values.items():
+            if key not in other.attribute_values:
+                values.codes.extend(array.array(values.codes.typecode, [MISSING]) * len(other.uids))
+        for key, values in other.attribute_values.items():
+            if key not in self.attribute_values:
+                self.attribute_values[key] = Categories.missing(num_agents, 'i')
+            self.attribute_values[key].extend_categories(values)
+
+        self.plan_sources.extend_categories(other.plan_sources)
+        self.plan_acts.extend(shift(other.plan_acts, self.plan_acts[-1]))
+        self.plan_legs.extend(shift(other.plan_legs, self.plan_legs[-1]))
+
+        self.act_seq.extend(other.act_seq)
+        self.act_types.extend_categories(other.act_types)
+        self.act_x.extend(other.act_x)
+        self.act_y.extend(other.act_y)
+        self.act_start.extend(other.act_start)
+        self.act_end.extend(other.act_end)
+
+        self.leg_seq.extend(other.leg_seq)
+        self.leg_modes.extend_categories(other.leg_modes)
+        self.leg_ox.extend(other.leg_ox)
+        self.leg_oy.extend(other.leg_oy)
+        self.leg_dx.extend(other.leg_dx)
+        self.leg_dy.extend(other.leg_dy)
+        self.leg_start.extend(other.leg_start)
+        self.leg_end.extend(other.leg_end)
+        self.leg_dist.extend(other.leg_dist)
+
+    def slice(self, start, stop):
+        """
+        Copy agents in given index range into a new population.
+        :param start: int
+        :param stop: int
+        :return: Population
+        """
+        stop = min(stop, len(self.uids))
+        first_plan, last_plan = self.agent_plans[start], self.agent_plans[stop]
+        first_act, last_act = self.plan_acts[first_plan], self.plan_acts[last_plan]
+        first_leg, last_leg = self.plan_legs[first_plan], self.plan_legs[last_plan]
+
+        other = Population()
+        other.uids = self.uids[start:stop]
+        other.agent_plans = rebase(self.agent_plans[start:stop + 1])
+        other.attribute_keys = self.attribute_keys.slice(start, stop)
+        other.attribute_values = {key: values.slice(start, stop) for key, values in self.attribute_values.items()}
+
+        other.plan_sources = self.plan_sources.slice(first_plan, last_plan)
+        other.plan_acts = rebase(self.plan_acts[first_plan:last_plan + 1])
+        other.plan_legs = rebase(self.plan_legs[first_plan:last_plan + 1])
+
+        other.act_seq = self.act_seq[first_act:last_act]
+        other.act_types = self.act_types.slice(first_act, last_act)
+        other.act_x = self.act_x[first_act:last_act]
+        other.act_y = self.act_y[first_act:last_act]
+        other.act_start = self.act_start[first_act:last_act]
+        other.act_end = self.act_end[first_act:last_act]
+
+        other.leg_seq = self.leg_seq[first_leg:last_leg]
+        other.leg_modes = self.leg_modes.slice(first_leg, last_leg)
+        other.leg_ox = self.leg_ox[first_leg:last_leg]
+        other.leg_oy = self.leg_oy[first_leg:last_leg]
+        other.leg_dx = self.leg_dx[first_leg:last_leg]
+        other.leg_dy = self.leg_dy[first_leg:last_leg]
+        other.leg_start = self.leg_start[first_leg:last_leg]
+        other.leg_end = self.leg_end[first_leg:last_leg]
+        other.leg_dist = self.leg_dist[first_leg:last_leg]
+
+        other.records = dict(self.records)
+        return other
+
+    def chunks(self, size):
+        """
+        Generate populations of (at most) size agents, in agent order.
+        :param size: int
+        :return: generator of Population
+        """
+        for start in range(0, len(self.uids), size):
+            yield self.slice(start, start + size)
+
     def get_size(self):
-        num_people = 0
-        acts = 0
-        legs = 0
-        for person in self.agents:
-            num_people += 1
-            for plan in person.plans:
-                acts += len(plan.activities)
-                legs += len(plan.legs)
-        self.num_people = num_people
-        self.acts = acts
-        self.legs = legs
-        return num_people, acts, legs
+        self.num_people = len(self.uids)
+        self.acts = len(self.act_seq)
+        self.legs = len(self.leg_seq)
+        return self.num_people, self.acts, self.legs
+
+    def get_agent(self, index):
+        """
+        Build Agent view of agent at given index.
+        :param index: int
+        :return: Agent
+        """
+        uid = self.uids[index]
+        attributes = {key: self.attribute_values[key][index] for key in self.attribute_keys[index]}
+        plans = [self.get_plan(uid, p) for p in range(self.agent_plans[index], self.agent_plans[index + 1])]
+        return Agent(uid, plans, attributes)
+
+    def get_plan(self, uid, index):
+        """
+        Build Plan view of plan at given index.
+        :param uid: agent uid
+        :param index: int
+        :return: Plan
+        """
+        activities = []
+        for i in range(self.plan_acts[index], self.plan_acts[index + 1]):
+            activities.append(Activity(
+                uid,
+                self.act_seq[i],
+                self.act_types[i],
+                make_point(self.act_x[i], self.act_y[i]),
+                self.act_start[i],
+                self.act_end[i]
+            ))
+        legs = []
+        for i in range(self.plan_legs[index], self.plan_legs[index + 1]):
+            dist = self.leg_dist[i]
+            legs.append(Leg(
+                uid,
+                self.leg_seq[i],
+                self.leg_modes[i],
+                make_point(self.leg_ox[i], self.leg_oy[i]),
+                make_point(self.leg_dx[i], self.leg_dy[i]),
+                self.leg_start[i],
+                self.leg_end[i],
+                None if np.isnan(dist) else dist
+            ))
+        return Plan(activities, legs, self.plan_sources[index])
 
     def make_records(self, config):
         self.get_size()
@@ -72,7 +400,55 @@ class Population:
         return records
 
     def xml(self, path):
-        output.write_xml(self, path)
+        from lps.core.output import PlansWriter  # output depends on population
+        with PlansWriter(path, self.records) as writer:
+            writer.add_population(self)
+
+    def save(self, path):
+        """
+        Persist population columns to given path as numpy npz archive. Categorical columns are
+        saved as codes, with their categories (and the records) as object arrays.
+        :param path: str
+        :return: None
+        """
+        columns = {'version': POPULATION_VERSION, 'uids': to_objects(self.uids), 'records': to_objects([self.records])}
+        for name in ARRAY_COLUMNS:
+            columns[name] = to_numpy(getattr(self, name))
+        categorical = [(name, getattr(self, column)) for name, column in CATEGORY_COLUMNS]
+        for i, values in enumerate(self.attribute_values.values()):
+            categorical.append(('attribute_values.{}'.format(i), values))
+        columns['attribute_names'] = to_objects(list(self.attribute_values))
+        for name, column in categorical:
+            columns[name + '.codes'] = column.to_numpy()
+            columns[name + '.categories'] = to_objects(column.categories)
+        np.savez(path, **columns)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load population from numpy npz archive, as written by save.
+        :param path: str
+        :return: Population
+        """
+        population = cls()
+        with np.load(path, allow_pickle=True) as archive:
+            if int(archive['version']) != POPULATION_VERSION:
+                raise ValueError('population version {} not supported'.format(int(archive['version'])))
+            population.uids = archive['uids'].tolist()
+            population.records = archive['records'][0]
+            for name in ARRAY_COLUMNS:
+                column = getattr(population, name)
+                setattr(population, name, array.array(column.typecode, archive[name].tobytes()))
+            for name, column in CATEGORY_COLUMNS:
+                setattr(population, column, Categories.from_codes(
+                    archive[name + '.codes'], archive[name + '.categories'], 'h'
+                ))
+            for i, key in enumerate(archive['attribute_names']):
+                name = 'attribute_values.{}'.format(i)
+                population.attribute_values[key] = Categories.from_codes(
+                    archive[name + '.codes'], archive[name + '.categories'], 'i'
+                )
+        return population
 
 
 class Agent:
@@ -152,21 +528,54 @@ class Plan:
         return report
 
 
-class Activity:
+class Timed:
+    """
+    Base for plan components with start and end times. Times are held as integer seconds since
+    midnight, with string (hh:mm:ss) and minute forms computed on demand.
+    """
+    __slots__ = ('start_seconds', 'end_seconds')
+
+    def set_times(self, start_time, end_time):
+        """
+        :param start_time: int seconds since midnight or str formatted hh:mm:ss
+        :param end_time: int seconds since midnight or str formatted hh:mm:ss
+        """
+        self.start_seconds = parse_seconds(start_time)
+        self.end_seconds = parse_seconds(end_time)
+
+    @property
+    def start_time(self):
+        return format_seconds(self.start_seconds)
+
+    @property
+    def end_time(self):
+        return format_seconds(self.end_seconds)
+
+    @property
+    def start_time_minutes(self):
+        return self.start_seconds // 60
+
+    @property
+    def end_time_minutes(self):
+        return self.end_seconds // 60
+
+    @property
+    def duration(self):
+        duration = self.end_time_minutes - self.start_time_minutes
+        if duration < 0:
+            duration = (24 * 60) + duration
+        return duration
+
+
+class Activity(Timed):
+    __slots__ = ('uid', 'sequence', 'act', 'point')
+
     def __init__(self, uid, seq, act, point, start_time=None, end_time=None):
         self.uid = uid
         self.sequence = seq
         self.act = act
         self.point = point
-        self.start_time = start_time
-        self.end_time = end_time
-        self.start_time_dt = dt.strptime(self.start_time, '%H:%M:%S')
-        self.end_time_dt = dt.strptime(self.end_time, '%H:%M:%S')
-        self.start_time_minutes = self.start_time_dt.hour * 60 + self.start_time_dt.minute
-        self.end_time_minutes = self.end_time_dt.hour * 60 + self.end_time_dt.minute
-        self.duration = self.end_time_minutes - self.start_time_minutes
-        if self.duration < 0:
-            self.duration = (24 * 60) + self.duration
+        self.set_times(start_time, end_time)
 
     def report(self):
         return [self.uid,
@@ -195,7 +604,9 @@ class Activity:
                 }
 
 
-class Leg:
+class Leg(Timed):
+    __slots__ = ('uid', 'sequence', 'mode', 'start_loc', 'end_loc', 'dist')
+
     def __init__(self, uid, seq, mode,
                  start_loc=None, end_loc=None,
                  start_time=None, end_time=None,
@@ -205,16 +616,8 @@ class Leg:
         self.mode = mode
         self.start_loc = start_loc
         self.end_loc = end_loc
-        self.start_time = start_time
-        self.end_time = end_time
-        self.start_time_dt = dt.strptime(start_time, '%H:%M:%S')
-        self.end_time_dt = dt.strptime(end_time, '%H:%M:%S')
-        self.start_time_minutes = self.start_time_dt.hour * 60 + self.start_time_dt.minute
-        self.end_time_minutes = self.end_time_dt.hour * 60 + self.end_time_dt.minute
-        self.duration = self.end_time_minutes - self.start_time_minutes
+        self.set_times(start_time, end_time)
         self.dist = dist
-        if self.duration < 0:
-            self.duration = (24 * 60) + self.duration
 
     def report(self):
         return [self.uid,
@@ -247,3 +650,241 @@ class Leg:
                 'duration_mins': self.duration,
                 'distance': self.dist
                 }
+
+
+class Agents:
+    """
+    Lazy sequence of Agent views of a Population. Appending an Agent adds it to the population columns.
+    Note that views are copies, changes to a view are not reflected in the population.
+    """
+
+    def __init__(self, population):
+        self.population = population
+
+    def __len__(self):
+        return len(self.population.uids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self.population.get_agent(i) for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('agent index out of range')
+        return self.population.get_agent(index)
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self.population.get_agent(index)
+
+    def append(self, agent):
+        self.population.add_agent(agent)
+
+    def extend(self, agents):
+        for agent in agents:
+            self.population.add_agent(agent)
+
+
+class Categories:
+    """
+    Growable categorical column, holding a list of unique values and an integer code for each row.
+    Missing rows are coded as -1.
+    """
+
+    def __init__(self, typecode='h'):
+        self.categories = []
+        self.lookup = {}
+        self.codes = array.array(typecode)
+
+    @classmethod
+    def missing(cls, n, typecode='h'):
+        """
+        Build column of n missing rows.
+        :param n: int
+        :param typecode: array typecode for codes
+        :return: Categories
+        """
+        column = cls(typecode)
+        column.codes = array.array(typecode, [MISSING]) * n
+        return column
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, index):
+        code = self.codes[index]
+        if code == MISSING:
+            return None
+        return self.categories[code]
+
+    def encode(self, value):
+        code = self.lookup.get(value)
+        if code is None:
+            code = len(self.categories)
+            self.categories.append(value)
+            self.lookup[value] = code
+        return code
+
+    def append(self, value):
+        self.codes.append(self.encode(value))
+
+    def extend_categories(self, other):
+        """
+        Append rows of other Categories, re-coding as required.
+        :param other: Categories
+        """
+        mapping = np.array([self.encode(value) for value in other.categories] + [MISSING], dtype=np.int64)
+        codes = mapping[other.to_numpy()]  # missing (-1) maps to last entry
+        self.codes.frombytes(codes.astype(np.dtype(self.codes.typecode)).tobytes())
+
+    def slice(self, start, stop):
+        """
+        Copy rows in given index range, with a copy of the categories.
+        :param start: int
+        :param stop: int
+        :return: Categories
+        """
+        other = Categories(self.codes.typecode)
+        other.categories = list(self.categories)
+        other.lookup = dict(self.lookup)
+        other.codes = self.codes[start:stop]
+        return other
+
+    def repeat(self, value, n):
+        """
+        Append n rows of the same value.
+        :param value: category value
+        :param n: int
+        """
+        self.codes.extend(array.array(self.codes.typecode, [self.encode(value)]) * n)
+
+    def extend_values(self, values, n):
+        """
+        Append n rows of values.
+        :param values: single value (repeated for all rows) or sequence of n values
+        :param n: int
+        """
+        if isinstance(values, str) or np.isscalar(values):
+            self.repeat(values, n)
+            return
+        try:
+            uniques, inverse = np.unique(np.asarray(values), return_inverse=True)
+        except TypeError:  # unorderable values (eg strings with missing values)
+            extend_array(self.codes, [self.encode(value) for value in values])
+            return
+        mapping = np.array([self.encode(value) for value in uniques.tolist()], dtype=np.int64)
+        extend_array(self.codes, mapping[inverse.reshape(-1)])
+
+    @classmethod
+    def from_codes(cls, codes, categories, typecode='h'):
+        """
+        Build column from codes and categories.
+        :param codes: numpy array of codes
+        :param categories: sequence of unique values
+        :param typecode: array typecode for codes
+        :return: Categories
+        """
+        column = cls(typecode)
+        column.categories = list(categories)
+        column.lookup = {value: code for code, value in enumerate(column.categories)}
+        column.codes = array.array(typecode, np.asarray(codes, dtype=np.dtype(typecode)).tobytes())
+        return column
+
+    def to_numpy(self):
+        return to_numpy(self.codes)
+
+
+def to_objects(values):
+    """
+    Copy values into numpy object array (without unpacking tuple values into extra dimensions).
+    :param values: sequence
+    :return: numpy array
+    """
+    objects = np.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        objects[i] = value
+    return objects
+
+
+def to_numpy(values):
+    """
+    Copy array.array column to numpy array of same type.
+    :param values: array.array
+    :return: numpy array
+    """
+    return np.array(values, dtype=np.dtype(values.typecode))
+
+
+def extend_array(column, values):
+    """
+    Append numpy values to array.array column, converting to the column type.
+    :param column: array.array
+    :param values: array like
+    """
+    column.frombytes(np.asarray(values, dtype=np.dtype(column.typecode)).tobytes())
+
+
+def rebase(offsets):
+    """
+    Shift offsets to start from zero.
+    :param offsets: array of offsets
+    :return: array
+    """
+    return array.array(offsets.typecode, (to_numpy(offsets) - offsets[0]).tobytes())
+
+
+def shift(offsets, by):
+    """
+    Shift offsets (excluding leading zero) by given amount.
+    :param offsets: array of offsets
+    :param by: int
+    :return: array
+    """
+    return array.array(offsets.typecode, (to_numpy(offsets)[1:] + by).tobytes())
+
+
+def minutes_duration(start, end):
+    """
+    Durations in minutes (ignoring seconds) from start and end times in seconds, wrapping midnight.
+    :param start: array of seconds (array.array or numpy)
+    :param end: array of seconds (array.array or numpy)
+    :return: numpy array
+    """
+    start = np.asarray(start) // 60
+    end = np.asarray(end) // 60
+    duration = end - start
+    duration[duration < 0] += 24 * 60
+    return duration
+
+
+def parse_seconds(value):
+    """
+    Parse time string formatted hh:mm:ss (or integer seconds) into seconds since midnight.
+    :param value: str or int
+    :return: int
+    """
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    hours, minutes, seconds = value.split(':')
+    return int(hours) * 3600 + int(minutes) * 60 + int(float(seconds))
+
+
+def format_seconds(seconds):
+    """
+    Format seconds since midnight as string hh:mm:ss.
+    :param seconds: int
+    :return: str
+    """
+    return '{:02d}:{:02d}:{:02d}'.format(seconds // 3600, (seconds // 60) % 60, seconds % 60)
+
+
+def point_xy(point):
+    if point is None:
+        return np.nan, np.nan
+    return point.x, point.y
+
+
+def make_point(x, y):
+    if np.isnan(x):
+        return None
+    return Point(x, y)
@@ -0,0 +1,106 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from utils import aws_s3_ftns, persistence
+
+"""
+Background fetching of source inputs, so that input I/O overlaps with sampling. Once configs are
+built, the inputs declared by every source config (config values named *PATH, other than outputs)
+are fetched into the local S3 cache (persistence.local_path) by a pool of threads, in source order,
+while earlier sources are loading and sampling. Sources reading an input which is still being
+fetched wait for that download, rather than repeating it. Local inputs are read directly, so are
+not prefetched.
+"""
+
+OUTPUTS = {'OUTPATH', 'XMLPATH', 'XMLPATHATTRIBS'}
+
+
+def input_paths(config):
+    """
+    S3 input paths (files or directories) declared by source config.
+    :param config: source Config
+    :return: list of str
+    """
+    paths = []
+    for name in sorted(vars(config)):
+        value = getattr(config, name)
+        if name.endswith('PATH') and name not in OUTPUTS and isinstance(value, str):
+            if persistence.is_s3_location(value) and value not in paths:
+                paths.append(value)
+    return paths
+
+
+class Prefetcher:
+    """
+    Fetch inputs of source configs in background threads. Use as a context manager, around loading
+    and sampling sources (pending fetches are cancelled, and failed fetches reported, on exit):
+
+        with Prefetcher(configurations, threads) as prefetcher:
+            ...
+    """
+
+    def __init__(self, configurations, threads=4):
+        """
+        :param configurations: dict of source name: source Config, in sampling order
+        :param threads: number of fetching threads
+        """
+        self.paths = []
+        for config in configurations.values():
+            self.paths.extend(path for path in input_paths(config) if path not in self.paths)
+        self.threads = threads
+        self.executor = None
+        self.futures = []
+        self.closed = False
+        self.lock = threading.Lock()
+        self.failed = {}
+
+    def __enter__(self):
+        if self.paths:
+            print('\tPrefetching {} S3 inputs'.format(len(self.paths)))
+            self.executor = ThreadPoolExecutor(self.threads)
+            for path in self.paths:
+                self.submit(self.fetch, path)
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self.executor is not None:
+            with self.lock:
+                self.closed = True
+                for future in self.futures:
+                    future.cancel()
+            self.executor.shutdown(wait=True)
+        for path, error in self.failed.items():
+            print('\t> unable to prefetch {}: {}'.format(path, error))
+
+    def submit(self, fn, *args):
+        with self.lock:
+            if not self.closed:
+                self.futures.append(self.executor.submit(fn, *args))
+
+    def fetch(self, path):
+        """
+        Fetch input into local cache. Directories (eg MoTiON demand segments) are fetched one
+        object per task, so that their objects are fetched concurrently. Failures are reported on
+        exit rather than raised, as the source raises them when it reads the input.
+        :param path: S3 path
+        """
+        try:
+            if persistence.s3_head(path) is None:
+                bucket, key = aws_s3_ftns.parse_bucket_and_key_path(path.rstrip('/'))
+                for obj in aws_s3_ftns.get_matching_s3_objects(bucket, key + '/'):
+                    self.submit(self.fetch_object, bucket, obj['Key'], obj['ETag'])
+            else:
+                persistence.local_path(path)
+        except Exception as e:
+            self.failed[path] = e
+
+    def fetch_object(self, bucket, key, etag):
+        """
+        :param bucket: str
+        :param key: str
+        :param etag: str
+        """
+        try:
+            persistence.cache_s3_object(bucket, key, etag)
+        except Exception as e:
+            self.failed['s3://{}/{}'.format(bucket, key)] = e
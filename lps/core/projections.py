@@ -0,0 +1,54 @@
+from functools import lru_cache
+import numpy as np
+from pyproj import Transformer
+
+"""
+Coordinate reprojection of numpy x, y arrays, using cached pyproj Transformers (which are
+expensive to build, so are built once per pair of crs per process). Coordinates are always in
+x, y (lon, lat) order.
+"""
+
+WGS84 = 4326
+
+
+@lru_cache(maxsize=None)
+def get_transformer(from_epsg, to_epsg):
+    """
+    :param from_epsg: int
+    :param to_epsg: int
+    :return: pyproj Transformer
+    """
+    return Transformer.from_crs('epsg:{}'.format(from_epsg), 'epsg:{}'.format(to_epsg), always_xy=True)
+
+
+def transform(x, y, from_epsg, to_epsg=WGS84):
+    """
+    Reproject coordinates. Missing (nan) coordinates remain missing.
+    :param x: array like
+    :param y: array like
+    :param from_epsg: int
+    :param to_epsg: int
+    :return: tuple of numpy float64 arrays (x, y)
+    """
+    x = np.array(x, dtype=np.float64, ndmin=1)
+    y = np.array(y, dtype=np.float64, ndmin=1)
+    if int(from_epsg) == int(to_epsg):
+        return x, y
+    known = np.isfinite(x) & np.isfinite(y)
+    out_x = np.full(len(x), np.nan)
+    out_y = np.full(len(y), np.nan)
+    if known.any():
+        out_x[known], out_y[known] = get_transformer(int(from_epsg), int(to_epsg)).transform(x[known], y[known])
+    return out_x, out_y
+
+
+def transform_point(x, y, from_epsg, to_epsg=WGS84):
+    """
+    Reproject a single coordinate.
+    :param x: float
+    :param y: float
+    :param from_epsg: int
+    :param to_epsg: int
+    :return: tuple (x, y)
+    """
+    return get_transformer(int(from_epsg), int(to_epsg)).transform(x, y)
@@ -1,5 +1,5 @@
-from shapely.geometry import Point
-import random
+import numpy as np
+import zlib
 from datetime import timedelta, datetime
 from lps.core.population import Population
 
@@ -30,8 +30,13 @@ class ObjectSampler:
         if not config.DUMMIES:
             print("\t> dummy trips to be removed automatically")
 
-        random.seed = config.SEED
-        self.samples = random.sample(range(10000), int(self.config.SAMPLE * 100))  # sample % from range 10000
+        self.rng = make_rng(config.SEED, config.SOURCE)
+        samples = self.rng.choice(10000, int(self.config.SAMPLE * 100), replace=False)  # sample % from range 10000
+        self.samples = set(samples.tolist())
+        self.residues = np.sort(samples)
+        flags = np.zeros(10000, dtype=bool)
+        flags[samples] = True
+        self.cumulative = np.concatenate(([0], np.cumsum(flags)))  # number of samples below each residue
         self.count = 0
         self.sample_count = 0
 
@@ -43,6 +48,43 @@ class ObjectSampler:
         self.sample_count += 1
         return True
 
+    def sample_counts(self, freq):
+        """
+        Frequency weighted version of sample, for consecutive groups of objects (eg plans) of given sizes
+        (frequencies). Samples exactly the objects that repeated calls to sample would, but using array
+        operations over groups, so that cost scales with the number of groups and objects sampled rather
+        than the total frequency. Objects beyond the Config limit are not sampled.
+        :param freq: array of group sizes
+        :return: tuple of numpy arrays (number sampled from each group, position in group of each sample)
+        """
+        freq = np.asarray(freq, dtype=np.int64)
+        bounds = self.count + np.concatenate(([0], np.cumsum(freq)))
+        before = self.sampled_before(bounds)  # number of objects sampled before each bound
+        limit = before[-1]
+        if self.config.LIMIT:
+            limit = min(limit, before[0] + max(self.config.LIMIT - self.sample_count, 0))
+        counts = np.diff(np.minimum(before, limit))
+
+        # positions of sampled objects within their groups, from the index of each sample
+        index = np.arange(before[0], limit)
+        if len(index):
+            positions = (index // len(self.residues)) * 10000 + self.residues[index % len(self.residues)]
+        else:
+            positions = index
+        positions = positions - np.repeat(bounds[:-1], counts)
+
+        self.count = int(bounds[-1])
+        self.sample_count += int(limit - before[0])
+        return counts, positions
+
+    def sampled_before(self, positions):
+        """
+        Number of objects sampled before given positions in the sequence of all objects
+        :param positions: array of positions
+        :return: numpy array
+        """
+        return (positions // 10000) * len(self.residues) + self.cumulative[positions % 10000]
+
 
 class DemandSampler:
     """
@@ -58,6 +100,7 @@ class DemandSampler:
         if config.LIMIT:
             print("\t> results limited to {} plans".format(config.LIMIT))
 
+        self.rng = make_rng(config.SEED, config.SOURCE)
         self.counter = 0
         self.hit_limit = False
 
@@ -70,7 +113,7 @@ class DemandSampler:
         # if self.config.NORM:
         #     return int(self.config.NORM)
         n = n * self.adjustment
-        count = probability_rounder(n)
+        count = probability_rounder(n, self.rng)
         provisional_counter = self.counter + count
 
         if self.config.LIMIT and self.config.LIMIT < provisional_counter:  # check if limit reached
@@ -81,46 +124,68 @@ class DemandSampler:
         self.counter = provisional_counter
         return count
 
+    def apply_limit(self, count):
+        """
+        Method for counting an already sampled number of plans against the Config limit.
+        :param count: number of plans sampled
+        :return: number of plans that can be kept
+        """
+        if self.config.LIMIT and self.counter + count > self.config.LIMIT:
+            count = max(self.config.LIMIT - self.counter, 0)
+            self.hit_limit = True
+        self.counter += count
+        return count
+
 
-def probability_rounder(n):
+def make_rng(seed=None, *keys):
+    """
+    Returns a numpy random Generator for the given seed. Optional keys identify an independent child
+    stream of the seed (eg a source or a unit of work), so that a unit of work always draws the same
+    numbers regardless of which process samples it or in what order.
+    :param seed: int seed (None for fresh entropy)
+    :param keys: str or int identifiers of the child stream
+    :return: numpy Generator
+    """
+    return np.random.Generator(np.random.PCG64(seed_sequence(seed, *keys)))
+
+
+def seed_sequence(seed=None, *keys):
+    """
+    Returns a numpy SeedSequence for the child stream of the seed identified by keys. Seed sequences
+    are cheap to pickle, so can be passed to worker processes and expanded using make_rng.
+    :param seed: int seed (None for fresh entropy)
+    :param keys: str or int identifiers of the child stream
+    :return: numpy SeedSequence
+    """
+    if isinstance(seed, np.random.SeedSequence):
+        return np.random.SeedSequence(seed.entropy, spawn_key=seed.spawn_key + stream_key(keys))
+    return np.random.SeedSequence(seed, spawn_key=stream_key(keys))
+
+
+def stream_key(keys):
+    """
+    Convert child stream identifiers to non-negative integers
+    :param keys: sequence of str or int
+    :return: tuple of int
+    """
+    return tuple(
+        int(key) if isinstance(key, (int, np.integer)) else zlib.crc32(str(key).encode()) for key in keys
+    )
+
+
+def probability_rounder(n, rng):
     """
     function for probabilistic rounding of integers
     :param n:
+    :param rng: numpy Generator
     :return:
     """
     remainder = n - int(n)
-    remainder = int(random.random() < remainder)
+    remainder = int(rng.random() < remainder)
     return int(n) + remainder
 
 
-def sample_point(geo_id, geo_df):
-    """
-    Returns randomly placed point within given geometry, using the lsoa_df. Note that it uses
-    random sampling within the shape's bounding box then checks if point is within given geometry.
-    If the method cannot return a valid point within 50 attempts then a RunTimeWarning is raised.
-    :param geo_id: sting for LSOA identification
-    :param geo_df: GeoPandas df object with required boundaries
-    :return: Point object
-    """
-    # TODO can speed this up by returning n points for geo where n is the sample frequency
-    try:
-        geom = geo_df.geometry.loc[geo_id]
-    except LookupError:
-        print('Unknown geo_id: {}'.format(geo_id))
-        return Point(530000, 180000)  # default to central london if not found (specifically Horseguard's Parade)
-    min_x, min_y, max_x, max_y = geom.bounds
-    patience = 1000
-    for attempt in range(patience):
-        random_point = Point(random.uniform(min_x, max_x), random.uniform(min_y, max_y))
-        if geom.is_valid:
-            if random_point.within(geom):
-                return random_point
-        else:
-            if random_point.within(geom.buffer(0)):
-                return random_point
-
-    raise RuntimeWarning(f'unable to sample point from geometry:{geo_id} with {patience} attempts')
-
+DAY_SECONDS = 24 * 60 * 60
 
 mode_speeds = {'Car_driver': 40,  # in miles per hour
                'Car_passenger': 40,
@@ -175,6 +240,53 @@ def build_trip_times(time, journey_time, push='forward'):
     return depart_dt, arrive_dt
 
 
+def build_journey_seconds(distance, default_speed=30, limit=5400, mode='unknown', factor=1.5):
+    """
+    Array version of build_journey_time
+    :param distance: numpy array of distances
+    :param default_speed:
+    :param limit:
+    :param mode:
+    :param factor:
+    :return: numpy array of journey times in seconds
+    """
+    speed = mode_speeds.get(mode, default_speed)
+    speed = speed * 1600 / 3600  # metres per second
+    return np.minimum(np.asarray(distance) * factor / speed, limit)
+
+
+def build_trip_seconds(seconds, journey_seconds, push='forward'):
+    """
+    Array version of build_trip_times. Times are seconds from the start of the day, so that times
+    outside of the day are negative or exceed 24 hours. If a leg overlaps 'midnight' then times
+    will be either pushed 'forward' or 'back' to ensure activity is available at start of day.
+    :param seconds: numpy array of times in seconds
+    :param journey_seconds: numpy array of journey times in seconds
+    :param push: 'forward' or 'back'
+    :return: tuple of numpy arrays (departure seconds, arrival seconds)
+    """
+    assert push in ['forward', 'back']
+    depart = seconds - journey_seconds / 2.
+    arrive = seconds + journey_seconds / 2.
+    wrapped = (depart // DAY_SECONDS) != (arrive // DAY_SECONDS)
+    if push == 'forward':
+        depart = np.where(wrapped, 0, depart)
+        arrive = np.where(wrapped, journey_seconds, arrive)
+    if push == 'back':
+        arrive = np.where(wrapped, DAY_SECONDS - 60, arrive)
+        depart = np.where(wrapped, depart - journey_seconds, depart)
+    return depart, arrive
+
+
+def get_day_seconds(seconds):
+    """
+    Array version of get_seconds, for times given as seconds from the start of the day
+    :param seconds: numpy array of times in seconds
+    :return: numpy array of whole seconds since midnight
+    """
+    return np.floor(seconds).astype(np.int64) % DAY_SECONDS
+
+
 def get_manhattan_distance(a, b, factor=1):
     x_diff = abs(a.x - b.x)
     y_diff = abs(a.y - b.y)
@@ -205,3 +317,32 @@ def get_timestamp(integer):
         if len(hours) == 1:
             hours = '0' + hours
         return '{}:{}:00'.format(hours, minutes)
+
+
+def get_timestamp_seconds(integer):
+    """
+    Parses integer timestamp from csv into seconds since midnight
+    :param integer: input integer formatted hhmm
+    :return: output integer seconds
+    """
+    integer = int(integer)
+    return (integer // 100) * 3600 + (integer % 100) * 60
+
+
+def get_timestamp_seconds_array(integers):
+    """
+    Array version of get_timestamp_seconds
+    :param integers: array of input integers formatted hhmm
+    :return: numpy array of seconds
+    """
+    integers = np.asarray(integers).astype(np.int64)
+    return (integers // 100) * 3600 + (integers % 100) * 60
+
+
+def get_seconds(t):
+    """
+    Seconds since midnight of given time or datetime
+    :param t: time or datetime object
+    :return: int
+    """
+    return t.hour * 3600 + t.minute * 60 + t.second
@@ -0,0 +1,148 @@
+import os
+import uuid
+import multiprocessing
+import tempfile
+from collections import deque
+import numpy as np
+
+"""
+Read only numpy arrays shared with worker processes through memory-mapped files. Arrays are published
+once by the parent process and workers attach to them without copying, using a small (picklable)
+handle, rather than each worker receiving its own pickled copy of the data. Files are placed in
+shared memory (/dev/shm) where available. Worker pools are started with process_context, and
+work is submitted to them with ordered_map.
+"""
+
+ALIGNMENT = 64  # byte alignment of each array within the shared file
+
+
+class SharedArrays:
+    """
+    Handle to a group of named numpy arrays published to a memory-mapped file. Arrays of objects
+    (eg strings) cannot be memory-mapped, so are held (and pickled) with the handle.
+    """
+
+    def __init__(self, path, layout, inline=None):
+        """
+        :param path: path of shared file
+        :param layout: dict of array name: (dtype str, shape, byte offset)
+        :param inline: dict of array name: array, for arrays held with the handle
+        """
+        self.path = path
+        self.layout = layout
+        self.inline = inline or {}
+        self.arrays = None
+
+    @classmethod
+    def publish(cls, arrays, directory=None):
+        """
+        Write arrays to a new shared file.
+        :param arrays: dict of array name: array
+        :param directory: directory for shared file, defaults to shared memory
+        :return: SharedArrays
+        """
+        arrays = {name: np.ascontiguousarray(values) for name, values in arrays.items()}
+        layout = {}
+        inline = {}
+        size = 0
+        for name, values in arrays.items():
+            if values.dtype.hasobject:
+                inline[name] = values
+                continue
+            layout[name] = (values.dtype.str, values.shape, size)
+            size += -(-values.nbytes // ALIGNMENT) * ALIGNMENT
+
+        path = os.path.join(directory or shared_directory(), 'lps-{}.shared'.format(uuid.uuid4().hex))
+        buffer = np.memmap(path, dtype=np.uint8, mode='w+', shape=max(size, 1))
+        for name, (_, _, offset) in layout.items():
+            values = arrays[name].reshape(-1).view(np.uint8)
+            buffer[offset:offset + len(values)] = values
+        buffer.flush()
+        del buffer
+        return cls(path, layout, inline)
+
+    def attach(self):
+        """
+        Map shared arrays (read only) into this process. Arrays are mapped once per process.
+        :return: dict of array name: array
+        """
+        if self.arrays is None:
+            buffer = np.memmap(self.path, dtype=np.uint8, mode='r')
+            arrays = dict(self.inline)
+            for name, (dtype, shape, offset) in self.layout.items():
+                dtype = np.dtype(dtype)
+                count = int(np.prod(shape))
+                arrays[name] = np.frombuffer(buffer, dtype=dtype, count=count, offset=offset).reshape(shape)
+            self.arrays = arrays
+        return self.arrays
+
+    def unlink(self):
+        """
+        Remove shared file. Processes already attached keep their mapping.
+        :return: None
+        """
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['arrays'] = None  # attached again by each process
+        return state
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.unlink()
+
+
+def shared_directory():
+    """
+    Directory for shared files, shared memory where available.
+    :return: str
+    """
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm'
+    return tempfile.gettempdir()
+
+
+def process_context():
+    """
+    Multiprocessing context for worker pools. Workers are started from a fork server (or spawned where
+    fork servers are not available) rather than forked from the parent, as a forked worker inherits
+    any locks held by other threads of the parent (eg input prefetching, spinners) in their held state.
+    :return: multiprocessing context
+    """
+    if 'forkserver' in multiprocessing.get_all_start_methods():
+        return multiprocessing.get_context('forkserver')
+    return multiprocessing.get_context('spawn')
+
+
+def ordered_map(executor, fn, items, ahead, stop=None):
+    """
+    Map fn over items across executor, yielding results in item order. At most `ahead` items are
+    submitted but not yet yielded, so that finished results do not accumulate while the consumer
+    (eg output writers) catches up. Pending items are cancelled when the generator is closed.
+    :param executor: concurrent.futures Executor
+    :param fn: function of item
+    :param items: iterable
+    :param ahead: maximum number of items in flight
+    :param stop: optional function returning True once no further results are required
+    :return: generator of results
+    """
+    items = iter(items)
+    pending = deque()
+    try:
+        while True:
+            if stop is not None and stop():
+                return
+            for item in items:
+                pending.append(executor.submit(fn, item))
+                if len(pending) >= ahead:
+                    break
+            if not pending:
+                return
+            yield pending.popleft().result()
+    finally:
+        for future in pending:
+            future.cancel()
@@ -0,0 +1,671 @@
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gp
+from shapely import wkb
+from shapely.geometry import LineString, Polygon, MultiPolygon
+from shapely.geometry.polygon import orient
+from shapely.ops import split, triangulate, unary_union
+
+from utils import persistence
+from lps.core import shared
+
+
+DEFAULT_POINT = (530000, 180000)  # central london (specifically Horseguard's Parade)
+CACHE_SUFFIXES = ('.zidx.npz', '.zstore.npz', '.zmember.npz', '.tmp.npz')  # indices and stores built from zones
+INDEX_VERSION = 1
+STORE_VERSION = 1
+
+_stores = {}  # zone stores already loaded in this process, by (source path, name, epsg)
+
+
+class ZoneIndex:
+    """
+    Triangulated zone sampling index. Each zone polygon is broken into triangles once, stored as
+    flat numpy tables of triangle coordinates and area weights, so that uniform points can be drawn
+    inside any zone without rejection sampling.
+    """
+
+    def __init__(self, ids, offsets, triangles, cumulative, source_mtime=None, epsg=None):
+        """
+        :param ids: array of zone ids
+        :param offsets: int array (zones + 1) of start positions of each zone in the triangle tables
+        :param triangles: float array (triangles, 6) of triangle coordinates (ax, ay, bx, by, cx, cy)
+        :param cumulative: float array (triangles) of zone position plus cumulative area fraction
+        :param source_mtime: modified time of source zones, used to validate persisted indices
+        :param epsg: crs of triangle coordinates
+        """
+        self.ids = np.asarray(ids)
+        self.offsets = np.asarray(offsets, dtype=np.int64)
+        self.triangles = np.asarray(triangles, dtype=np.float64)
+        self.cumulative = np.asarray(cumulative, dtype=np.float64)
+        self.source_mtime = source_mtime
+        self.epsg = epsg
+        self.lookup = pd.Index(self.ids)
+        self.shared = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def share(self, directory=None):
+        """
+        Publish index tables as shared arrays for worker processes. The returned index pickles as a
+        small handle, and its tables are attached (without copying) when unpickled. The caller should
+        unlink the shared arrays (index.shared.unlink()) once workers have attached.
+        :param directory: directory for shared arrays, defaults to shared memory
+        :return: ZoneIndex
+        """
+        arrays = shared.SharedArrays.publish(
+            {'ids': self.ids, 'offsets': self.offsets, 'triangles': self.triangles, 'cumulative': self.cumulative},
+            directory
+        )
+        index = ZoneIndex.__new__(ZoneIndex)
+        index.__setstate__({'source_mtime': self.source_mtime, 'epsg': self.epsg, 'shared': arrays})
+        return index
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        if self.shared is not None:  # tables are attached from shared arrays
+            for name in ('ids', 'offsets', 'triangles', 'cumulative', 'lookup'):
+                del state[name]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        if self.shared is not None:
+            tables = self.shared.attach()
+            self.ids = tables['ids']
+            self.offsets = tables['offsets']
+            self.triangles = tables['triangles']
+            self.cumulative = tables['cumulative']
+            self.lookup = pd.Index(self.ids)
+
+    @classmethod
+    def from_geodataframe(cls, zones, epsg=None):
+        """
+        Build index by triangulating every zone geometry.
+        :param zones: GeoPandas GeoDataFrame indexed by zone id
+        :param epsg: crs of zones
+        :return: ZoneIndex
+        """
+        offsets = [0]
+        triangles = []
+        cumulative = []
+        for position, geom in enumerate(zones.geometry):
+            zone_triangles = triangulate_geometry(geom)
+            areas = triangle_areas(zone_triangles)
+            if areas.sum() > 0:
+                fractions = np.cumsum(areas) / areas.sum()
+                fractions[-1] = 1.
+                triangles.append(zone_triangles)
+                cumulative.append(position + fractions)
+                offsets.append(offsets[-1] + len(zone_triangles))
+            else:  # empty zones are treated as unknown when sampling
+                offsets.append(offsets[-1])
+
+        if triangles:
+            triangles = np.concatenate(triangles)
+            cumulative = np.concatenate(cumulative)
+        else:
+            triangles = np.empty((0, 6))
+            cumulative = np.empty(0)
+        return cls(np.asarray(zones.index), offsets, triangles, cumulative, epsg=epsg)
+
+    def sample(self, zone_ids, rng):
+        """
+        Returns uniformly placed points within given zones. A triangle is chosen for each point
+        using its zone's area weights, then a point drawn uniformly within the triangle.
+        Unknown zone ids default to central london (DEFAULT_POINT).
+        :param zone_ids: sequence of zone ids, one for each point required
+        :param rng: numpy Generator
+        :return: tuple of numpy arrays (x, y)
+        """
+        zone_ids = np.asarray(zone_ids)
+        n = len(zone_ids)
+        x = np.full(n, DEFAULT_POINT[0], dtype=np.float64)
+        y = np.full(n, DEFAULT_POINT[1], dtype=np.float64)
+        if not n:
+            return x, y
+
+        positions = self.lookup.get_indexer(zone_ids)
+        known = positions >= 0
+        known[known] = self.offsets[positions[known] + 1] > self.offsets[positions[known]]
+        if not known.all():
+            for geo_id in np.unique(zone_ids[~known]):
+                print('Unknown geo_id: {}'.format(geo_id))
+        positions = positions[known]
+
+        # choose triangle by area weight within zone
+        target = positions + rng.random(len(positions))
+        chosen = np.searchsorted(self.cumulative, target, side='right')
+        chosen = np.clip(chosen, self.offsets[positions], self.offsets[positions + 1] - 1)
+
+        # uniform point within triangle (reflecting points from the far half of the parallelogram)
+        r1 = rng.random(len(chosen))
+        r2 = rng.random(len(chosen))
+        flip = (r1 + r2) > 1
+        r1[flip] = 1 - r1[flip]
+        r2[flip] = 1 - r2[flip]
+        tri = self.triangles[chosen]
+        x[known] = tri[:, 0] + r1 * (tri[:, 2] - tri[:, 0]) + r2 * (tri[:, 4] - tri[:, 0])
+        y[known] = tri[:, 1] + r1 * (tri[:, 3] - tri[:, 1]) + r2 * (tri[:, 5] - tri[:, 1])
+        return x, y
+
+    def save(self, path):
+        """
+        Persist index to given path as numpy npz archive.
+        :param path: str
+        :return: None
+        """
+        np.savez(
+            path,
+            version=INDEX_VERSION,
+            ids=self.ids,
+            offsets=self.offsets,
+            triangles=self.triangles,
+            cumulative=self.cumulative,
+            source_mtime=np.nan if self.source_mtime is None else self.source_mtime,
+            epsg=-1 if self.epsg is None else self.epsg,
+        )
+
+    @classmethod
+    def load(cls, path):
+        """
+        Load index from numpy npz archive.
+        :param path: str
+        :return: ZoneIndex
+        """
+        with np.load(path, allow_pickle=True) as archive:
+            if int(archive['version']) != INDEX_VERSION:
+                raise ValueError('zone index version {} not supported'.format(int(archive['version'])))
+            source_mtime = float(archive['source_mtime'])
+            epsg = int(archive['epsg'])
+            return cls(
+                archive['ids'],
+                archive['offsets'],
+                archive['triangles'],
+                archive['cumulative'],
+                source_mtime=None if np.isnan(source_mtime) else source_mtime,
+                epsg=None if epsg < 0 else epsg,
+            )
+
+
+def load_zone_index(zones, source_path, epsg, name):
+    """
+    Load triangulated zone index persisted alongside the source zones, or build (and persist) it
+    if missing or out of date. S3 sources are read through the local S3 cache, with indices persisted
+    alongside the cached copy.
+    :param zones: GeoPandas GeoDataFrame indexed by zone id
+    :param source_path: path of zones shapefile (or directory)
+    :param epsg: crs of zones
+    :param name: index name, eg zone id column name
+    :return: ZoneIndex
+    """
+    source_path = persistence.local_path(source_path)
+    path = index_path(source_path, name, epsg)
+    mtime = source_mtime(source_path)
+
+    if path and os.path.exists(path):
+        try:
+            index = ZoneIndex.load(path)
+            if index.source_mtime == mtime and index.epsg == epsg and len(index) == len(zones):
+                print('\t> zone index loaded from {}'.format(path))
+                return index
+        except (OSError, ValueError, KeyError):
+            pass
+
+    index = ZoneIndex.from_geodataframe(zones, epsg=epsg)
+    index.source_mtime = mtime
+
+    if path:
+        try:
+            index.save(path)
+            print('\t> zone index saved to {}'.format(path))
+        except OSError:
+            print('\t> unable to save zone index to {}'.format(path))
+    return index
+
+
+def index_path(source_path, name, epsg):
+    """
+    Path for persisted index alongside given zones source, None for S3 locations.
+    :param source_path: path of zones shapefile (or directory)
+    :param name: index name
+    :param epsg: crs of index
+    :return: str
+    """
+    if persistence.is_s3_location(source_path):
+        return None
+    source_path = source_path.rstrip('/')
+    if os.path.isdir(source_path):
+        return os.path.join(source_path, '{}.{}.zidx.npz'.format(name, epsg))
+    root, _ = os.path.splitext(source_path)
+    return '{}.{}.{}.zidx.npz'.format(root, name, epsg)
+
+
+class ZoneMembership:
+    """
+    Lookup of zone membership (eg of London) held as a numpy array indexed directly by integer zone
+    id, so that the membership of many zone ids is a single array gather. Zone ids that are not in
+    the zone system are neither inside nor outside.
+    """
+
+    def __init__(self, zone_ids, inside):
+        """
+        :param zone_ids: sequence of integer zone ids
+        :param inside: sequence of bool, membership of each zone
+        """
+        self.zone_ids = np.asarray(zone_ids, dtype=np.int64)
+        self.members = np.asarray(inside, dtype=bool)
+        self.lookup = np.full(int(self.zone_ids.max()) + 1 if len(self.zone_ids) else 0, -1, dtype=np.int8)
+        self.lookup[self.zone_ids] = self.members
+
+    def __len__(self):
+        return len(self.zone_ids)
+
+    def get(self, ids):
+        """
+        :param ids: array of zone ids
+        :return: int8 array of membership: 1 inside, 0 outside, -1 unknown
+        """
+        ids = np.asarray(ids, dtype=np.int64)
+        known = (ids >= 0) & (ids < len(self.lookup))
+        if known.all():
+            return self.lookup[ids]
+        membership = np.full(len(ids), -1, dtype=np.int8)
+        membership[known] = self.lookup[ids[known]]
+        return membership
+
+    def inside(self, ids):
+        return self.get(ids) == 1
+
+    def outside(self, ids):
+        return self.get(ids) == 0
+
+    @property
+    def inside_ids(self):
+        return self.zone_ids[self.members]
+
+    @property
+    def outside_ids(self):
+        return self.zone_ids[~self.members]
+
+
+def load_zone_membership(source_path, epsg, id_column, filter_path):
+    """
+    Load membership of zones (those intersecting the union of the filter zones), persisted alongside
+    the source zones, or build (and persist) it if missing or out of date.
+    :param source_path: path of zones shapefile (or directory)
+    :param epsg: crs of zones
+    :param id_column: zone id column name
+    :param filter_path: path of filter zones shapefile (or directory)
+    :return: ZoneMembership
+    """
+    source_path = persistence.local_path(source_path)
+    filter_path = persistence.local_path(filter_path)
+    filter_name = os.path.splitext(os.path.basename(filter_path.rstrip('/')))[0]
+    name = '{}.in.{}'.format(id_column, filter_name)
+    key = (source_path, name, epsg)
+    mtimes = [source_mtime(source_path), source_mtime(filter_path)]
+    mtime = None if None in mtimes else max(mtimes)
+    if key in _stores and _stores[key][0] == mtime:
+        return _stores[key][1]
+
+    path = store_path(source_path, name, epsg, 'zmember')
+    membership = None
+    if path and os.path.exists(path):
+        try:
+            with np.load(path) as archive:
+                if int(archive['version']) == STORE_VERSION and float(archive['source_mtime']) == mtime:
+                    membership = ZoneMembership(archive['zone_ids'], archive['members'])
+        except (OSError, ValueError, KeyError):
+            pass
+
+    if membership is None:
+        gdf = load_zones(source_path, epsg, repair=True)
+        union = load_zones_union(filter_path, epsg)
+        membership = ZoneMembership(gdf[id_column], gdf.intersects(union))
+        if path:
+            try:
+                temp_path = path + '.tmp.npz'
+                np.savez(
+                    temp_path,
+                    version=STORE_VERSION,
+                    source_mtime=np.nan if mtime is None else mtime,
+                    zone_ids=membership.zone_ids,
+                    members=membership.members,
+                )
+                os.replace(temp_path, path)
+            except OSError:
+                print('\t> unable to save zone membership to {}'.format(path))
+
+    _stores[key] = (mtime, membership)
+    return membership
+
+
+def load_zones(source_path, epsg, repair=False):
+    """
+    Load zone system reprojected to given crs, and optionally repaired (using buffer(0)). The
+    processed zones are persisted alongside the source and held in memory, so that repeated builds
+    and sources sharing a zone system skip reading, reprojecting and repairing. S3 sources are read
+    through the local S3 cache, with stores persisted alongside the cached copy.
+    :param source_path: path of zones shapefile (or directory)
+    :param epsg: target crs
+    :param repair: bool, repair geometries
+    :return: GeoPandas GeoDataFrame
+    """
+    source_path = persistence.local_path(source_path)
+    name = 'repaired' if repair else 'zones'
+
+    def build():
+        gdf = gp.read_file(source_path)
+        if not crs_epsg(gdf.crs) == epsg:
+            gdf = gdf.to_crs(epsg=epsg)
+        if repair:
+            gdf.geometry = gdf.buffer(0)
+        return gdf
+
+    return load_store(source_path, name, epsg, build).copy()
+
+
+def load_zones_union(source_path, epsg):
+    """
+    Load the union of all (repaired) zones, eg for use as a spatial filter. The union is persisted
+    alongside the source zones.
+    :param source_path: path of zones shapefile (or directory)
+    :param epsg: target crs
+    :return: shapely geometry
+    """
+    source_path = persistence.local_path(source_path)
+
+    def build():
+        gdf = load_zones(source_path, epsg, repair=True)
+        return gp.GeoDataFrame(geometry=[unary_union(list(gdf.geometry))], crs=gdf.crs)
+
+    return load_store(source_path, 'union', epsg, build).geometry.iloc[0]
+
+
+def load_store(source_path, name, epsg, build):
+    """
+    Load named zone store from memory, from disk (if up to date), or build and persist it.
+    :param source_path: path of zones shapefile (or directory)
+    :param name: store name
+    :param epsg: crs of store
+    :param build: function returning GeoPandas GeoDataFrame to be stored
+    :return: GeoPandas GeoDataFrame
+    """
+    key = (source_path, name, epsg)
+    mtime = source_mtime(source_path)
+    if key in _stores and _stores[key][0] == mtime:
+        return _stores[key][1]
+
+    path = store_path(source_path, name, epsg)
+    gdf = None
+    if path and os.path.exists(path):
+        try:
+            stored_mtime, gdf = read_store(path)
+            if stored_mtime != mtime:
+                gdf = None
+        except (OSError, ValueError, KeyError):
+            gdf = None
+
+    if gdf is None:
+        gdf = build()
+        if path:
+            try:
+                write_store(gdf, path, mtime, epsg)
+            except OSError:
+                print('\t> unable to save zone store to {}'.format(path))
+
+    _stores[key] = (mtime, gdf)
+    return gdf
+
+
+def write_store(gdf, path, mtime, epsg):
+    """
+    Persist zones to given path as numpy npz archive, with geometries as concatenated WKB.
+    :param gdf: GeoPandas GeoDataFrame
+    :param path: str
+    :param mtime: modified time of source zones
+    :param epsg: crs of zones
+    :return: None
+    """
+    geometries = [geom.wkb for geom in gdf.geometry]
+    offsets = np.cumsum([0] + [len(geom) for geom in geometries])
+    columns = [column for column in gdf.columns if column != gdf.geometry.name]
+    temp_path = path + '.tmp.npz'
+    np.savez(
+        temp_path,
+        version=STORE_VERSION,
+        source_mtime=np.nan if mtime is None else mtime,
+        epsg=epsg,
+        wkb=np.frombuffer(b''.join(geometries), dtype=np.uint8),
+        offsets=offsets,
+        columns=np.array(columns, dtype=object),
+        **{'column_{}'.format(i): np.asarray(gdf[column]) for i, column in enumerate(columns)}
+    )
+    os.replace(temp_path, path)
+
+
+def read_store(path):
+    """
+    Load zones from numpy npz archive.
+    :param path: str
+    :return: tuple (source modified time, GeoPandas GeoDataFrame)
+    """
+    with np.load(path, allow_pickle=True) as archive:
+        if int(archive['version']) != STORE_VERSION:
+            raise ValueError('zone store version {} not supported'.format(int(archive['version'])))
+        mtime = float(archive['source_mtime'])
+        buffer = archive['wkb'].tobytes()
+        offsets = archive['offsets']
+        geometry = [wkb.loads(buffer[start:end]) for start, end in zip(offsets[:-1], offsets[1:])]
+        data = {
+            column: archive['column_{}'.format(i)] for i, column in enumerate(archive['columns'])
+        }
+        gdf = gp.GeoDataFrame(data, geometry=geometry, crs={'init': 'epsg:{}'.format(int(archive['epsg']))})
+    return None if np.isnan(mtime) else mtime, gdf
+
+
+def store_path(source_path, name, epsg, extension='zstore'):
+    """
+    Path for persisted zone store alongside given zones source, None for S3 locations.
+    :param source_path: path of zones shapefile (or directory)
+    :param name: store name
+    :param epsg: crs of store
+    :param extension: store type
+    :return: str
+    """
+    if persistence.is_s3_location(source_path):
+        return None
+    source_path = source_path.rstrip('/')
+    if os.path.isdir(source_path):
+        return os.path.join(source_path, '{}.{}.{}.npz'.format(name, epsg, extension))
+    root, _ = os.path.splitext(source_path)
+    return '{}.{}.{}.{}.npz'.format(root, name, epsg, extension)
+
+
+def crs_epsg(crs):
+    """
+    EPSG code of given crs (dict or pyproj CRS), None if unknown.
+    :param crs: crs
+    :return: int
+    """
+    if not crs:
+        return None
+    if isinstance(crs, dict):
+        init = crs.get('init', '')
+        if init.lower().startswith('epsg:'):
+            return int(init.split(':')[1])
+        return None
+    try:
+        return crs.to_epsg()
+    except AttributeError:
+        return None
+
+
+def source_mtime(source_path):
+    """
+    Latest modified time of given file or of the files in given directory (excluding indices
+    and stores).
+    :param source_path: str
+    :return: float
+    """
+    if persistence.is_s3_location(source_path):
+        return None
+    if os.path.isdir(source_path):
+        mtimes = [
+            os.path.getmtime(os.path.join(source_path, name)) for name in os.listdir(source_path)
+            if not name.endswith(CACHE_SUFFIXES)
+        ]
+        return max(mtimes) if mtimes else None
+    return os.path.getmtime(source_path)
+
+
+def triangle_areas(triangles):
+    """
+    :param triangles: float array (triangles, 6)
+    :return: float array of triangle areas
+    """
+    return np.abs(
+        (triangles[:, 2] - triangles[:, 0]) * (triangles[:, 5] - triangles[:, 1])
+        - (triangles[:, 4] - triangles[:, 0]) * (triangles[:, 3] - triangles[:, 1])
+    ) / 2
+
+
+def triangulate_geometry(geom):
+    """
+    Triangulate (multi) polygon geometry.
+    :param geom: shapely geometry
+    :return: float array (triangles, 6)
+    """
+    if geom is None or geom.is_empty:
+        return np.empty((0, 6))
+    if not geom.is_valid:
+        geom = geom.buffer(0)
+    if isinstance(geom, Polygon):
+        polygons = [geom]
+    elif isinstance(geom, MultiPolygon) or hasattr(geom, 'geoms'):
+        polygons = [g for g in getattr(geom, 'geoms') if isinstance(g, Polygon)]
+    else:
+        return np.empty((0, 6))
+
+    triangles = [triangulate_polygon(polygon) for polygon in polygons if polygon.area > 0]
+    triangles = [t for t in triangles if len(t)]
+    if not triangles:
+        return np.empty((0, 6))
+    return np.concatenate(triangles)
+
+
+def triangulate_polygon(polygon):
+    """
+    Exact triangulation of a polygon. Holes are removed by splitting the polygon along a
+    vertical line through each hole, the remaining simple polygons are then ear clipped. If
+    clipping fails to reproduce the polygon area (eg for degenerate rings) then a filtered
+    delaunay triangulation is used instead.
+    :param polygon: shapely Polygon
+    :return: float array (triangles, 6)
+    """
+    if len(polygon.interiors):
+        min_x, min_y, max_x, max_y = polygon.bounds
+        hole_min_x, _, hole_max_x, _ = polygon.interiors[0].bounds
+        x = (hole_min_x + hole_max_x) / 2
+        cutter = LineString([(x, min_y - 1), (x, max_y + 1)])
+        pieces = [p for p in split(polygon, cutter).geoms if isinstance(p, Polygon)]
+        if len(pieces) > 1:
+            triangles = [triangulate_polygon(piece) for piece in pieces if piece.area > 0]
+            triangles = [t for t in triangles if len(t)]
+            return np.concatenate(triangles) if triangles else np.empty((0, 6))
+        return delaunay_triangles(polygon)
+
+    ring = np.asarray(orient(polygon, sign=1.0).exterior.coords)[:-1, :2]
+    triangles = ear_clip(ring)
+    if not np.isclose(triangle_areas(triangles).sum(), polygon.area, rtol=1e-6):
+        return delaunay_triangles(polygon)
+    return triangles
+
+
+def ear_clip(ring):
+    """
+    Ear clipping triangulation of a simple counter-clockwise ring.
+    :param ring: float array (vertices, 2), not closed
+    :return: float array (triangles, 6)
+    """
+    remaining = list(range(len(ring)))
+    triangles = []
+    start = 0
+    while len(remaining) > 3:
+        points = ring[remaining]
+        previous = np.roll(points, 1, axis=0)
+        following = np.roll(points, -1, axis=0)
+        cross = (points[:, 0] - previous[:, 0]) * (following[:, 1] - previous[:, 1]) \
+            - (points[:, 1] - previous[:, 1]) * (following[:, 0] - previous[:, 0])
+        reflex = np.flatnonzero(cross <= 0)
+
+        count = len(remaining)
+        ear = None
+        for step in range(count):
+            i = (start + step) % count
+            if cross[i] <= 0:
+                continue
+            others = reflex[(reflex != (i - 1) % count) & (reflex != i) & (reflex != (i + 1) % count)]
+            if not len(others) or not points_in_triangle(points[others], previous[i], points[i], following[i]).any():
+                ear = i
+                break
+        if ear is None:  # degenerate ring, clip the most convex vertex
+            ear = int(np.argmax(cross))
+
+        triangles.append(np.concatenate([previous[ear], points[ear], following[ear]]))
+        del remaining[ear]
+        start = ear % len(remaining)
+
+    if len(remaining) == 3:
+        triangles.append(ring[remaining].reshape(6))
+    if not triangles:
+        return np.empty((0, 6))
+    return np.vstack(triangles)
+
+
+def points_in_triangle(points, a, b, c):
+    """
+    Test which points lie inside or on the boundary of triangle abc.
+    :param points: float array (n, 2)
+    :return: boolean array
+    """
+    v0 = c - a
+    v1 = b - a
+    v2 = points - a
+    dot00 = v0 @ v0
+    dot01 = v0 @ v1
+    dot11 = v1 @ v1
+    dot02 = v2 @ v0
+    dot12 = v2 @ v1
+    denominator = dot00 * dot11 - dot01 * dot01
+    if denominator == 0:
+        return np.zeros(len(points), dtype=bool)
+    u = (dot11 * dot02 - dot01 * dot12) / denominator
+    v = (dot00 * dot12 - dot01 * dot02) / denominator
+    return (u >= 0) & (v >= 0) & (u + v <= 1)
+
+
+def delaunay_triangles(polygon):
+    """
+    Approximate triangulation using delaunay triangles of polygon vertices, clipped to the polygon.
+    Clipped pieces that are not triangles are replaced by their convex hull triangulation.
+    :param polygon: shapely Polygon
+    :return: float array (triangles, 6)
+    """
+    triangles = []
+    for triangle in triangulate(polygon):
+        piece = triangle.intersection(polygon)
+        if piece.is_empty or piece.area == 0:
+            continue
+        if np.isclose(piece.area, triangle.area):
+            triangles.append(np.asarray(triangle.exterior.coords)[:3, :2].reshape(6))
+            continue
+        for sub in triangulate(piece):
+            if sub.representative_point().within(polygon):
+                triangles.append(np.asarray(sub.exterior.coords)[:3, :2].reshape(6))
+    if not triangles:
+        return np.empty((0, 6))
+    return np.vstack(triangles)
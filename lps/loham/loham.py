@@ -1,12 +1,10 @@
 import pandas as pd
-from datetime import time, timedelta, datetime
+from datetime import time
 import numpy as np
-import geopandas as gp
-import random
 from halo import Halo
 
-from lps.core import samplers, generators
-from lps.core.population import Population, Agent, Plan, Activity, Leg
+from lps.core import samplers, generators, zones, matrices
+from lps.core.population import Population
 
 times = {
     (7, 10): 0,
@@ -21,7 +19,9 @@ class Demand:
         print('\n--------- Initiating LoHAM (freight) Population Input ---------')
         self.config = config
         self.zones = self.load_zones()
+        self.zone_index = zones.load_zone_index(self.zones, config.ZONESPATH, config.EPSG, 'renumber_I')
         self.london = self.load_filter()
+        self.london_key = matrices.filter_key('london', self.london.inside_ids)
         self.demand = self.load_demand()
         self.num_plans = None
         self.sampler = None
@@ -41,41 +41,40 @@ class Demand:
         :return: GeoPandas GeoDataFrame
         """
         with Halo(text='Loading zone data...', spinner='dots') as spinner:
-            gdf = gp.read_file(self.config.ZONESPATH)
-            if not gdf.crs.get('init') == self.config.EPSG:
-                spinner.text = 'converting zones to espg:{}'.format(self.config.EPSG)
-                gdf = gdf.to_crs(epsg=self.config.EPSG)
+            gdf = zones.load_zones(self.config.ZONESPATH, self.config.EPSG)
             gdf = gdf.loc[:, ['renumber_I', 'london', 'geometry']]
             gdf = gdf.set_index('renumber_I')
             spinner.succeed('{} zones loaded'.format(len(gdf)))
         return gdf
 
     def load_filter(self):
-        return pd.Series(self.zones.loc[self.zones.london == 1, :].index)
+        return zones.ZoneMembership(self.zones.index, self.zones.london == 1)
 
     def filter(self, df):
-        return df.loc[df.o.isin(self.london) | df.d.isin(self.london), :]
+        return df.loc[self.london.inside(df.o.values) | self.london.inside(df.d.values), :]
+
+    def read_demand(self, path):
+        """
+        Read demand csv and filter for london
+        :param path: str
+        :return: Pandas DataFrame [o, d, freq]
+        """
+        return self.filter(pd.read_csv(path, header=None, names=['o', 'd', 'freq']))
 
     # load OD pairs
     def load_demand(self):
-        with Halo(text='loading demand inputs...', spinner='dots') as spinner:
-            am = pd.read_csv(self.config.AMPATH, header=None, names=['o', 'd', 'freq'])
-            inter = pd.read_csv(self.config.INTERPATH, header=None, names=['o', 'd', 'freq'])
-            pm = pd.read_csv(self.config.PMPATH, header=None, names=['o', 'd', 'freq'])
-            spinner.succeed('input demand loaded')
+        with Halo(text='loading am demand (1/3) for london...', spinner='dots') as spinner:
+            am = matrices.load_matrix(self.config.AMPATH, self.read_demand, self.london_key)
+            spinner.text = 'loading inter demand (2/3) for london...'
+            inter = matrices.load_matrix(self.config.INTERPATH, self.read_demand, self.london_key)
+            spinner.text = 'loading pm demand (3/3) for london...'
+            pm = matrices.load_matrix(self.config.PMPATH, self.read_demand, self.london_key)
 
             # TODO SENSE CHECK - halve demand so that return trip does not cause double counting
             am.freq = am.freq / 2
             inter.freq = inter.freq / 2
             pm.freq = pm.freq / 2
 
-        with Halo(text='filtering am demand (1/3) for london...', spinner='dots') as spinner:
-            am = self.filter(am)
-            spinner.text = 'filtering inter demand (2/3) for london...'
-            inter = self.filter(inter)
-            spinner.text = 'filtering pm demand (3/3) for london...'
-            pm = self.filter(pm)
-
             am_hour = sum(am.freq)
             inter_hour = sum(inter.freq)
             pm_hour = sum(pm.freq)
@@ -113,7 +112,7 @@ class Demand:
                 print(hour_str + ': ' + ('/' * norm))
 
         daily_profile = np.array(daily_profile)
-        daily_sampler = (daily_hours, daily_profile)
+        daily_sampler = generators.FrequencyDistribution(daily_hours, daily_profile)
 
         if self.config.NORM:  # Normalise
             print("Normalising")
@@ -122,117 +121,134 @@ class Demand:
         print("{} total trips loaded".format(int(sum(daily_profile))))
 
         with Halo(text='Modelled O-D demand profiles...', spinner='dots') as spinner:
-            am_profile = np.array(am.freq)
-            am_od = tuple(zip(am.o, am.d))
-            am_sampler = (am_od, am_profile)
-            inter_profile = np.array(inter.freq)
-            inter_od = tuple(zip(inter.o, inter.d))
-            inter_sampler = (inter_od, inter_profile)
-            pm_profile = np.array(pm.freq)
-            pm_od = tuple(zip(pm.o, pm.d))
-            pm_sampler = (pm_od, pm_profile)
+            am_od = np.column_stack((am.o, am.d))
+            am_sampler = generators.FrequencyDistribution(am_od, am.freq)
+            inter_od = np.column_stack((inter.o, inter.d))
+            inter_sampler = generators.FrequencyDistribution(inter_od, inter.freq)
+            pm_od = np.column_stack((pm.o, pm.d))
+            pm_sampler = generators.FrequencyDistribution(pm_od, pm.freq)
             spinner.succeed('O-D demand profiles completed')
 
         return {'daily': daily_sampler, 'am': am_sampler, 'inter': inter_sampler, 'pm': pm_sampler}
 
     def sample(self, sampler, population=None):
-
+        """
+        Sample freight plans. Trips are sampled and built as arrays, with plans added to the
+        population as columns.
+        :param sampler: DemandSampler
+        :param population: Population object
+        :return: Population object
+        """
         if not population:
             print('Creating new population object')
             population = Population()
 
         with Halo(text='Sampling from distributions', spinner='dots') as spinner:
-
-            n = sum(self.demand['daily'][1])  # total daily demand
+            rng = sampler.rng
+            n = self.demand['daily'].frequency.sum()  # total daily demand
             n = sampler.get_sample_size(n)
 
-            # Sample n times (over samples but no significant slow down)
-            hours = random.choices(self.demand['daily'][0], weights=self.demand['daily'][1], k=n + 1)
-            start_times = generators.gen_minutes(hours)
-            am_od_ids = random.choices(self.demand['am'][0], weights=self.demand['am'][1], k=n + 1)
-            inter_od_ids = random.choices(self.demand['inter'][0], weights=self.demand['inter'][1], k=n + 1)
-            pm_od_ids = random.choices(self.demand['pm'][0], weights=self.demand['pm'][1], k=n + 1)
+            hours = self.demand['daily'].sample_array(rng, n)
+            minutes = rng.integers(60, size=n)
+            stops = rng.integers(1, 7, size=n) * 5  # Assume 5 to 30 minutes at destination
             spinner.succeed('Sampling completed for {} plans'.format(n))
 
-        with Halo(text="Building trips...", spinner="dots") as spinner:
-            for trip in range(n):
-                spinner.text = "Built {} of {} trips...".format(trip, n)
+        with Halo(text="Sampling trip locations...", spinner="dots") as spinner:
+            # Select Peak or Inter-Peak O-D pairs for each trip
+            period = np.full(n, 3)
+            for (start, end), p in times.items():
+                period[(hours >= start) & (hours < end)] = p
+            ods = np.empty((n, 2), dtype=self.demand['am'].distribution.dtype)
+            for key, mask in (('am', period == 0), ('inter', (period == 1) | (period == 3)), ('pm', period == 2)):
+                ods[mask] = self.demand[key].sample_array(rng, int(mask.sum()))
 
-                # Make unique ID
-                uid = self.config.PREFIX + str(trip)
+            # Sample O-D points for all trips
+            o_xs, o_ys = self.zone_index.sample(ods[:, 0], rng)
+            d_xs, d_ys = self.zone_index.sample(ods[:, 1], rng)
+            spinner.succeed('Locations sampled for {} trips'.format(n))
 
-                # Random sample hour from daily profile distribution
-                hour = hours[trip]
+        with Halo(text="Building trips...", spinner="dots") as spinner:
+            # Get distance between pair (for approx. journey time)
+            dist = np.hypot(d_xs - o_xs, d_ys - o_ys)
+            journey = samplers.build_journey_seconds(dist, mode=self.config.MODE, limit=72000)  # limited at 20 hours
 
-                # Random sample minute to make time stamp
-                start_time = start_times[trip]
+            # Build up day times (seconds from start of day), preventing legs straddling day
+            start = hours * 3600 + minutes * 60
+            s0, s1 = samplers.build_trip_seconds(start, journey, push='forward')
+            s2 = s1 + stops * 60
+            s3 = s2 + journey
 
-                # Select Peak or Inter-Peal O-D pairs and weights
-                period = 3
-                for (start, end), p in times.items():
-                    if end > hour >= start:
-                        period = p
-                        break
-                if period == 0:  # Use am matrix
-                    o_id, d_id = am_od_ids[trip]
-                elif period == 2:  # Use pm matrix
-                    o_id, d_id = pm_od_ids[trip]
-                else:  # Use inter-peak matrix
-                    o_id, d_id = inter_od_ids[trip]
-
-                # Sample O-D points
-                o = samplers.sample_point(o_id, self.zones)
-                d = samplers.sample_point(d_id, self.zones)
-
-                # Get distance between pair (for approx. journey time)
-                dist = samplers.get_approx_distance(o, d)
-                journey_time = samplers.build_journey_time(dist, mode=self.config.MODE, limit=72000)  # limited at 20 hours
-
-                # Build up day times
-                dt = datetime(2000, 1, 1, start_time.hour, start_time.minute)
-                dt0, dt1 = samplers.build_trip_times(dt, journey_time, push='forward')  # function prevents leg straddling day
-                minutes = random.randint(1, 6) * 5
-                dt2 = dt1 + timedelta(seconds=(minutes * 60))  # Assume 5 to 30 minutes at destination
-                dt3 = dt2 + journey_time
-
-                population.agents.append(self.build_plan(uid, o, d, dt0, dt1, dt2, dt3, dist))
+            uids = [self.config.PREFIX + str(trip) for trip in range(n)]
+            self.build_plans(population, uids, (o_xs, o_ys), (d_xs, d_ys), (s0, s1, s2, s3), dist)
 
             spinner.succeed("Plan simulation completed for {} plans".format(n))
         return population
 
-    def build_plan(self, uid, o, d, dt0, dt1, dt2, dt3, dist=None):
-
-        t0 = dt0.time().strftime("%H:%M:%S")  # Home departure
-        t1 = dt1.time().strftime("%H:%M:%S")  # Delivery arrival
-        t2 = dt2.time().strftime("%H:%M:%S")  # Delivery departure
-        t3 = dt3.time().strftime("%H:%M:%S")  # Home arrival
-
-        activities = []
-        legs = []
-
-        if (dt1 - dt0).days or (dt1 - dt0).seconds > (12 * 60 * 60):  # long journey - don't try to return
-            activities.append(Activity(uid, 0, 'depot', o, t1, t0))
-            legs.append(Leg(uid, 0, self.config.MODE, o, d, t0, t1, dist))
-            activities.append(Activity(uid, 1, 'delivery', d, t1, t0))
-        else:
-            if dt0.time() < dt2.time():  # Regular sequence with delivery end time after depo departure
-                activities.append(Activity(uid, 0, 'depot', o, t3, t0))
-                legs.append(Leg(uid, 0, self.config.MODE, o, d, t0, t1, dist))
-                activities.append(Activity(uid, 1, 'delivery', d, t1, t2))
-                legs.append(Leg(uid, 1, self.config.MODE, d, o, t2, t3, dist))
-                activities.append(Activity(uid, 2, 'depot', o, t3, t0))
-            else:  # sequence starting at delivery
-                activities.append(Activity(uid, 0, 'delivery', d, t1, t2))
-                legs.append(Leg(uid, 0, self.config.MODE, d, o, t2, t3, dist))
-                activities.append(Activity(uid, 1, 'depot', o, t3, t0))
-                legs.append(Leg(uid, 1, self.config.MODE, o, d, t0, t1, dist))
-                activities.append(Activity(uid, 2, 'delivery', o, t1, t2))
+    def build_plans(self, population, uids, o, d, seconds, dist):
+        """
+        Build depot-delivery plans from trip arrays and add them to the population.
+        Long journeys (over 12 hours) do not return to the depot. Otherwise plans start at the depot,
+        unless delivery ends before the depot departure time, when plans start with the delivery.
+        :param population: Population object
+        :param uids: list of agent uids
+        :param o: tuple of numpy arrays (x, y) of depot locations
+        :param d: tuple of numpy arrays (x, y) of delivery locations
+        :param seconds: tuple of numpy arrays of depot departure, delivery arrival, delivery
+        departure and depot arrival times, in seconds from start of day
+        :param dist: numpy array of trip distances
+        :return: None
+        """
+        s0, s1, s2, s3 = seconds
+        t0, t1, t2, t3 = [samplers.get_day_seconds(t) for t in seconds]
+        (ox, oy), (dx, dy) = o, d
+
+        long = np.floor(s1 - s0) > (12 * 60 * 60)  # long journey - don't try to return
+        reverse = ~long & ~(s0 % samplers.DAY_SECONDS < s2 % samplers.DAY_SECONDS)  # sequence starting at delivery
+
+        # activity slots for each plan, the final slot is not used for long journeys
+        act_types = np.array([
+            np.where(reverse, 'delivery', 'depot'),
+            np.where(reverse, 'depot', 'delivery'),
+            np.where(reverse, 'delivery', 'depot'),
+        ]).T
+        act_x = np.array([np.where(reverse, dx, ox), np.where(reverse, ox, dx), np.where(reverse, dx, ox)]).T
+        act_y = np.array([np.where(reverse, dy, oy), np.where(reverse, oy, dy), np.where(reverse, dy, oy)]).T
+        act_start = np.array([np.where(long | reverse, t1, t3), np.where(reverse, t3, t1), np.where(reverse, t1, t3)]).T
+        act_end = np.array([np.where(reverse, t2, t0), np.where(long | reverse, t0, t2), np.where(reverse, t2, t0)]).T
+        act_used = np.column_stack((np.ones((len(uids), 2), dtype=bool), ~long))
+
+        # leg slots for each plan, the final slot is not used for long journeys
+        leg_ox = np.array([np.where(reverse, dx, ox), np.where(reverse, ox, dx)]).T
+        leg_oy = np.array([np.where(reverse, dy, oy), np.where(reverse, oy, dy)]).T
+        leg_dx = np.array([np.where(reverse, ox, dx), np.where(reverse, dx, ox)]).T
+        leg_dy = np.array([np.where(reverse, oy, dy), np.where(reverse, dy, oy)]).T
+        leg_start = np.array([np.where(reverse, t2, t0), np.where(reverse, t0, t2)]).T
+        leg_end = np.array([np.where(reverse, t3, t1), np.where(reverse, t1, t3)]).T
+        leg_used = np.column_stack((np.ones(len(uids), dtype=bool), ~long))
+
+        acts = {
+            'seq': np.broadcast_to(np.arange(3), act_used.shape)[act_used],
+            'act': act_types[act_used],
+            'x': act_x[act_used],
+            'y': act_y[act_used],
+            'start': act_start[act_used],
+            'end': act_end[act_used],
+        }
+        legs = {
+            'seq': np.broadcast_to(np.arange(2), leg_used.shape)[leg_used],
+            'mode': self.config.MODE,
+            'ox': leg_ox[leg_used],
+            'oy': leg_oy[leg_used],
+            'dx': leg_dx[leg_used],
+            'dy': leg_dy[leg_used],
+            'start': leg_start[leg_used],
+            'end': leg_end[leg_used],
+            'dist': np.broadcast_to(dist[:, None], leg_used.shape)[leg_used],
+        }
 
         tag = self.config.SOURCE
-        plan = [Plan(activities, legs, tag)]
         keys = (
             'source', 'subpopulation', 'hsize', 'car', 'inc', 'hstr', 'gender', 'age', 'race', 'license', 'job', 'occ')
-        values = [tag] * len(keys)
-        attribute_dic = dict(zip(keys, values))
+        attributes = dict.fromkeys(keys, tag)
 
-        return Agent(uid, plan, attribute_dic)
+        population.add_plans(uids, attributes, tag, act_used.sum(axis=1), acts, leg_used.sum(axis=1), legs)
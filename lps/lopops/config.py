@@ -54,6 +54,7 @@ class LoPopSConfig(GlobalConfig):
         self.EPSG = global_config.EPSG
         self.SEED = global_config.SEED
         self.VERBOSE = global_config.VERBOSE
+        self.WORKERS = global_config.WORKERS
         self.OUTPATH = global_config.OUTPATH
         self.XMLPATH = global_config.XMLPATH
         self.XMLPATHATTRIBS = global_config.XMLPATHATTRIBS
@@ -84,5 +85,6 @@ class LoPopSConfig(GlobalConfig):
             'demand': self.INPUTPATH,
             'attributes': self.ATTRIBPATH,
             'zones_path': self.ZONESPATH,
-            'dummies': self.DUMMIES
+            'dummies': self.DUMMIES,
+            'workers': self.WORKERS
         }
@@ -1,8 +1,12 @@
-from lps.core import samplers
-from lps.core.population import Population, Agent, Plan, Activity, Leg
+from lps.core import samplers, zones, shared
+from utils import persistence
+from lps.core.population import Population
 from halo import Halo
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
 import pandas as pd
-import geopandas as gp
+
+SHARD_PLANS = 10000  # plans per unit of work, fixed so that output does not depend on the number of workers
 
 
 class Data:
@@ -14,9 +18,10 @@ class Data:
         print('\n--------- Initiating LoPopS Population Input ---------')
         self.config = config
         self.zones = self.load_zones()
+        self.zone_index = zones.load_zone_index(self.zones, config.ZONESPATH, config.EPSG, 'ZoneID')
         self.attributes = self.load_attributes()
-        self.df = self.prepare()
         self.num_plans = None
+        self.plans = self.prepare()
         self.sampler = None
         print('Input Synthesis Loaded:')
         print("\t> pop inputs from: {}".format(config.INPUTPATH))
@@ -29,10 +34,7 @@ class Data:
         :return: GeoPandas GeoDataFrame
         """
         with Halo(text='Loading zone data...', spinner='dots') as spinner:
-            gdf = gp.read_file(self.config.ZONESPATH)
-            if not gdf.crs.get('init') == self.config.EPSG:
-                spinner.text = 'converting zones to espg:{}'.format(self.config.EPSG)
-                gdf = gdf.to_crs(epsg=self.config.EPSG)
+            gdf = zones.load_zones(self.config.ZONESPATH, self.config.EPSG)
             gdf = gdf.set_index('ZoneID')
             spinner.succeed('{} zones loaded'.format(len(gdf)))
         return gdf
@@ -42,7 +44,7 @@ class Data:
         :return: Pandas DataFrame
         """
         with Halo(text='Loading data...', spinner='dots') as spinner:
-            df = pd.read_csv(self.config.INPUTPATH)  # load csv data
+            df = pd.read_csv(persistence.local_path(self.config.INPUTPATH))  # load csv data
             spinner.succeed('{} trips loaded'.format(len(df)))
         return df
 
@@ -51,35 +53,46 @@ class Data:
         :return: Pandas DataFrame
         """
         with Halo(text='Loading attributes data...', spinner='dots') as spinner:
-            df = pd.read_csv(self.config.ATTRIBPATH, index_col='recID')  # load csv data
+            df = pd.read_csv(persistence.local_path(self.config.ATTRIBPATH), index_col='recID')  # load csv data
             spinner.succeed('{} attributes loaded'.format(len(df)))
         return df
 
     def prepare(self):
         """
-        Method for returning parsed trip
-        :return: list of Plan Objects
+        Sort trips and infer plan templates for all input plans
+        :return: PlanTemplates
         """
         df = self.load()
 
         with Halo(text='Preparing data...', spinner='dots') as spinner:
-            df = df.sort_values(['tpid', 'tseqno'])
+            df = df.sort_values(['tpid', 'tseqno'], kind='mergesort')
             spinner.text = 'population data sorted'
-            df = df.groupby('tpid')
-            self.num_plans = len(df)
-            spinner.succeed('raw trip data sorted and grouped into {} plans'.format(self.num_plans))
+            plans = PlanTemplates(self.config, df)
+            self.num_plans = len(plans)
+            plans.attributes = self.plan_attributes(plans.tpids)
+            spinner.succeed('raw trip data sorted and inferred as {} plans'.format(self.num_plans))
 
-        return df
+        if self.config.VERBOSE:
+            print(df.loc[:, ['tpid', 'tseqno', 'mdname', 'dpurp', 'tstime', 'tetime']].head(20))
+
+        return plans
+
+    def plan_attributes(self, tpids):
+        """
+        Get person attributes for each plan
+        :param tpids: array of plan tpids
+        :return: Pandas DataFrame, with a row for each tpid
+        """
+        attributes = self.attributes.loc[tpids].iloc[:, 2:].copy()
+        attributes['source'] = self.config.SOURCE
+        subpopulation = attributes['inc'].astype(str)
+        attributes['subpopulation'] = subpopulation.where(attributes['car'] != 'car0', subpopulation + '_nocar')
+        return attributes.reset_index(drop=True)
 
     def sample(self, sampler, population=None):
         """
-        Sample from the input plans data:
-        1) Initiate Sampler to keep track of sampling
-        2) Loop through all plans
-        3) Get attributes for person
-        4) Initiate a Parser with plan
-        5) Sample from the Parser
-        6) Add returned People to the Population
+        Sample from the input plans data, adding shard populations (see sample_chunks) to the
+        Population in tpid order.
 
         :param sampler: Sampler object
         :param population: Population object
@@ -89,204 +102,311 @@ class Data:
             print('Creating new population object')
             population = Population()
 
-        self.sampler = sampler
-
         with Halo(text='Sampling...', spinner='dots') as spinner:
-            for index, (tpid, day_plan) in enumerate(self.df):
-                spinner.text = '{} plans sampled'.format(sampler.sample_count)
-
-                # Get attributes for tpid
-                pid_attributes = dict(self.attributes.loc[tpid][2:])
-
-                # Initiate the parser for the tpid
-                parser = Parser(self.config, tpid, day_plan, self.zones, pid_attributes)
-
-                # Sample for the parser using the sampler, not that may return no people
-                # The sampler keeps track of sampling for all instances of the parser
-                people = parser.sample(self.sampler)
+            for shard_population in self.sample_chunks(sampler):
+                population.add_agents(shard_population)
+                spinner.text = '{} plans sampled'.format(len(population.uids))
 
-                # add sampled people (with plan) to the population
-                if people:
-                    population.agents.extend(people)
-                if self.config.LIMIT and (sampler.sample_count >= self.config.LIMIT):  # break if limit exceeded
-                    spinner.succeed('limit reached: {} plans sampled'.format(sampler.sample_count))
-                    break
+            if self.config.LIMIT and (sampler.sample_count >= self.config.LIMIT):
+                spinner.succeed('limit reached: {} plans sampled'.format(sampler.sample_count))
         spinner.succeed('{} plans sampled'.format(sampler.sample_count))
         return population
 
+    def sample_chunks(self, sampler):
+        """
+        Sample from the input plans data:
+        1) Sample people from each plan using frequency weighting (to the Config limit)
+        2) Partition sampled people into shards by tpid range
+        3) Build plans for each shard, sampling activity locations from the shard's own stream,
+        either serially or across a pool of worker processes (config WORKERS)
 
-class Parser:
-    """
-    Intermediate object for holding trip info that can then be sampled
-    """
-
-    def __init__(self, config, tpid, df, zones, attributes):
-        self.config = config
-        self.tpid = tpid
-        self.df = df
-        self.zones = zones
-        self.dummy = None
-        self.first = df.iloc[0]
-        self.freq = self.first.Freq16
-        self.attributes = attributes
+        :param sampler: Sampler object
+        :return: generator of Population objects, one for each shard in tpid order
+        """
+        self.sampler = sampler
+        freq = self.plans.freq
         if self.config.NOFREQ:
-            self.freq = 1
+            freq = np.ones(len(self.plans), dtype=np.int64)
 
-        self.num_trips = len(df.Freq16)
+        # number of people sampled from each plan, numbered within their plan
+        counts, persons = sampler.sample_counts(freq)
+        shards = self.build_shards(counts, persons)
+        print('> {} plan shards to sample using {} worker(s)'.format(len(shards), self.config.WORKERS))
+        return self.sample_shards(shards)
 
-    def sample(self, sampler):
+    def build_shards(self, counts, persons):
         """
-
-        :param sampler:
-        :param count:
-        :param sample_count:
-        :return:
+        Partition sampled people into independent work units of SHARD_PLANS consecutive plans.
+        Shards without people are skipped.
+        :param counts: array of number of people sampled from each plan
+        :param persons: array of each person's number within their plan
+        :return: list of PlanShard
         """
-        people = []
-        for person in range(self.freq):  # generate person and plan using frequency weighting
-
-            if sampler.sample():  # Checks for sample and updates sampler counts
-                people.append(self.parse(person))
+        person_plans = np.repeat(np.arange(len(counts)), counts)
+        bounds = np.searchsorted(person_plans, np.arange(0, len(counts) + SHARD_PLANS, SHARD_PLANS))
+        shards = []
+        for shard_no, (start, end) in enumerate(zip(bounds[:-1], bounds[1:])):
+            if end > start:
+                shards.append(PlanShard(
+                    shard_no,
+                    person_plans[start:end],
+                    persons[start:end],
+                    samplers.seed_sequence(self.config.SEED, self.config.SOURCE, shard_no)
+                ))
+        return shards
+
+    def sample_shards(self, shards):
+        """
+        Generate a Population for each shard, in shard order.
+        :param shards: list of PlanShard
+        :return: generator of Population Objects
+        """
+        if self.config.WORKERS > 1 and len(shards) > 1:
+            zone_index = self.zone_index.share()  # attached by workers rather than copied
+            try:
+                with ProcessPoolExecutor(
+                        max_workers=self.config.WORKERS,
+                        mp_context=shared.process_context(),
+                        initializer=init_worker,
+                        initargs=(self.config, self.plans, zone_index)
+                ) as executor:
+                    ahead = 2 * self.config.WORKERS  # bound populations held awaiting output
+                    for shard_population in shared.ordered_map(executor, sample_shard_worker, shards, ahead):
+                        yield shard_population
+            finally:
+                zone_index.shared.unlink()
+        else:
+            for shard in shards:
+                yield sample_shard(self.config, self.plans, self.zone_index, shard)
+
+
+class PlanShard:
+    """
+    Unit of work of sampled people from a range of plans, with its own random stream.
+    """
 
-            if self.config.LIMIT and (sampler.sample_count >= self.config.LIMIT):
-                break
+    def __init__(self, shard_no, plans, persons, seed):
+        self.shard_no = shard_no
+        self.plans = plans
+        self.persons = persons
+        self.seed = seed
 
-        return people  # can sample be safely removed from this loop?
 
-    def parse(self, person):
-        """
-        Method to initiate parse
-        :param person: integer
-        :return: Person Object for population
-        """
-        uid = self.config.PREFIX + str(self.tpid) + '_' + str(person)
-        return self.infer_plan(uid)
+def sample_shard(config, plans, zone_index, shard):
+    """
+    Build plans for the people of a single shard. Random numbers are drawn from the shard's own
+    stream so that results are independent of where and when the shard is sampled.
+    :param config: Config object
+    :param plans: PlanTemplates
+    :param zone_index: ZoneIndex for sampling points within zones
+    :param shard: PlanShard
+    :return: Population Object
+    """
+    rng = samplers.make_rng(shard.seed)
+    population = Population()
+    uids = [
+        config.PREFIX + str(tpid) + '_' + str(person)
+        for tpid, person in zip(plans.tpids[shard.plans].tolist(), shard.persons.tolist())
+    ]
+    attributes = {key: column.values[shard.plans] for key, column in plans.attributes.items()}
+    act_counts, acts, leg_counts, legs = plans.build(shard.plans, zone_index, rng)
+    population.add_plans(uids, attributes, config.SOURCE, act_counts, acts, leg_counts, legs)
+    return population
+
+
+class PlanTemplates:
+    """
+    Activity and leg columns inferred from synthesised trips, for all input plans (tpids) at once.
+    Activity locations are held as zone ids, to be sampled as points for each person using the plan.
+    Rows for each plan are located using offsets (plans + 1) into the activity, leg and unique
+    location columns.
+    """
 
-    def infer_plan(self, uid):
+    def __init__(self, config, df):
         """
-        Method for inferring plans from synthesised trips
-        :param uid:
-        :return: Person Object for population
+        :param config: Config object
+        :param df: Pandas DataFrame of trips, sorted by tpid and tseqno
         """
-
-        if self.config.VERBOSE:
-            print(self.tpid)
-            print(uid)
-            print(self.freq)
-            print(self.num_trips)
-            print(self.df.loc[:, ['tpid', 'tseqno', 'mdname', 'dpurp', 'tstime', 'tetime']])
-
-        ozone = list(self.df.ozone)
-        dzone = list(self.df.dzone)
-        dpurp = list(self.df.dpurp)
-        mdname = list(self.df.mdname)
-        tstime = list(self.df.tstime)
-        tetime = list(self.df.tetime)
-
-        last_purpose = None
-        new_pair = False
-
-        act_locations = [None] * (self.num_trips + 1)
-        act_start_times = [None] * (self.num_trips + 1)
-        act_end_times = [None] * (self.num_trips + 1)
-        act_types = ['Home'] * (self.num_trips + 1)  # assumes home if no inference made
-
-        for t in range(self.num_trips):  # loop through trips
-            trip_purpose = dpurp[t]
-            act_locations[t] = ozone[t]  # get trip origin
-            act_start_times[t] = samplers.get_timestamp(tetime[t - 1])  # activity start time = prev trip end
-            act_end_times[t] = samplers.get_timestamp(tstime[t])
-
-            # TODO check/improve activity inference
-            # currently defaults to home. If new trip purpose is found then sets next activity to that purpose.
-            # If repeated trip purpose then assumes this is a return trip and defaults to home activity.
-            # Note that first activity will always be home in this case but that plan does not need to return home.
-            if trip_purpose != last_purpose or new_pair:
-                act_types[t + 1] = trip_purpose
-                new_pair = False
-            else:
-                new_pair = True
-
-            last_purpose = trip_purpose  # reset lookback
-
-        act_locations[-1] = dzone[-1]
-        act_start_times[-1] = samplers.get_timestamp(tetime[-1])
-        act_end_times[-1] = samplers.get_timestamp(tstime[0])
+        self.config = config
+        self.attributes = None
+
+        tpid = df.tpid.values
+        num_trips = len(tpid)
+        first = np.flatnonzero(np.concatenate(([True], tpid[1:] != tpid[:-1])))  # first trip of each plan
+        trip_counts = np.diff(np.concatenate((first, [num_trips])))
+        last = first + trip_counts - 1
+        num_plans = len(first)
+        trip_plans = np.repeat(np.arange(num_plans), trip_counts)
+
+        self.tpids = tpid[first]
+        self.freq = np.maximum(df.Freq16.values[first], 0).astype(np.int64)
+
+        # ----------- Activity slots -----------
+        # One activity at the origin of each trip plus a final activity at the last destination
+        slot_offsets = np.concatenate(([0], np.cumsum(trip_counts + 1)))
+        trip_slots = np.arange(num_trips) + trip_plans
+        final_slots = slot_offsets[1:] - 1
+
+        # TODO check/improve activity inference
+        # Activities default to home. If new trip purpose is found then sets next activity to that purpose.
+        # If repeated trip purpose then assumes this is a return trip and defaults to home activity, so
+        # that within a run of repeated purposes, alternate trips are assumed to return home.
+        # Note that first activity will always be home in this case but that plan does not need to return home.
+        purpose = df.dpurp.values
+        run_starts = np.concatenate(([True], purpose[1:] != purpose[:-1]))
+        run_starts[first] = True
+        positions = np.arange(num_trips)
+        run_positions = positions - np.maximum.accumulate(np.where(run_starts, positions, 0))
+        act_types = np.full(num_trips + num_plans, 'Home', dtype=object)  # assumes home if no inference made
+        act_types[trip_slots + 1] = np.where(run_positions % 2 == 0, purpose, 'Home')
+
+        zone_ids = np.empty(num_trips + num_plans, dtype=df.ozone.values.dtype)
+        zone_ids[trip_slots] = df.ozone.values
+        zone_ids[final_slots] = df.dzone.values[last]
+
+        # activity start time = prev trip end (last trip end for first activity)
+        trip_starts = samplers.get_timestamp_seconds_array(df.tstime.values)
+        trip_ends = samplers.get_timestamp_seconds_array(df.tetime.values)
+        previous = positions - 1
+        previous[first] = last
+        act_starts = np.empty(num_trips + num_plans, dtype=np.int64)
+        act_ends = np.empty(num_trips + num_plans, dtype=np.int64)
+        act_starts[trip_slots] = trip_ends[previous]
+        act_ends[trip_slots] = trip_starts
+        act_starts[final_slots] = trip_ends[last]
+        act_ends[final_slots] = trip_starts[first]
 
         # ----------- Force home -----------
         if self.config.FORCEHOME:
-            act_types[-1] = 'Home'
+            act_types[final_slots] = 'Home'
 
         # ----------- Deal with dummy legs -----------
-        num_trips = self.num_trips
+        keep = np.ones(num_trips + num_plans, dtype=bool)
+        dummies = np.zeros(num_plans, dtype=bool)
         if not self.config.DUMMIES:
-            if self.first.dpurp == 'dummy':
-                del act_types[1]
-                del act_locations[1]
-                del act_start_times[1]
-                del act_end_times[1]
-                num_trips = num_trips - 1
-
-        # ----------- Build unique location coordinates -----------
-
-        # Build unique locations for each unique activity (so that 'home' is always same coords for example)
-        # Note that any repeat of same activity in same zone should repeat coordinates
-        act_pairs = list(zip(act_types, act_locations))
-        act_uniques = list(set(act_pairs))
-        act_points = [samplers.sample_point(loc, self.zones) for (act, loc) in act_uniques]
-        act_loc_dict = dict(zip(act_uniques, act_points))
-        act_points = [act_loc_dict.get(p) for p in act_pairs]
+            dummies = purpose[first] == 'dummy'
+            keep[slot_offsets[:-1][dummies] + 1] = False
+
+        self.act_counts = trip_counts + 1 - dummies
+        self.act_offsets = np.concatenate(([0], np.cumsum(self.act_counts)))
+        act_plans = np.repeat(np.arange(num_plans), self.act_counts)
+        act_types = act_types[keep]
+        zone_ids = zone_ids[keep]
+
+        # activities are numbered by position, except the final activity which is numbered by trip count
+        act_seq = np.arange(len(act_plans)) - self.act_offsets[act_plans]
+        act_seq[self.act_offsets[1:] - 1] = trip_counts
+
+        # ----------- Build unique locations -----------
+        # Unique locations for each unique activity in each plan (so that 'home' is always same coords
+        # for example). Note that any repeat of same activity in same zone should repeat coordinates.
+        pairs = pd.DataFrame({'plan': act_plans, 'act': pd.factorize(act_types)[0], 'zone': zone_ids})
+        unique_ids = pairs.groupby(['plan', 'act', 'zone'], sort=False).ngroup().values  # by first occurrence
+        firsts = ~pairs.duplicated().values
+        self.unique_zones = zone_ids[firsts]
+        self.unique_offsets = np.concatenate(([0], np.cumsum(np.bincount(act_plans[firsts], minlength=num_plans))))
 
         # ----------- Convert to MATSIM -----------
+        act_dict = self.config.ACTIVITYMAP
+        self.acts = {
+            'seq': act_seq,
+            'act': pd.Series(act_types).map(act_dict).fillna('other').values,
+            'unique': unique_ids - self.unique_offsets[act_plans],
+            'start': act_starts[keep],
+            'end': act_ends[keep],
+        }
+
+        # ----------- Legs -----------
+        # Legs join consecutive activities, with the mode of the trip at the same position
+        self.leg_counts = self.act_counts - 1
+        self.leg_offsets = np.concatenate(([0], np.cumsum(self.leg_counts)))
+        leg_plans = np.repeat(np.arange(num_plans), self.leg_counts)
+        leg_seq = np.arange(len(leg_plans)) - self.leg_offsets[leg_plans]
+        origins = self.act_offsets[leg_plans] + leg_seq
+
         mode_dict = self.config.MODEMAP
         if self.config.ALLCARS:
             mode_dict = {}
-        t_modes = [mode_dict.get(m, 'car') for m in mdname]  # default to car
+        modes = df.mdname.values[first[leg_plans] + leg_seq]
+        self.legs = {
+            'seq': leg_seq,
+            'mode': pd.Series(modes).map(mode_dict).fillna('car').values,  # default to car
+            'start': self.acts['end'][origins],
+            'end': self.acts['start'][origins + 1],
+        }
+
+    def __len__(self):
+        return len(self.tpids)
+
+    def build(self, plans, zone_index, rng):
+        """
+        Build activity and leg columns for people using the given plans. Unique activity locations
+        are sampled as points for each person.
+        :param plans: array of plan index for each person
+        :param zone_index: ZoneIndex for sampling points within zones
+        :param rng: numpy Generator
+        :return: tuple of (activity counts, activity columns, leg counts, leg columns)
+        """
+        act_counts = self.act_counts[plans]
+        leg_counts = self.leg_counts[plans]
+        unique_counts = np.diff(self.unique_offsets)[plans]
+        act_rows = expand_offsets(self.act_offsets, plans)
+        leg_rows = expand_offsets(self.leg_offsets, plans)
+
+        xs, ys = zone_index.sample(self.unique_zones[expand_offsets(self.unique_offsets, plans)], rng)
+        person_uniques = np.cumsum(unique_counts) - unique_counts
+        points = np.repeat(person_uniques, act_counts) + self.acts['unique'][act_rows]
+        act_x = xs[points]
+        act_y = ys[points]
+
+        person_acts = np.cumsum(act_counts) - act_counts
+        origins = np.repeat(person_acts, leg_counts) + self.legs['seq'][leg_rows]
+        ox, oy = act_x[origins], act_y[origins]
+        dx, dy = act_x[origins + 1], act_y[origins + 1]
+
+        acts = {
+            'seq': self.acts['seq'][act_rows],
+            'act': self.acts['act'][act_rows],
+            'x': act_x,
+            'y': act_y,
+            'start': self.acts['start'][act_rows],
+            'end': self.acts['end'][act_rows],
+        }
+        legs = {
+            'seq': self.legs['seq'][leg_rows],
+            'mode': self.legs['mode'][leg_rows],
+            'ox': ox,
+            'oy': oy,
+            'dx': dx,
+            'dy': dy,
+            'start': self.legs['start'][leg_rows],
+            'end': self.legs['end'][leg_rows],
+            'dist': np.hypot(dx - ox, dy - oy),
+        }
+        return act_counts, acts, leg_counts, legs
+
+
+def expand_offsets(offsets, groups):
+    """
+    Row indices of the given groups, concatenated in order.
+    :param offsets: array (groups + 1) of start positions of each group
+    :param groups: array of group indices
+    :return: numpy array of row indices
+    """
+    counts = offsets[groups + 1] - offsets[groups]
+    ends = np.cumsum(counts)
+    return np.arange(ends[-1] if len(ends) else 0) + np.repeat(offsets[groups] - (ends - counts), counts)
 
-        act_dict = self.config.ACTIVITYMAP
-        act_types = [act_dict.get(a, 'other') for a in act_types]
-
-        # ----------- Build plan objects -----------
-        activities = []
-        legs = []
-        for t in range(num_trips):
-            activities.append(Activity(uid,
-                                       t,
-                                       act_types[t],
-                                       act_points[t],
-                                       act_start_times[t],
-                                       act_end_times[t]))
-            legs.append(Leg(uid,
-                            t,
-                            t_modes[t],
-                            act_points[t],
-                            act_points[t + 1],
-                            act_end_times[t],
-                            act_start_times[t + 1],
-                            samplers.get_approx_distance(act_points[t], act_points[t + 1])
-                            )
-                        )
-
-            if self.config.VERBOSE:
-                print(activities[t].report())
-                print(legs[t].report())
-
-        # Get final activity
-        activities.append(Activity(uid,
-                                   self.num_trips,
-                                   act_types[-1],
-                                   act_points[-1],
-                                   act_start_times[-1],
-                                   act_end_times[-1]))
-        if self.config.VERBOSE:
-            print(activities[-1].report())
 
-        tag = self.config.SOURCE
-        plan = [Plan(activities, legs, tag)]
-        self.attributes['source'] = self.config.SOURCE
-        subpopulation = self.attributes['inc']
-        if self.attributes['car'] == 'car0':
-            subpopulation += '_nocar'
-        self.attributes['subpopulation'] = subpopulation
+# Worker process state, set once per worker by the pool initializer to avoid pickling
+# the plan templates and attributes for every shard (zone tables are shared)
+_worker_state = None
+
+
+def init_worker(config, plans, zone_index):
+    global _worker_state
+    _worker_state = (config, plans, zone_index)
+
 
-        return Agent(uid, plan, self.attributes)
+def sample_shard_worker(shard):
+    return sample_shard(*_worker_state, shard)
@@ -3,7 +3,8 @@ import click
 
 from lps.config import GlobalConfig
 from lps.factory import synth_map
-from lps.core import output, population
+from lps.core import output, population, checkpoints, prefetch
+from lps import pipeline
 
 
 CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
@@ -14,7 +15,12 @@ CONTEXT_SETTINGS = dict(help_option_names=["-h", "--help"])
     'config_path',
     type=str
 )
-def cli(config_path):
+@click.option(
+    '--resume',
+    is_flag=True,
+    help='Use valid source checkpoints from a previous build, rather than sampling those sources again.'
+)
+def cli(config_path, resume):
 
     print('\n========================================================')
     print(' ------------------------ MIMI ------------------------- ')
@@ -37,16 +43,29 @@ def cli(config_path):
     if not value.lower() == 'y':
         sys.exit('Cancelled population build.')
 
-    for source, config in configurations.items():
-
-        source_data = synth_map[source]['input'](config)
-        sampler = synth_map[source]['sampler'](config)
-        source_population = source_data.sample(sampler)
-        source_population.make_records(config)
-        output.print_records(source_population.records)
-        final_population.add_agents(source_population)
-
-        # TODO can implement caching of final_population to disk just in case
+    with prefetch.Prefetcher(configurations, global_config.PREFETCH_THREADS):  # overlap input I/O with sampling
+
+        if global_config.STREAM:  # build and write population in chunks
+            if resume:
+                print('\t> warning: --resume is not supported for streaming builds, all sources will be sampled')
+            records = pipeline.build(configurations, global_config)
+            output.print_records(records)
+            print('\nDone\n')
+            return
+
+        for source, config in configurations.items():
+
+            source_population = checkpoints.load(config) if resume else None
+            if source_population is not None:
+                print(f'\tResuming {source} from checkpoint')
+            else:
+                source_data = synth_map[source]['input'](config)
+                sampler = synth_map[source]['sampler'](config)
+                source_population = source_data.sample(sampler)
+                source_population.make_records(config)
+                checkpoints.save(source_population, config)  # so that a failed build can be resumed
+            output.print_records(source_population.records)
+            final_population.add_agents(source_population)
 
     print('\tCompleted Population Build')
 
@@ -1,5 +1,4 @@
 from shapely.geometry import Point
-from pyproj import Proj, transform
 import pandas as pd
 from halo import Halo
 import s2sphere as s2
@@ -7,6 +6,7 @@ import s2sphere as s2
 # custom
 from utils import s2_geo_toolkit_ftns as s2_tools, aws_cognito_ftns, persistence, osm_ftns
 from lps.core.population import Plan, Leg, Activity, Population, Agent
+from lps.core import projections
 
 
 # these are the s2 cells as ripped from Region Coverer, which cover London
@@ -292,7 +292,5 @@ def make_attributes():
             'subpopulation': subpopulation}
 
 
-def project_lat_lon_to_27700(lon,lat):
-    outProj = Proj(init='epsg:27700')
-    inProj = Proj(init='epsg:4326')
-    return transform(inProj,outProj,lon,lat)
+def project_lat_lon_to_27700(lon, lat):
+    return projections.transform_point(lon, lat, projections.WGS84, 27700)
@@ -157,6 +157,7 @@ class MotionConfig(GlobalConfig):
         self.EPSG = global_config.EPSG
         self.SEED = global_config.SEED
         self.VERBOSE = global_config.VERBOSE
+        self.WORKERS = global_config.WORKERS
         self.OUTPATH = global_config.OUTPATH
         self.XMLPATH = global_config.XMLPATH
         self.XMLPATHATTRIBS = global_config.XMLPATHATTRIBS
@@ -206,5 +207,6 @@ class MotionConfig(GlobalConfig):
             'norm': self.NORM,
             'demand': self.DEMANDPATH,
             'zones_path': self.ZONESPATH,
-            'filter_path': self.FILTERPATH
+            'filter_path': self.FILTERPATH,
+            'workers': self.WORKERS
         }
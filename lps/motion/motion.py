@@ -1,11 +1,15 @@
 import pandas as pd
 import numpy as np
-import geopandas as gp
 from halo import Halo
 import os
+import copy
+from functools import partial
+from datetime import time
+from concurrent.futures import ProcessPoolExecutor
+from shapely.geometry import Point
 from utils import persistence
 
-from lps.core import samplers, generators
+from lps.core import samplers, generators, zones, matrices, shared
 from lps.core.population import Population, Agent, Plan, Activity, Leg
 
 
@@ -23,7 +27,9 @@ class Demand:
         # self.return_factors = PeriodFactors(self.config, self.config.RETURNFACTORPATH)
 
         self.zones, self.regions_map = self.load_zones()
+        self.zone_index = zones.load_zone_index(self.zones, config.ZONESPATH, config.EPSG, 'Sequential_9_1')
         self.filter = self.add_filter()
+        self.filter_key = matrices.filter_key('commuters', self.filter.outside_ids, self.filter.inside_ids)
 
         print('Input Demand Loaded:')
         print("\t> outputs using epsg:{}".format(config.EPSG))
@@ -33,7 +39,10 @@ class Demand:
 
     def sample(self, sampler, population=None):
         """
-        Adds a sample of the demand to the input Population Object, using the input Sampler Object
+        Adds a sample of the demand to the input Population Object, using the input Sampler Object.
+        Each tour, mode and demand segment combination is sampled independently (with its own stream),
+        either serially or across a pool of worker processes (config WORKERS). Segment populations
+        are merged in a stable order so that output does not depend on the number of workers.
         :param sampler:
         :param population:
         :return: Population Object
@@ -42,19 +51,51 @@ class Demand:
             print('Creating new population object')
             population = Population()
 
-        total_count = 0
+        with Halo(text='building demand segments and sampling...', spinner='dots') as spinner:
+            for segment_population in self.sample_chunks(sampler):
+                population.add_agents(segment_population)
+                spinner.text = '{} samples taken'.format(sampler.counter)
 
-        for tour in self.config.TOURS:
+            spinner.succeed("{} samples taken".format(sampler.counter))
+        return population
 
-            activity = self.config.TOURSACTIVITYMAP[tour]
+    def sample_chunks(self, sampler):
+        """
+        Generate populations for each demand segment, in stable segment order, applying the
+        Config limit and assigning unique ids.
+        :param sampler: DemandSampler
+        :return: generator of Population Objects
+        """
+        segments = self.build_segments()
+        print('> {} demand segments to sample using {} worker(s)'.format(len(segments), self.config.WORKERS))
 
-            for mode_key in self.config.MODES:
+        total_count = 0
+        for segment, segment_population in zip(segments, self.sample_segments(segments, sampler)):
+
+            keep = sampler.apply_limit(len(segment_population.uids))
+            if keep < len(segment_population.uids):
+                segment_population = segment_population.slice(0, keep)
+
+            # Assign unique ids in stable segment order
+            mode = self.config.MODESMAP[segment.mode_key]
+            segment_population.uids = [
+                '{}_{}_{}_{}'.format(self.config.PREFIX, total_count + trip + 1, segment.tour, mode)
+                for trip in range(keep)
+            ]
+            total_count += keep
+            yield segment_population
+
+    def build_segments(self):
+        """
+        Build list of independent work units, one for each tour, mode and demand segment combination.
+        :return: list of SegmentDemand
+        """
+        segments = []
+        for tour in self.config.TOURS:
 
-                print('> segmentation for {} {}'.format(tour, mode_key))
+            tour_segment_key = self.config.TOURSSEGMENTMAP.get(tour)
 
-                tour_segment_key = self.config.TOURSSEGMENTMAP.get(tour)
-                tour_factor_key = self.config.TOURSFACTORSMAP.get(tour)
-                mode = self.config.MODESMAP[mode_key]
+            for mode_key in self.config.MODES:
 
                 # Find base demand matrices
                 demand_path = os.path.join(self.config.DEMANDPATH, tour, mode_key)
@@ -66,125 +107,205 @@ class Demand:
                 #
                 # assert num_segments == len(demand_segments)  # check that number of matrices == number of segments
 
-                # Build demand object for each segment
+                for n, (demand_segment, (seg_no, attribute_series)) in enumerate(zip(demand_segments, attributes.iterrows())):
+
+                    assert n == seg_no
+
+                    segments.append(SegmentDemand(
+                        tour,
+                        mode_key,
+                        seg_no,
+                        os.path.join(demand_path, demand_segment),
+                        attribute_series,
+                        samplers.seed_sequence(self.config.SEED, self.config.SOURCE, tour, mode_key, seg_no)
+                    ))
+        return segments
+
+    def sample_segments(self, segments, sampler):
+        """
+        Generate a Population for each segment, in segment order.
+        :param segments: list of SegmentDemand
+        :param sampler: DemandSampler
+        :return: generator of Population Objects
+        """
+        adjustment = sampler.adjustment
+        if self.config.WORKERS > 1:
+            zone_index = self.zone_index.share()  # attached by workers rather than copied
+            try:
+                with ProcessPoolExecutor(
+                        max_workers=self.config.WORKERS,
+                        mp_context=shared.process_context(),
+                        initializer=init_worker,
+                        initargs=(self.worker_demand(zone_index),)
+                ) as executor:
+                    ahead = 2 * self.config.WORKERS  # bound populations held awaiting output
+                    worker = partial(sample_segment_worker, adjustment=adjustment)
+                    for segment_population in shared.ordered_map(
+                            executor, worker, segments, ahead,
+                            stop=lambda: sampler.hit_limit  # no need to sample further segments
+                    ):
+                        yield segment_population
+            finally:
+                zone_index.shared.unlink()
+        else:
+            for segment in segments:
+                if sampler.hit_limit:  # no need to sample further segments
+                    return
+                yield self.sample_segment(segment, adjustment)
 
-                with Halo(text='building demand segments and sampling...', spinner='dots') as spinner:
-                    for n, (demand_segment, (seg_no, attribute_series)) in enumerate(zip(demand_segments, attributes.iterrows())):
+    def worker_demand(self, zone_index):
+        """
+        Copy of demand inputs for worker processes, without zone geometries and using the given
+        (shared) zone index.
+        :param zone_index: ZoneIndex
+        :return: Demand
+        """
+        demand = copy.copy(self)
+        demand.zones = None
+        demand.zone_index = zone_index
+        return demand
 
-                        assert n == seg_no
+    def sample_segment(self, segment, adjustment):
+        """
+        Sample plans for a single tour, mode and demand segment combination. Random numbers are drawn
+        from the segment's own stream so that results are independent of where and when the segment
+        is sampled.
+        Agent uids are temporary and are assigned when segments are merged.
+        :param segment: SegmentDemand
+        :param adjustment: sample adjustment (ie sample percentage / 100)
+        :return: Population Object
+        """
+        rng = samplers.make_rng(segment.seed)
+
+        population = Population()
+
+        tour = segment.tour
+        mode_key = segment.mode_key
+        activity = self.config.TOURSACTIVITYMAP[tour]
+        tour_factor_key = self.config.TOURSFACTORSMAP.get(tour)
+        mode = self.config.MODESMAP[mode_key]
+
+        # get income
+        car = segment.attributes.car
+        gender = segment.attributes.gender
+        job = segment.attributes.job
+        occ = segment.attributes.occ
+        income = segment.attributes.inc
+        income_mapped = self.config.INCOMEMAP.get(income, 'All')
+
+        # Build period factors
+        outbound_factors = self.outbound_factors.get_factor_map(tour_factor_key, mode_key, income_mapped)
+        # return_factors = self.return_factors.get_factor_map(tour_factor_key, mode_key, income)
+
+        # Build demand for segment
+        outbound_demand = DayDemand(self, segment.path, rng)
+        sample_demand = samplers.probability_rounder(outbound_demand.total_demand * adjustment, rng)
+
+        if not sample_demand:  # skip if no demand sampled
+            return population
+
+        outbound_demand.build_periods(outbound_factors)
+
+        out_periods = outbound_demand.period_sampler.sample_array(rng, sample_demand)
+        out_hours = np.empty(sample_demand, dtype=int)
+        return_hours = np.empty(sample_demand, dtype=int)
+        origin_zones = np.empty(sample_demand, dtype=int)
+        destination_zones = np.empty(sample_demand, dtype=int)
+
+        # Sample all trips for each outbound period at once
+        for out_period, period_demand in outbound_demand.period_demands.items():
+            mask = out_periods == out_period
+            period_count = int(mask.sum())
+            if not period_count:
+                continue
+
+            # Sample Outbound
+            out_hours[mask] = period_demand.hour_sampler.sample(rng, period_count)
+            ods = period_demand.od_sampler.sample_array(rng, period_count)
+            origin_zones[mask], destination_zones[mask] = ods[:, 0], ods[:, 1]
+
+            # Sample Inbound Time (from oposite period, ie am to pm return)
+            # return_period = return_demand.sampler.sample_exclude(out_period)
+            index = self.config.ALLPERIODS.index(out_period) - 2
+            return_period = list(self.config.PERIODTIMES.keys())[index]
+            return_hours[mask] = outbound_demand.period_demands[return_period].hour_sampler.sample(rng, period_count)
+
+        out_minutes = rng.integers(60, size=sample_demand)
+        return_minutes = rng.integers(60, size=sample_demand)
+
+        # Sample O-D points for all trips in segment
+        origin_xs, origin_ys = self.zone_index.sample(origin_zones, rng)
+        destination_xs, destination_ys = self.zone_index.sample(destination_zones, rng)
+
+        tag = '{}_{}'.format(self.config.SOURCE, tour)
+        default = 'unknown'
+        subpopulation = self.config.INCOMECONVERT.get(income, 'inc56')
+        if car == 'car0':
+            subpopulation += '_nocar'
+
+        for trip in range(sample_demand):
+
+            out_time = time(int(out_hours[trip]), int(out_minutes[trip]))
+            return_time = time(int(return_hours[trip]), int(return_minutes[trip]))
+            origin = Point(origin_xs[trip], origin_ys[trip])
+            destination = Point(destination_xs[trip], destination_ys[trip])
+
+            # Get distance between pairs (for approx. journey time)
+            distance = samplers.get_approx_distance(origin, destination)
+            journey_time = samplers.build_journey_time(distance, mode=mode)
+
+            # Build up leg datetimes (method prevents leg wrapping)
+            out_depart_dt, out_arrive_dt = samplers.build_trip_times(out_time, journey_time, 'forward')
+            return_depart_dt, return_arrive_dt = samplers.build_trip_times(return_time, journey_time, 'back')
+
+            # Build Plan
+            uid = str(trip)
+
+            t0 = samplers.get_seconds(out_depart_dt)  # Home departure
+            t1 = samplers.get_seconds(out_arrive_dt)  # Activity arrival
+            t2 = samplers.get_seconds(return_depart_dt)  # Activity departure
+            t3 = samplers.get_seconds(return_arrive_dt)  # Home arrival
+
+            activities = []
+            legs = []
+
+            if return_time > out_time:  # therefore no wrapping
+
+                activities.append(Activity(uid, 0, 'home', origin, t3, t0))
+                legs.append(Leg(uid, 0, mode, origin, destination, t0, t1, distance))
+                activities.append(Activity(uid, 1, activity, destination, t1, t2))
+                legs.append(Leg(uid, 1, mode, destination, origin, t2, t3, distance))
+                activities.append(Activity(uid, 2, 'home', origin, t3, t0))
+
+            else:  # eg a night shift - start with destination activity
+                activities.append(Activity(uid, 0, activity, destination, t1, t2))
+                legs.append(Leg(uid, 0, mode, destination, origin, t2, t3, distance))
+                activities.append(Activity(uid, 1, 'home', origin, t3, t0))
+                legs.append(Leg(uid, 1, mode, origin, destination, t0, t1, distance))
+                activities.append(Activity(uid, 2, activity, destination, t1, t2))
+
+            plan = [Plan(activities, legs, tag)]
+
+            # keys = (
+            #     'source', 'hsize', 'car', 'inc', 'hstr', 'gender', 'age', 'race', 'license', 'job',
+            #     'occ')
+
+            attribute_dic = {'source': tag,
+                             'subpopulation': subpopulation,
+                             'hsize': default,
+                             'car': car,
+                             'inc': income,
+                             'hstr': default,
+                             'gender': gender,
+                             'age': default,
+                             'race': default,
+                             'license': default,
+                             'job': job,
+                             'occ': occ
+                             }
+
+            population.agents.append(Agent(uid, plan, attribute_dic))
 
-                        # get income
-                        car = attribute_series.car
-                        gender = attribute_series.gender
-                        job = attribute_series.job
-                        occ = attribute_series.occ
-                        income = attribute_series.inc
-                        income_mapped = self.config.INCOMEMAP.get(income, 'All')
-
-                        spinner.text = 'building demand for segment {}: car:{} gender:{} job:{} occ:{} inc:{}'.format(n, car, gender, job, occ, income)
-
-                        # Build period factors
-                        outbound_factors = self.outbound_factors.get_factor_map(tour_factor_key, mode_key, income_mapped)
-                        # return_factors = self.return_factors.get_factor_map(tour_factor_key, mode_key, income)
-
-                        # Build path for segment demand
-                        full_path = os.path.join(demand_path, demand_segment)
-                        outbound_demand = DayDemand(self, full_path)
-                        sample_demand = sampler.get_sample_size(outbound_demand.total_demand)
-
-                        if not sample_demand:  # skip if no demand sampled
-                            spinner.text = 'skipping'
-                            continue
-
-                        outbound_demand.build_periods(outbound_factors)
-
-                        for trip in range(sample_demand):
-
-                            total_count += 1
-
-                            spinner.text = "sampling gender:car:{} gender:{} job:{} occ:{} inc:{}: {}/{}".format(car, gender, job, occ, income, trip + 1, sample_demand)
-
-                            # Sample Outbound
-                            [out_period] = outbound_demand.period_sampler.sample(n=1)
-                            [out_hour] = outbound_demand.period_demands[out_period].hour_sampler.sample()
-                            out_time = generators.gen_minute(out_hour)
-
-                            [(origin_zone, destination_zone)] = outbound_demand.period_demands[out_period].od_sampler.sample()
-                            # origin_zone, destination_zone = zones
-
-                            # Sample Inbound Time (from oposite period, ie am to pm return)
-                            # return_period = return_demand.sampler.sample_exclude(out_period)
-                            index = self.config.ALLPERIODS.index(out_period) - 2
-                            return_period = list(self.config.PERIODTIMES.keys())[index]
-                            [return_hour] = outbound_demand.period_demands[return_period].hour_sampler.sample()
-                            return_time = generators.gen_minute(return_hour)
-
-                            # Sample O-D points
-                            origin = samplers.sample_point(origin_zone, self.zones)
-                            destination = samplers.sample_point(destination_zone, self.zones)
-
-                            # Get distance between pairs (for approx. journey time)
-                            distance = samplers.get_approx_distance(origin, destination)
-                            journey_time = samplers.build_journey_time(distance, mode=mode)
-
-                            # Build up leg datetimes (method prevents leg wrapping)
-                            out_depart_dt, out_arrive_dt = samplers.build_trip_times(out_time, journey_time, 'forward')
-                            return_depart_dt, return_arrive_dt = samplers.build_trip_times(return_time, journey_time, 'back')
-
-                            # Build Plan
-                            uid = '{}_{}_{}_{}'.format(self.config.PREFIX, total_count, tour, mode)
-
-                            t0 = out_depart_dt.time().strftime("%H:%M:%S")  # Home departure
-                            t1 = out_arrive_dt.time().strftime("%H:%M:%S")  # Activity arrival
-                            t2 = return_depart_dt.time().strftime("%H:%M:%S")  # Activity departure
-                            t3 = return_arrive_dt.time().strftime("%H:%M:%S")  # Home arrival
-
-                            activities = []
-                            legs = []
-
-                            if return_time > out_time:  # therefore no wrapping
-
-                                activities.append(Activity(uid, 0, 'home', origin, t3, t0))
-                                legs.append(Leg(uid, 0, mode, origin, destination, t0, t1, distance))
-                                activities.append(Activity(uid, 1, activity, destination, t1, t2))
-                                legs.append(Leg(uid, 1, mode, destination, origin, t2, t3, distance))
-                                activities.append(Activity(uid, 2, 'home', origin, t3, t0))
-
-                            else:  # eg a night shift - start with destination activity
-                                activities.append(Activity(uid, 0, activity, destination, t1, t2))
-                                legs.append(Leg(uid, 0, mode, destination, origin, t2, t3, distance))
-                                activities.append(Activity(uid, 1, 'home', origin, t3, t0))
-                                legs.append(Leg(uid, 1, mode, origin, destination, t0, t1, distance))
-                                activities.append(Activity(uid, 2, activity, destination, t1, t2))
-
-                            tag = '{}_{}'.format(self.config.SOURCE, tour)
-                            plan = [Plan(activities, legs, tag)]
-
-                            # keys = (
-                            #     'source', 'hsize', 'car', 'inc', 'hstr', 'gender', 'age', 'race', 'license', 'job',
-                            #     'occ')
-
-                            default = 'unknown'
-                            subpopulation = self.config.INCOMECONVERT.get(income, 'inc56')
-                            if car == 'car0':
-                                subpopulation += '_nocar'
-                            attribute_dic = {'source': tag,
-                                             'subpopulation': subpopulation,
-                                             'hsize': default,
-                                             'car': car,
-                                             'inc': income,
-                                             'hstr': default,
-                                             'gender': gender,
-                                             'age': default,
-                                             'race': default,
-                                             'license': default,
-                                             'job': job,
-                                             'occ': occ
-                                             }
-
-                            population.agents.append(Agent(uid, plan, attribute_dic))
-
-                    spinner.succeed("{} samples taken".format(total_count))
         return population
 
     def load_xlsx(self, path):
@@ -192,7 +313,7 @@ class Demand:
         :return: dictionary of Pandas DataFrames
         """
         # xl_file = pd.ExcelFile(self.config.SEGMENTSPATH)
-        dfs = pd.read_excel(path, sheet_name=None)  # load xlsx data
+        dfs = pd.read_excel(persistence.local_path(path), sheet_name=None)  # load xlsx data
         return dfs
 
     def load_zones(self):
@@ -201,10 +322,7 @@ class Demand:
         :return: GeoPandas GeoDataFrame, dictionary
         """
         with Halo(text='loading zone data...', spinner='dots') as spinner:
-            gdf = gp.read_file(self.config.ZONESPATH)
-            if not gdf.crs.get('init') == self.config.EPSG:
-                spinner.text = 'converting zones to espg:{}'.format(self.config.EPSG)
-                gdf = gdf.to_crs(epsg=self.config.EPSG)
+            gdf = zones.load_zones(self.config.ZONESPATH, self.config.EPSG, repair=True)
 
             # Build zones-regions dict
             zone_ids = gdf.loc[:, 'Sequential_9_1']
@@ -214,45 +332,42 @@ class Demand:
             gdf = gdf.loc[:, ['Sequential_9_1', 'geometry']]
             gdf = gdf.set_index('Sequential_9_1')
 
-            spinner.text = 'buffering zone data'
-            gdf.geometry = gdf.buffer(0)
-
             spinner.succeed('{} zones loaded and buffered'.format(len(gdf)))
         return gdf, regions_map
 
-    def load_filter(self):
+    def add_filter(self):
         """
-        Load filter
-        :return: geometry
+        Build spatial filter, ie membership of London for each zone
+        :return: ZoneMembership
         """
-        with Halo(text='loading filter data...', spinner='dots') as spinner:
-            gdf = gp.read_file(self.config.FILTERPATH)
-            if not gdf.crs.get('init') == self.config.EPSG:
-                spinner.text = 'converting filter to espg:{}'.format(self.config.EPSG)
-                gdf = gdf.to_crs(epsg=self.config.EPSG)
-            spinner.text = 'buffering geometries'
-            geometry = gdf.geometry.buffer(0)
-            spinner.text = 'dissolving all geometries'
-            geometry = geometry.unary_union
-            spinner.succeed('filter loaded')
-        return geometry
+        with Halo(text='preparing filter...', spinner='dots') as spinner:
+            membership = zones.load_zone_membership(
+                self.config.ZONESPATH, self.config.EPSG, 'Sequential_9_1', self.config.FILTERPATH
+            )
+            assert len(membership) > 0
+            assert len(membership.outside_ids) > 0
+            assert len(membership.inside_ids) > 0
+            spinner.succeed('filter prepared')
+        return membership
 
-    def add_filter(self):
+    def read_demand(self, path):
         """
-        Build spatial filter
-        :return:
+        Read wide format demand matrix and filter for commuters
+        :param path: str
+        :return: Pandas DataFrame [o, d, freq]
         """
-        geom = self.load_filter()
+        demand = pd.read_csv(path)
 
-        with Halo(text='preparing filter...', spinner='dots') as spinner:
-            self.zones['london'] = self.zones.intersects(geom)
-            assert len(self.zones) > 0
-            out_filter = pd.Series(self.zones.loc[self.zones.london == False, :].index)
-            assert len(out_filter) > 0
-            in_filter = pd.Series(self.zones.loc[self.zones.london == True, :].index)
-            assert len(in_filter) > 0
-            spinner.succeed('filter prepared')
-        return {'out': out_filter, 'in': in_filter}
+        if is_wide(demand):
+            id_vars = demand.columns[0]
+            value_vars = demand.columns[1:]
+            demand = pd.melt(demand, id_vars=id_vars, value_vars=value_vars)
+            demand.columns = ['o', 'd', 'freq']
+            demand = demand.astype({'o': int, 'd': int, 'freq': float})
+        else:
+            raise ValueError('unknown input format, only wide (ie matrix) is implemented')
+
+        return self.filterer(demand)
 
     def filterer(self, df):
         """
@@ -261,12 +376,10 @@ class Demand:
         :param df:
         :return:
         """
-        out_filter = self.filter['out']
-        out_mask = df.o.isin(out_filter)
-        assert sum(out_mask)
-        in_filter = self.filter['in']
-        in_mask = df.d.isin(in_filter)
-        assert sum(in_mask)
+        out_mask = self.filter.outside(df.o.values)
+        assert out_mask.any()
+        in_mask = self.filter.inside(df.d.values)
+        assert in_mask.any()
         return df.loc[out_mask & in_mask, :]
 
 
@@ -288,10 +401,16 @@ class ModeDemand:
 
 class SegmentDemand:
     """
-    Demand container for given tour, mode and segment
+    Demand container for given tour, mode and segment. Segments are the independent units of
+    work for sampling, each with its own random stream (numpy SeedSequence).
     """
-    def __init__(self):
-        raise NotImplementedError
+    def __init__(self, tour, mode_key, seg_no, path, attributes, seed):
+        self.tour = tour
+        self.mode_key = mode_key
+        self.seg_no = seg_no
+        self.path = path
+        self.attributes = attributes
+        self.seed = seed
 
 
 class DayDemand:
@@ -301,16 +420,15 @@ class DayDemand:
     from the all-day demand profile
     """
 
-    def __init__(self, master, path):
+    def __init__(self, master, path, rng):
         self.master = master
         self.config = master.config
-        self.zones = master.zones
         self.filter = master.filter
         self.period_demands = {}
         self.period_sampler = None
         self.demand = self.load_demand_df(path)
 
-        self.total_demand = samplers.probability_rounder(sum(self.demand.freq))
+        self.total_demand = samplers.probability_rounder(sum(self.demand.freq), rng)
 
     def build_periods(self, period_factors):
 
@@ -318,22 +436,10 @@ class DayDemand:
             self.period_demands[period] = PeriodDemand(self, period, factor_map)
 
         totals = [d.total_demand for d in self.period_demands.values()]
-        self.period_sampler = generators.FrequencyDistribution(list(self.period_demands.keys()), totals)
+        self.period_sampler = generators.FrequencyDistribution(np.array(list(self.period_demands.keys())), totals)
 
     def load_demand_df(self, path):
-        demand = pd.read_csv(path)
-
-        if is_wide(demand):
-            id_vars = demand.columns[0]
-            value_vars = demand.columns[1:]
-            demand = pd.melt(demand, id_vars=id_vars, value_vars=value_vars)
-            demand.columns = ['o', 'd', 'freq']
-            demand = demand.astype({'o': int, 'd': int, 'freq': float})
-        else:
-            raise ValueError('unknown input format, only wide (ie matrix) is implemented')
-
-        demand = self.master.filterer(demand)
-        demand['od_zones'] = tuple(zip(demand.o, demand.d))
+        demand = matrices.load_matrix(path, self.master.read_demand, self.master.filter_key)
         origin_regions = demand.o.map(self.master.regions_map)
         destination_regions = demand.d.map(self.master.regions_map)
         demand['od_regions'] = tuple(zip(origin_regions, destination_regions))
@@ -352,7 +458,7 @@ class PeriodDemand:
         demand = day_demand.demand.copy()
         demand['factors'] = demand.od_regions.map(factor_map)
         demand.freq *= demand.factors
-        self.od_sampler = generators.FrequencyDistribution(demand.od_zones, demand.freq)
+        self.od_sampler = generators.FrequencyDistribution(np.column_stack((demand.o, demand.d)), demand.freq)
         self.total_demand = sum(demand.freq)
         self.hour_sampler = generators.UniformDistributionGen(range_in=self.config.PERIODTIMES[period])
 
@@ -368,7 +474,7 @@ class PeriodFactors:
 
     def __init__(self, config, xlsx_path):
         self.config = config
-        self.xlsx = pd.read_excel(xlsx_path, sheet_name=None)  # load xlsx data
+        self.xlsx = pd.read_excel(persistence.local_path(xlsx_path), sheet_name=None)  # load xlsx data
 
     def get_factor_map(self, tour, mode, income):
         """
@@ -442,3 +548,16 @@ def melt_demand_matrix(df):
     df.columns = ['o', 'd', 'freq']
     return df.astype({'o': int, 'd': int, 'freq': float})
 
+
+# Worker process state, set once per worker by the pool initializer to avoid pickling
+# the demand inputs for every segment
+_worker_demand = None
+
+
+def init_worker(demand):
+    global _worker_demand
+    _worker_demand = demand
+
+
+def sample_segment_worker(segment, adjustment):
+    return _worker_demand.sample_segment(segment, adjustment)
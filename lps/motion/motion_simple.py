@@ -1,11 +1,11 @@
 import pandas as pd
 from datetime import timedelta, datetime
 import numpy as np
-import geopandas as gp
-import random
 from halo import Halo
+from shapely.geometry import Point
 
-from lps.core import samplers, generators
+from utils import persistence
+from lps.core import samplers, generators, zones
 from lps.core.population import Agent, Plan, Activity, Leg
 
 
@@ -15,6 +15,7 @@ class Demand:
         print('\n--------- Initiating Motion Population Input ---------')
         self.config = config
         self.zones = self.load_zones()
+        self.zone_index = zones.load_zone_index(self.zones, config.ZONESPATH, config.EPSG, 'Sequential_9_1')
         self.filter = self.add_filter()
         self.demand = self.load_demand()
         self.num_plans = None
@@ -32,50 +33,26 @@ class Demand:
         :return: GeoPandas GeoDataFrame
         """
         with Halo(text='loading zone data...', spinner='dots') as spinner:
-            gdf = gp.read_file(self.config.ZONESPATH)
-            if not gdf.crs.get('init') == self.config.EPSG:
-                spinner.text = 'converting zones to espg:{}'.format(self.config.EPSG)
-                gdf = gdf.to_crs(epsg=self.config.EPSG)
+            gdf = zones.load_zones(self.config.ZONESPATH, self.config.EPSG, repair=True)
             gdf = gdf.loc[:, ['Sequential_9_1', 'geometry']]
             gdf = gdf.set_index('Sequential_9_1')
-            spinner.text = 'buffering zone data'
-            gdf.geometry = gdf.buffer(0)
             spinner.succeed('{} zones loaded and buffered'.format(len(gdf)))
         return gdf
 
-    def load_filter(self):
-        """
-        Load filter
-        :return: geometry
-        """
-        with Halo(text='loading filter data...', spinner='dots') as spinner:
-            gdf = gp.read_file(self.config.FILTERPATH)
-            if not gdf.crs.get('init') == self.config.EPSG:
-                spinner.text = 'converting filter to espg:{}'.format(self.config.EPSG)
-                gdf = gdf.to_crs(epsg=self.config.EPSG)
-            spinner.text = 'buffering geometries'
-            geometry = gdf.geometry.buffer(0)
-            spinner.text = 'preparing for dissolve'
-            spinner.text = 'dissolving all geometries'
-            geometry = geometry.unary_union
-            spinner.succeed('filter loaded')
-        return geometry
-
     def add_filter(self):
         """
-        Build spatial filter
-        :return:
+        Build spatial filter, ie membership of London for each zone
+        :return: ZoneMembership
         """
-        geom = self.load_filter()
         with Halo(text='preparing filter...', spinner='dots') as spinner:
-            self.zones['london'] = self.zones.intersects(geom)
-            assert len(self.zones) > 0
-            out_filter = pd.Series(self.zones.loc[self.zones.london == False, :].index)
-            assert len(out_filter) > 0
-            in_filter = pd.Series(self.zones.loc[self.zones.london == True, :].index)
-            assert len(in_filter) > 0
+            membership = zones.load_zone_membership(
+                self.config.ZONESPATH, self.config.EPSG, 'Sequential_9_1', self.config.FILTERPATH
+            )
+            assert len(membership) > 0
+            assert len(membership.outside_ids) > 0
+            assert len(membership.inside_ids) > 0
             spinner.succeed('filter prepared')
-        return {'out': out_filter, 'in': in_filter}
+        return membership
 
     def filterer(self, df):
         """
@@ -84,12 +61,10 @@ class Demand:
         :param df:
         :return:
         """
-        out_filter = self.filter['out']
-        out_mask = df.o.isin(out_filter)
-        assert sum(out_mask)
-        in_filter = self.filter['in']
-        in_mask = df.d.isin(in_filter)
-        assert sum(in_mask)
+        out_mask = self.filter.outside(df.o.values)
+        assert out_mask.any()
+        in_mask = self.filter.inside(df.d.values)
+        assert in_mask.any()
         return df.loc[out_mask & in_mask, :]
 
     def load_demand(self):
@@ -98,7 +73,7 @@ class Demand:
         :return: bespoke demand dict
         """
         with Halo(text='loading demand inputs...', spinner='dots') as spinner:
-            demand = pd.read_csv(self.config.INPUTPATH)
+            demand = pd.read_csv(persistence.local_path(self.config.INPUTPATH))
             if is_wide(demand):
                 id_vars = demand.columns[0]
                 value_vars = demand.columns[1:]
@@ -136,21 +111,24 @@ class Demand:
     def sample(self, sampler, population):
         with Halo(text='sampling from distributions...', spinner='dots') as spinner:
 
+            rng = sampler.rng
             n = self.demand['total']  # total daily demand
             n = sampler.get_sample_size(n)
 
             # TODO: HARDCODED ASSUMING DEMAND MATRIX IS PER HOUR FOR 3 HOURS OF AM DEMAND
             n *= 3
 
-            start_hours = self.demand['starts'].sample(n + 1)
-            lunch_hours = self.demand['lunches'].sample(n + 1)
-            end_hours = self.demand['ends'].sample(n + 1)
+            start_hours = self.demand['starts'].sample(rng, n + 1)
+            lunch_hours = self.demand['lunches'].sample(rng, n + 1)
+            end_hours = self.demand['ends'].sample(rng, n + 1)
 
-            start_times = generators.gen_minutes(start_hours)
-            lunch_times = generators.gen_minutes(lunch_hours)
-            end_times = generators.gen_minutes(end_hours)
+            start_times = generators.gen_minutes(start_hours, rng)
+            lunch_times = generators.gen_minutes(lunch_hours, rng)
+            end_times = generators.gen_minutes(end_hours, rng)
 
-            ods = random.choices(self.demand['od'][0], weights=self.demand['od'][1], k=n + 1)
+            ods = generators.FrequencyDistribution(*self.demand['od']).sample(rng, n + 1)
+            o_x, o_y = self.zone_index.sample([o_id for o_id, _ in ods[:n]], rng)
+            d_x, d_y = self.zone_index.sample([d_id for _, d_id in ods[:n]], rng)
 
             spinner.succeed('sampling completed for {} trips'.format(n))
 
@@ -162,12 +140,11 @@ class Demand:
                 start_time = start_times[trip]  # Random sample minute to make time stamp
                 lunch_time = lunch_times[trip]  # Random sample minute to make time stamp
                 end_time = end_times[trip]  # Random sample minute to make time stamp
-                o_id, d_id = ods[trip]
 
-                # Sample O-D points
-                o = samplers.sample_point(o_id, self.zones)
-                d1 = samplers.sample_point(d_id, self.zones)
-                d2 = generators.gen_location(d1)
+                # Sampled O-D points
+                o = Point(o_x[trip], o_y[trip])
+                d1 = Point(d_x[trip], d_y[trip])
+                d2 = generators.gen_location(d1, rng)
 
                 # Get distance between pairs (for approx. journey time)
                 dist1 = samplers.get_manhattan_distance(o, d1)
@@ -180,7 +157,7 @@ class Demand:
                 dt1 = dt0 + td1  # approx. arrive at work
                 dt2 = datetime(2000, 1, 1, lunch_time.hour, lunch_time.minute)  # leave for lunch
                 dt3 = dt2 + td2  # arrive at lunch
-                minutes_at_lunch = random.randint(20, 40)
+                minutes_at_lunch = int(rng.integers(20, 41))
                 dt4 = dt3 + timedelta(seconds=(minutes_at_lunch * 60))  # leave lunch
                 dt5 = dt4 + td2  # arrive back at work
                 dt6 = datetime(2000, 1, 1, end_time.hour, end_time.minute)  # leave work
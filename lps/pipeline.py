@@ -0,0 +1,124 @@
+from datetime import datetime as dt
+
+from lps.factory import synth_map
+from lps.core import output
+
+"""
+Streaming population build. Each source yields its population in chunks, which are passed through
+generator stages (sub-category building, xml plans and attributes writers, tables writer), so that
+only a chunk of the population is held in memory and outputs are written as sources are sampled.
+Table summaries are accumulated chunk by chunk, so do not include quartiles. Source checkpoints
+(--resume) are not used.
+"""
+
+
+def build(configurations, global_config):
+    """
+    Build and write population from all sources, in chunks of global_config.CHUNK_SIZE agents.
+    As sources have not been sampled when outputs are started, xml records give the input
+    configuration only. Final records (including counts) are printed on completion.
+    :param configurations: dict of source name: source Config
+    :param global_config: GlobalConfig
+    :return: dict of records
+    """
+    records = {config.SOURCE: dict(config.RECORDS) for config in configurations.values()}
+    records[global_config.SOURCE] = dict(global_config.RECORDS)
+
+    gzip_options = (global_config.GZIP_LEVEL, global_config.GZIP_THREADS)
+    with output.PlansWriter(global_config.XMLPATH, records, *gzip_options) as plans_writer, \
+            output.AttributesWriter(global_config.XMLPATHATTRIBS, records, *gzip_options) as attributes_writer, \
+            output.TablesWriter(global_config) as tables_writer:
+
+        chunks = sample_sources(configurations, global_config.CHUNK_SIZE, records)
+        chunks = build_sub_categories(chunks)
+        chunks = write_chunks(chunks, plans_writer)
+        chunks = write_chunks(chunks, attributes_writer)
+        chunks = write_chunks(chunks, tables_writer)
+
+        totals = {'plans': 0, 'acts': 0, 'legs': 0}
+        for chunk in chunks:
+            add_counts(totals, chunk)
+
+    print('\tCompleted Population Build')
+    print('\t> {} plans written to {}'.format(plans_writer.count, global_config.XMLPATH))
+    print('\t> {} attributes written to {}'.format(attributes_writer.count, global_config.XMLPATHATTRIBS))
+    tables_writer.describe('')
+
+    records[global_config.SOURCE].update(time=dt.now(), **totals)
+    return records
+
+
+def sample_sources(configurations, chunk_size, records):
+    """
+    Generate population chunks from each source in turn. Source records are updated with counts
+    once each source is complete.
+    :param configurations: dict of source name: source Config
+    :param chunk_size: maximum number of agents in each chunk
+    :param records: dict of records
+    :return: generator of Population
+    """
+    for source, config in configurations.items():
+        source_data = synth_map[source]['input'](config)
+        sampler = synth_map[source]['sampler'](config)
+
+        totals = {'plans': 0, 'acts': 0, 'legs': 0}
+        for chunk in sample_chunks(source_data, sampler, chunk_size):
+            add_counts(totals, chunk)
+            yield chunk
+
+        records[config.SOURCE].update(time=dt.now(), **totals)
+        output.print_records({config.SOURCE: records[config.SOURCE]})
+
+
+def sample_chunks(source_data, sampler, chunk_size):
+    """
+    Generate population chunks from a source. Sources that sample incrementally (sample_chunks)
+    are streamed, otherwise the source population is sampled in full and then split.
+    :param source_data: source input object
+    :param sampler: source Sampler
+    :param chunk_size: maximum number of agents in each chunk
+    :return: generator of Population
+    """
+    if hasattr(source_data, 'sample_chunks'):
+        populations = source_data.sample_chunks(sampler)
+    else:
+        populations = [source_data.sample(sampler)]
+    for population in populations:
+        for chunk in population.chunks(chunk_size):
+            yield chunk
+
+
+def build_sub_categories(chunks):
+    """
+    Break down work and home activities into sub categories. Plans are never split between
+    chunks, so this is the same as for the whole population.
+    :param chunks: iterable of Population
+    :return: generator of Population
+    """
+    for chunk in chunks:
+        chunk.build_sub_categories()
+        yield chunk
+
+
+def write_chunks(chunks, writer):
+    """
+    Add chunks to an output writer.
+    :param chunks: iterable of Population
+    :param writer: output writer with add_population method
+    :return: generator of Population
+    """
+    for chunk in chunks:
+        writer.add_population(chunk)
+        yield chunk
+
+
+def add_counts(totals, chunk):
+    """
+    :param totals: dict of plans, acts and legs counts
+    :param chunk: Population
+    :return: None
+    """
+    plans, acts, legs = chunk.get_size()
+    totals['plans'] += plans
+    totals['acts'] += acts
+    totals['legs'] += legs
@@ -0,0 +1,71 @@
+import os
+
+from lps.core import checkpoints
+from lps.core.population import Population
+
+
+class Config:
+    SOURCE = 'test'
+    SEED = 1
+    SAMPLE = 0.5
+    WORKERS = 1
+
+    def __init__(self, outpath):
+        self.OUTPATH = outpath
+
+
+def test_checkpoint_keyed_on_config(tmp_path):
+    config = Config(str(tmp_path))
+    population = Population()
+    population.uids = ['a']
+    population.agent_plans.append(0)
+    assert checkpoints.load(config) is None
+
+    path = checkpoints.save(population, config)
+    assert os.path.exists(path)
+    assert checkpoints.load(config).uids == ['a']
+
+    config.WORKERS = 4  # does not change sampled population
+    assert checkpoints.load(config) is not None
+    config.SEED = 2
+    assert checkpoints.load(config) is None
+    checkpoints.save(population, config)
+    assert not os.path.exists(path)  # stale checkpoint removed
+
+
+def test_checkpoint_invalidated_by_input_directory_changes(tmp_path):
+    demand = tmp_path / 'demand' / 'tour'
+    demand.mkdir(parents=True)
+    (demand / 'segment_0.CSV').write_text('1,2,3\n')
+    (tmp_path / 'zones.shp').write_text('shp')
+    (tmp_path / 'zones.dbf').write_text('dbf')
+    config = Config(str(tmp_path / 'out'))
+    config.DEMANDPATH = str(tmp_path / 'demand')
+    config.ZONESPATH = str(tmp_path / 'zones.shp')
+    population = Population()
+    checkpoints.save(population, config)
+    assert checkpoints.load(config) is not None
+
+    (demand / 'segment_0.CSV').write_text('1,2,30\n')
+    assert checkpoints.load(config) is None
+    checkpoints.save(population, config)
+    assert checkpoints.load(config) is not None
+
+    os.utime(str(tmp_path / 'zones.dbf'), (0, 0))  # shapefile sidecar
+    assert checkpoints.load(config) is None
+
+
+def test_checkpoint_key_ignores_caches_built_alongside_inputs(tmp_path):
+    (tmp_path / 'wards').mkdir()
+    (tmp_path / 'wards' / 'wards.shp').write_text('shp')
+    (tmp_path / 'demand.csv').write_text('1,2,3\n')
+    config = Config(str(tmp_path / 'out'))
+    config.FILTERPATH = str(tmp_path / 'wards')
+    config.AMPATH = str(tmp_path / 'demand.csv')
+    key = checkpoints.config_key(config)
+
+    (tmp_path / 'wards' / 'union.ZoneID.27700.zstore.npz').write_text('')  # eg by another source
+    (tmp_path / 'wards' / 'wards.ZoneID.27700.zidx.npz').write_text('')
+    (tmp_path / 'demand.london-1234.abcd.v1.demand.npy').write_text('')
+    (tmp_path / 'demand.london-1234.abcd.v1.demand.npy.99.tmp').write_text('')
+    assert checkpoints.config_key(config) == key
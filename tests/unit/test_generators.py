@@ -0,0 +1,23 @@
+import numpy as np
+
+from lps.core import generators, samplers
+
+
+def implied_probabilities(sampler):
+    probabilities = sampler.prob.copy()
+    np.add.at(probabilities, sampler.alias, 1 - sampler.prob)
+    return probabilities / sampler.size
+
+
+def test_alias_table_matches_weights():
+    rng = np.random.default_rng(0)
+    for weights in [rng.random(1000), np.r_[np.zeros(1000), [1e6, 1, 3]], rng.pareto(0.8, 10000)]:
+        sampler = generators.AliasSampler(weights)
+        assert np.allclose(implied_probabilities(sampler), weights / weights.sum())
+
+
+def test_alias_sampler_draws():
+    rng = samplers.make_rng(0)
+    draws = generators.AliasSampler([1, 0, 2, 7]).sample(rng, 100000)
+    assert np.allclose(np.bincount(draws, minlength=4) / 100000, [0.1, 0, 0.2, 0.7], atol=0.01)
+    assert len(generators.AliasSampler([0, 0]).sample(rng, 0)) == 0
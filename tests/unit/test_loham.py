@@ -0,0 +1,45 @@
+from types import SimpleNamespace
+import numpy as np
+
+from lps.core.population import Population
+from lps.loham.loham import Demand
+
+HOUR = 60 * 60
+
+
+def test_build_plans_long_regular_and_delivery_first():
+    demand = Demand.__new__(Demand)
+    demand.config = SimpleNamespace(MODE='lgv', SOURCE='loham_lgv')
+    population = Population()
+    o = (np.array([0., 0., 0.]), np.array([1., 1., 1.]))  # depots
+    d = (np.array([10., 20., 30.]), np.array([11., 21., 31.]))  # deliveries
+    seconds = (
+        np.array([6, 8, 20]) * HOUR,  # depot departure
+        np.array([19, 9, 21]) * HOUR,  # delivery arrival
+        np.array([20, 10, 26]) * HOUR,  # delivery departure (next day for the last trip)
+        np.array([21, 11, 27]) * HOUR,  # depot arrival
+    )
+    demand.build_plans(population, ['long', 'regular', 'reverse'], o, d, seconds, np.array([5., 6., 7.]))
+
+    def acts(index):
+        return [
+            (act.sequence, act.act, act.point.x, act.point.y, act.start_seconds // HOUR, act.end_seconds // HOUR)
+            for act in population.agents[index].plans[0].activities
+        ]
+
+    def legs(index):
+        return [
+            (leg.sequence, leg.start_loc.x, leg.end_loc.x, leg.start_seconds // HOUR, leg.end_seconds // HOUR, leg.dist)
+            for leg in population.agents[index].plans[0].legs
+        ]
+
+    # long journey (over 12 hours) does not return to the depot
+    assert acts(0) == [(0, 'depot', 0, 1, 19, 6), (1, 'delivery', 10, 11, 19, 6)]
+    assert legs(0) == [(0, 0, 10, 6, 19, 5)]
+
+    assert acts(1) == [(0, 'depot', 0, 1, 11, 8), (1, 'delivery', 20, 21, 9, 10), (2, 'depot', 0, 1, 11, 8)]
+    assert legs(1) == [(0, 0, 20, 8, 9, 6), (1, 20, 0, 10, 11, 6)]
+
+    # delivery ends before depot departure, so the plan starts (and ends) with the delivery
+    assert acts(2) == [(0, 'delivery', 30, 31, 21, 2), (1, 'depot', 0, 1, 3, 20), (2, 'delivery', 30, 31, 21, 2)]
+    assert legs(2) == [(0, 30, 0, 2, 3, 7), (1, 0, 30, 20, 21, 7)]
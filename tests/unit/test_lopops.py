@@ -0,0 +1,94 @@
+import numpy as np
+import pandas as pd
+import geopandas as gp
+from shapely.geometry import box
+
+from lps.core import samplers, zones
+from lps.core.population import ARRAY_COLUMNS, CATEGORY_COLUMNS
+from lps.lopops import lopops
+from lps.lopops.lopops import PlanTemplates, expand_offsets
+from lps.lopops.config import LoPopSConfig
+
+
+def trips():
+    return pd.DataFrame({
+        'tpid': [1, 1, 1, 1, 2, 2],
+        'tseqno': [0, 1, 2, 3, 0, 1],
+        'ozone': [10, 11, 12, 11, 20, 21],
+        'dzone': [11, 12, 11, 10, 21, 22],
+        'dpurp': ['Usual_work', 'Usual_work', 'Usual_work', 'Shop_Food', 'dummy', 'Edu'],
+        'mdname': ['Bus', 'Walk', 'Bus', 'Cycle', 'Walk', 'Rail'],
+        'tstime': [800, 1200, 1300, 1700, 900, 1000],
+        'tetime': [830, 1215, 1330, 1730, 930, 1045],
+        'Freq16': [3, 3, 3, 3, 1, 1],
+    })
+
+
+def test_plan_templates_infer_activities():
+    config = LoPopSConfig.__new__(LoPopSConfig)
+    plans = PlanTemplates(config, trips())
+    assert list(plans.tpids) == [1, 2]
+    assert list(plans.freq) == [3, 1]
+
+    # repeated purpose alternates with home, dummy activity removed
+    assert list(plans.act_counts) == [5, 2]
+    assert list(plans.acts['act']) == ['home', 'work', 'home', 'work', 'shop', 'home', 'education']
+    assert list(plans.acts['seq']) == [0, 1, 2, 3, 4, 0, 2]
+    assert list(plans.acts['start'][:2]) == [17 * 3600 + 30 * 60, 8 * 3600 + 30 * 60]
+    assert list(plans.acts['end'][:2]) == [8 * 3600, 12 * 3600]
+
+    # repeated work activity in zone 11 shares a location
+    assert list(plans.unique_zones[:plans.unique_offsets[1]]) == [10, 11, 12, 10]
+    assert list(plans.acts['unique'][:5]) == [0, 1, 2, 1, 3]
+
+    assert list(plans.leg_counts) == [4, 1]
+    assert list(plans.legs['mode']) == ['pt', 'walk', 'pt', 'bike', 'walk']
+    assert list(plans.legs['start'][:2]) == [8 * 3600, 12 * 3600]
+
+
+def zone_index():
+    ids = [10, 11, 12, 20, 21, 22]
+    geoms = gp.GeoDataFrame({'zone': ids}, geometry=[box(i, 0, i + 1, 1) for i in ids]).set_index('zone')
+    return zones.ZoneIndex.from_geodataframe(geoms)
+
+
+def test_plan_templates_build_empty():
+    config = LoPopSConfig.__new__(LoPopSConfig)
+    plans = PlanTemplates(config, trips())
+    act_counts, acts, leg_counts, legs = plans.build(np.array([], dtype=np.int64), zone_index(), samplers.make_rng(1))
+    assert len(act_counts) == len(leg_counts) == 0
+    assert len(acts['x']) == len(legs['dist']) == 0
+
+
+def test_expand_offsets():
+    offsets = np.array([0, 2, 5, 6])
+    assert list(expand_offsets(offsets, np.array([1, 0, 1]))) == [2, 3, 4, 0, 1, 2, 3, 4]
+    assert list(expand_offsets(offsets, np.array([], dtype=np.int64))) == []
+
+
+def test_sample_independent_of_workers(monkeypatch):
+    monkeypatch.setattr(lopops, 'SHARD_PLANS', 1)  # a shard per plan
+    config = LoPopSConfig.__new__(LoPopSConfig)
+    config.SAMPLE = 100
+    config.SEED = 3
+    config.VERBOSE = False
+    df = pd.concat([trips().assign(tpid=trips().tpid + 10 * i) for i in range(4)], ignore_index=True)
+    data = lopops.Data.__new__(lopops.Data)
+    data.config = config
+    data.zone_index = zone_index()
+    data.plans = PlanTemplates(config, df)
+    data.plans.attributes = pd.DataFrame({'source': 'lopops', 'tpid': data.plans.tpids})
+
+    populations = []
+    for workers in (1, 2):
+        config.WORKERS = workers
+        populations.append(data.sample(samplers.ObjectSampler(config)))
+    serial, parallel = populations
+    assert serial.uids == parallel.uids
+    assert serial.uids[:3] == ['1_0', '1_1', '1_2']
+    for name in ARRAY_COLUMNS:
+        assert getattr(serial, name) == getattr(parallel, name), name
+    for _, name in CATEGORY_COLUMNS:
+        serial_column, parallel_column = getattr(serial, name), getattr(parallel, name)
+        assert [serial_column[i] for i in range(len(serial_column))] == \
+            [parallel_column[i] for i in range(len(parallel_column))], name
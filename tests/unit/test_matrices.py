@@ -0,0 +1,28 @@
+import pandas as pd
+
+from lps.core import matrices
+
+
+def test_matrix_cached_alongside_source(tmp_path):
+    source = tmp_path / 'demand.csv'
+    source.write_text('1,2,0.5\n1,3,0\n2,3,4\n')
+    calls = []
+
+    def reader(path):
+        calls.append(path)
+        return pd.read_csv(path, header=None, names=['o', 'd', 'freq'])
+
+    key = matrices.filter_key('test', [3, 1, 2])
+    first = matrices.load_matrix(str(source), reader, key)
+    second = matrices.load_matrix(str(source), reader, key)
+    assert len(calls) == 1
+    assert list(first.o) == [1, 2] and list(first.freq) == [0.5, 4]
+    pd.testing.assert_frame_equal(first, second)
+    assert len(list(tmp_path.glob('demand.test-*.demand.npy'))) == 1
+
+    source.write_text('1,2,1\n')
+    changed = matrices.load_matrix(str(source), reader, key)
+    assert len(calls) == 2
+    assert list(changed.freq) == [1]
+    assert len(list(tmp_path.glob('demand.test-*.demand.npy'))) == 1
+    assert not list(tmp_path.glob('*.tmp'))
@@ -0,0 +1,68 @@
+import numpy as np
+import pandas as pd
+import geopandas as gp
+from shapely.geometry import box
+
+from lps.core import samplers, zones, matrices
+from lps.motion import motion
+from lps.motion.config import MotionConfig
+
+
+class UniformFactors:
+    """
+    Equal period factors for all region pairs, in place of PeriodFactors (read from xlsx).
+    """
+
+    def get_factor_map(self, tour, mode, income):
+        od = {(o, d): 0.25 for o in 'ab' for d in 'ab'}
+        return {period: dict(od) for period in MotionConfig.ALLPERIODS}
+
+
+def build_demand(tmp_path, workers, limit=None, num_segments=4):
+    ids = [1, 2, 3, 4]
+    segments = tmp_path / 'Business' / 'M1'
+    segments.mkdir(parents=True, exist_ok=True)
+    for seg_no in range(num_segments):
+        df = pd.DataFrame(np.random.RandomState(seg_no).randint(0, 20, (4, 4)), columns=[str(i) for i in ids])
+        df.insert(0, 'o', ids)
+        df.to_csv(str(segments / 'seg{}.CSV'.format(seg_no)), index=False)
+
+    config = MotionConfig.__new__(MotionConfig)
+    config.SEED = 1
+    config.SAMPLE = 100
+    config.WORKERS = workers
+    config.LIMIT = limit
+    config.TOURS = ['Business']
+    config.MODES = ['M1']
+    config.DEMANDPATH = str(tmp_path)
+
+    demand = motion.Demand.__new__(motion.Demand)
+    demand.config = config
+    demand.attributes = {'Business': pd.DataFrame({
+        'car': ['car0', 'car1'] * (num_segments // 2), 'gender': 'm', 'job': 'ft', 'occ': 'o', 'inc': 'inc16'
+    })}
+    demand.outbound_factors = UniformFactors()
+    demand.zones = gp.GeoDataFrame({'id': ids}, geometry=[box(i * 10, 0, i * 10 + 5, 5) for i in ids]).set_index('id')
+    demand.regions_map = {1: 'a', 2: 'a', 3: 'b', 4: 'b'}
+    demand.zone_index = zones.ZoneIndex.from_geodataframe(demand.zones)
+    demand.filter = zones.ZoneMembership(ids, [False, False, True, True])
+    demand.filter_key = matrices.filter_key('commuters', demand.filter.outside_ids, demand.filter.inside_ids)
+    return demand
+
+
+def test_sample_independent_of_workers(tmp_path):
+    populations = []
+    for workers in (1, 2):
+        demand = build_demand(tmp_path, workers)
+        populations.append(demand.sample(samplers.DemandSampler(demand.config)))
+    serial, parallel = populations
+    assert len(serial.uids) > 0
+    assert serial.uids == parallel.uids
+    assert serial.act_x == parallel.act_x and serial.act_start == parallel.act_start
+    assert serial.leg_dist == parallel.leg_dist
+
+    limited = build_demand(tmp_path / 'limited', 2, limit=5, num_segments=20)
+    population = limited.sample(samplers.DemandSampler(limited.config))
+    assert population.uids == serial.uids[:5]
+    loaded = list((tmp_path / 'limited').glob('**/*.demand.npy'))  # demand cached when loaded
+    assert 0 < len(loaded) < 20  # no further segments submitted once limit reached
@@ -0,0 +1,139 @@
+import gzip
+import random
+import pandas as pd
+import pytest
+from lxml import etree as et
+
+from lps.core import output
+from lps.core.population import Population
+from test_population import random_agent
+
+
+def build_population(n=10):
+    rand = random.Random(0)
+    population = Population()
+    population.agents.extend(random_agent(str(i), rand) for i in range(n))
+    population.records = {'test': {'plans': n}}
+    return population
+
+
+def test_plans_writer_streams_population_columns_and_agents_identically(tmp_path):
+    population = build_population()
+    with output.PlansWriter(str(tmp_path / 'columns.xml'), population.records) as writer:
+        writer.add_population(population)
+    with output.PlansWriter(str(tmp_path / 'agents.xml'), population.records) as writer:
+        writer.add_agents(population.agents)
+    assert writer.count == 10
+    assert (tmp_path / 'columns.xml').read_bytes() == (tmp_path / 'agents.xml').read_bytes()
+
+    tree = et.parse(str(tmp_path / 'columns.xml'))
+    assert tree.docinfo.doctype == '<!DOCTYPE population SYSTEM "http://matsim.org/files/dtd/population_v5.dtd">'
+    persons = tree.getroot().findall('person')
+    assert [p.get('id') for p in persons] == [str(i) for i in range(10)]
+
+
+def test_attributes_writer_gzip(tmp_path):
+    population = build_population()
+    path = tmp_path / 'attributes.xml.gz'
+    with output.AttributesWriter(str(path), population.records) as writer:
+        writer.add_population(population)
+    with gzip.open(str(path)) as f:
+        root = et.parse(f).getroot()
+    assert root.tag == 'objectAttributes'
+    assert len(root.findall('object')) == 10
+    assert root.find('object/attribute').get('name') == 'source'
+
+
+class TablesConfig:
+    EPSG = 4326  # no reprojection
+
+
+def test_tables_match_plan_reports():
+    population = build_population(20)
+    tables = output.Tables(TablesConfig, population)
+    activity_rows = [row for agent in population.agents for row in agent.plans[0].activity_report()]
+    leg_rows = [row for agent in population.agents for row in agent.plans[0].leg_report()]
+    assert tables.activity_df.astype(object).values.tolist() == activity_rows
+    assert tables.leg_df.astype(object).values.tolist() == leg_rows
+    assert str(tables.activity_df.activity.dtype) == 'category'
+    assert tables.attrib_df.loc['3', 'car'] == population.agents[3].attributes['car']
+
+
+def test_tables_writer_summaries_match_tables(tmp_path):
+    class Config(TablesConfig):
+        OUTPATH = str(tmp_path)
+        TABLE_FORMATS = {'activities': 'csv', 'legs': 'csv', 'attributes': 'csv'}
+        PARTITION = False
+
+    population = build_population(30)
+    with output.TablesWriter(Config) as writer:
+        for chunk in population.chunks(7):
+            writer.add_population(chunk)
+    tables = output.Tables(Config, population)
+    stats = ['count', 'mean', 'std', 'min', 'max']
+
+    expected = tables.activity_df.groupby('activity', observed=True)[output.SUMMARY_COLUMNS].describe()
+    expected.index = expected.index.astype(str)
+    summary = writer.act_summary.describe(writer.act_summary.moments())
+    pd.testing.assert_frame_equal(summary, expected.loc[:, (slice(None), stats)])
+    totals = tables.leg_df[output.SUMMARY_COLUMNS].describe().loc[stats]
+    pd.testing.assert_frame_equal(writer.leg_summary.totals(), totals)
+    assert dict(writer.attrib_counts['car']) == dict(tables.attrib_df['car'].value_counts())
+
+
+def test_tables_writer_parquet_partitioned_by_source(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    class Config(TablesConfig):
+        OUTPATH = str(tmp_path)
+        TABLE_FORMATS = {'activities': 'parquet', 'legs': 'arrow', 'attributes': 'csv'}
+        PARTITION = True
+        ROW_GROUP_SIZE = 10
+
+    population = build_population(20)
+    with output.TablesWriter(Config) as writer:
+        for chunk in population.chunks(7):
+            writer.add_population(chunk)
+    tables = output.Tables(Config, population)
+
+    activities = pq.read_table(str(tmp_path / 'activities.parquet' / 'source=test' / 'part-0.parquet'))
+    assert activities.schema.field('activity').type.index_type.bit_width == 32
+    assert 'source' not in activities.schema.names
+    assert activities.to_pandas()['uid'].astype(str).tolist() == tables.activity_df.uid.astype(str).tolist()
+    assert (tmp_path / 'legs.arrows' / 'source=test' / 'part-0.arrows').exists()
+    assert (tmp_path / 'attributes.csv').exists()
+
+
+def test_tables_writer_columnar_attributes_written_by_chunk(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+
+    class Config(TablesConfig):
+        OUTPATH = str(tmp_path)
+        TABLE_FORMATS = {'activities': 'csv', 'legs': 'csv', 'attributes': 'parquet'}
+        PARTITION = False
+        ROW_GROUP_SIZE = 100
+
+    rand = random.Random(0)
+    chunks = []
+    for chunk_no in range(3):
+        agents = [random_agent('{}_{}'.format(chunk_no, n), rand) for n in range(5)]
+        for n, agent in enumerate(agents):
+            if chunk_no == 0:
+                agent.attributes['age'] = n  # ints, then missing, then floats
+            elif chunk_no == 2:
+                agent.attributes['age'] = n + 0.5
+                agent.attributes['zone'] = 'E{}'.format(n)  # missing from earlier chunks
+        chunk = Population()
+        chunk.agents.extend(agents)
+        chunks.append(chunk)
+    with output.TablesWriter(Config) as writer:
+        for chunk in chunks:
+            writer.add_population(chunk)
+
+    attributes = pq.ParquetFile(str(tmp_path / 'attributes.parquet'))
+    assert attributes.metadata.num_row_groups == 3  # one for each chunk
+    assert str(attributes.schema_arrow.field('age').type) == 'double'
+    assert str(attributes.schema_arrow.field('zone').type) == 'string'
+    table = attributes.read().to_pandas()
+    assert table.age.tolist()[:5] == [0, 1, 2, 3, 4] and table.age.isna().sum() == 5
+    assert table.zone.tolist()[10:] == ['E0', 'E1', 'E2', 'E3', 'E4']
@@ -0,0 +1,159 @@
+import gzip
+import io
+import os
+import pytest
+from botocore.exceptions import ClientError
+
+from utils import persistence, aws_s3_ftns
+
+
+def test_parallel_gzip_writer_multi_member():
+    content = b''.join(b'<person id="%d"/>\n' % i for i in range(5000))
+    raw = io.BytesIO()
+    with persistence.ParallelGzipWriter(raw, compresslevel=6, threads=3, block_size=1000) as stream:
+        for i in range(0, len(content), 777):
+            stream.write(content[i:i + 777])
+    assert stream.members == -(-len(content) // 1000)
+    assert gzip.decompress(raw.getvalue()) == content
+
+    empty = io.BytesIO()
+    with persistence.ParallelGzipWriter(empty, threads=2):
+        pass
+    assert gzip.decompress(empty.getvalue()) == b''
+
+
+def test_open_output_parallel_gzip(tmp_path):
+    path = str(tmp_path / 'plans.xml.gz')
+    with persistence.open_output(path, compresslevel=1, threads=2) as stream:
+        stream.write(b'<population/>\n')
+    with gzip.open(path) as f:
+        assert f.read() == b'<population/>\n'
+
+
+class FakeS3:
+    """
+    In memory stand in for the S3 client multipart upload api, failing the first upload of
+    given part numbers.
+    """
+
+    def __init__(self, fail_parts=()):
+        self.objects = {}
+        self.uploads = {}
+        self.fail_parts = set(fail_parts)
+        self.gets = []
+
+    def put_object(self, Bucket, Key, Body):
+        self.objects[(Bucket, Key)] = bytes(Body)
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise ClientError({'Error': {'Code': '404'}}, 'HeadObject')
+        return {'ETag': '"{}"'.format(hash(self.objects[(Bucket, Key)]))}
+
+    def get_object(self, Bucket, Key, IfMatch=None):
+        self.gets.append(Key)
+        assert IfMatch == self.head_object(Bucket, Key)['ETag']
+        return {'Body': io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def list_objects_v2(self, Bucket, Prefix):
+        keys = sorted(key for bucket, key in self.objects if bucket == Bucket and key.startswith(Prefix))
+        return {'Contents': [{'Key': key, 'ETag': self.head_object(Bucket, key)['ETag']} for key in keys]}
+
+    def create_multipart_upload(self, Bucket, Key):
+        upload_id = str(len(self.uploads))
+        self.uploads[upload_id] = {}
+        return {'UploadId': upload_id}
+
+    def upload_part(self, Bucket, Key, UploadId, PartNumber, Body):
+        if PartNumber in self.fail_parts:
+            self.fail_parts.remove(PartNumber)
+            raise ClientError({'Error': {'Code': 'SlowDown'}}, 'UploadPart')
+        self.uploads[UploadId][PartNumber] = bytes(Body)
+        return {'ETag': 'etag{}'.format(PartNumber)}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        parts = self.uploads.pop(UploadId)
+        numbers = [part['PartNumber'] for part in MultipartUpload['Parts']]
+        assert numbers == sorted(parts)
+        self.objects[(Bucket, Key)] = b''.join(parts[n] for n in numbers)
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId)
+
+
+def test_multipart_writer_uploads_parts_in_order_with_retries():
+    client = FakeS3(fail_parts=[2])
+    content = bytes(range(256)) * 40
+    with aws_s3_ftns.MultipartWriter('bucket', 'key', part_size=1000, threads=3, backoff=0, client=client) as stream:
+        for i in range(0, len(content), 300):
+            stream.write(content[i:i + 300])
+    assert client.objects[('bucket', 'key')] == content
+    assert not client.uploads
+
+    with aws_s3_ftns.MultipartWriter('bucket', 'small', part_size=1000, client=client) as stream:
+        stream.write(b'small')
+    assert client.objects[('bucket', 'small')] == b'small'
+
+
+def test_multipart_writer_aborts_on_error():
+    client = FakeS3()
+    with pytest.raises(ValueError):
+        with aws_s3_ftns.MultipartWriter('bucket', 'key', part_size=10, client=client) as stream:
+            stream.write(b'x' * 100)
+            raise ValueError()
+    assert not client.uploads
+    assert not client.objects
+
+
+def test_local_path_reads_through_cache(tmp_path, monkeypatch):
+    client = FakeS3()
+    client.objects[('bucket', 'plans/TravelPlans.csv.gz')] = gzip.compress(b'a,b\n1,2\n')
+    client.objects[('bucket', 'zones/zones.shp')] = b'shp'
+    client.objects[('bucket', 'zones/zones.dbf')] = b'dbf'
+    monkeypatch.setattr(aws_s3_ftns, 's3', client)
+    monkeypatch.setattr(persistence, 'S3_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(persistence, '_s3_heads', {})
+
+    assert persistence.read_content('s3://bucket/plans/TravelPlans.csv.gz') == b'a,b\n1,2\n'
+    assert persistence.file_exists('s3://bucket/plans/TravelPlans.csv.gz')
+    assert not persistence.file_exists('s3://bucket/plans/missing.csv')
+    directory = persistence.local_path('s3://bucket/zones/')
+    assert sorted(os.listdir(directory)) == ['zones.dbf', 'zones.shp']
+    assert client.gets == ['plans/TravelPlans.csv.gz', 'zones/zones.dbf', 'zones/zones.shp']
+
+    monkeypatch.setattr(persistence, '_s3_heads', {})  # eg a later build
+    assert persistence.local_path('s3://bucket/zones/zones.shp') == os.path.join(directory, 'zones.shp')
+    assert len(client.gets) == 3  # cached copies are up to date
+    client.objects[('bucket', 'zones/zones.dbf')] = b'dbf2'
+    persistence.local_path('s3://bucket/zones/zones.shp')  # fetched with sidecar files
+    assert client.gets[3:] == ['zones/zones.dbf']
+
+
+def test_prefetcher_caches_source_inputs_once(tmp_path, monkeypatch, capsys):
+    from types import SimpleNamespace
+    from lps.core import prefetch
+    client = FakeS3()
+    for i in range(5):
+        client.objects[('bucket', 'motion/segment_{}.csv'.format(i))] = b'a,b\n'
+    client.objects[('bucket', 'zones/zones.shp')] = b'shp'
+    monkeypatch.setattr(aws_s3_ftns, 's3', client)
+    monkeypatch.setattr(persistence, 'S3_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(persistence, '_s3_heads', {})
+    configurations = {
+        'motion': SimpleNamespace(DEMANDPATH='s3://bucket/motion', ZONESPATH='s3://bucket/zones/zones.shp',
+                                  OUTPATH='s3://bucket/out', SAMPLE=0.1),
+        'lopops': SimpleNamespace(ZONESPATH='s3://bucket/zones/zones.shp', INPUTPATH='local.csv'),
+    }
+
+    with prefetch.Prefetcher(configurations, threads=3) as prefetcher:
+        assert prefetcher.paths == ['s3://bucket/motion', 's3://bucket/zones/zones.shp']
+        directory = persistence.local_path('s3://bucket/motion')  # read by source while prefetching
+        persistence.local_path('s3://bucket/zones/zones.shp')
+    assert len(os.listdir(directory)) == 5
+    assert sorted(client.gets) == ['motion/segment_{}.csv'.format(i) for i in range(5)] + ['zones/zones.shp']
+
+    client.objects[('bucket', 'changed.csv')] = b''
+    monkeypatch.setattr(persistence, '_s3_heads', {'s3://bucket/changed.csv': {'ETag': 'stale'}})  # download fails
+    with prefetch.Prefetcher({'motion': SimpleNamespace(DEMANDPATH='s3://bucket/changed.csv')}, threads=1) as prefetcher:
+        prefetcher.futures[0].exception()  # wait for fetch
+    assert 'unable to prefetch s3://bucket/changed.csv' in capsys.readouterr().out
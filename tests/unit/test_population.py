@@ -0,0 +1,166 @@
+import random
+from shapely.geometry import Point
+
+from lps.core.population import Population, Agent, Plan, Activity, Leg
+
+
+def stamp(minutes):
+    return '{:02d}:{:02d}:00'.format((minutes // 60) % 24, minutes % 60)
+
+
+def random_agent(uid, rand):
+    acts = ['home'] + [rand.choice(['work', 'shop', 'work', 'home']) for _ in range(rand.randint(1, 4))] + ['home']
+    times = sorted(rand.sample(range(0, 24 * 60), 2 * (len(acts) - 1)))
+    activities = []
+    legs = []
+    for seq, act in enumerate(acts):
+        start = times[2 * seq - 1] if seq else times[-1]
+        end = times[2 * seq] if seq < len(acts) - 1 else times[0]
+        activities.append(Activity(uid, seq, act, Point(seq, seq), stamp(start), stamp(end)))
+    for seq in range(len(acts) - 1):
+        legs.append(Leg(uid, seq, 'car', Point(seq, seq), Point(seq + 1, seq + 1),
+                        stamp(times[2 * seq]), stamp(times[2 * seq + 1]), 1.5))
+    return Agent(uid, [Plan(activities, legs, 'test')], {'source': 'test', 'car': rand.choice(['car0', 'car1'])})
+
+
+def test_agent_views_round_trip():
+    rand = random.Random(0)
+    agents = [random_agent(str(i), rand) for i in range(20)]
+    population = Population()
+    population.agents.extend(agents)
+    assert len(population.agents) == 20
+    for agent, view in zip(agents, population.agents):
+        assert view.uid == agent.uid
+        assert view.attributes == agent.attributes
+        for act, act_view in zip(agent.plans[0].activities, view.plans[0].activities):
+            assert act.report() == act_view.report()
+        for leg, leg_view in zip(agent.plans[0].legs, view.plans[0].legs):
+            assert leg.report() == leg_view.report()
+
+
+def test_build_sub_categories_matches_plan_objects():
+    rand = random.Random(1)
+    agents = [random_agent(str(i), rand) for i in range(200)]
+    population = Population()
+    population.agents.extend(agents)
+    population.build_sub_categories()
+    for agent, view in zip(agents, population.agents):
+        agent.build_sub_categories()
+        assert [a.act for a in agent.plans[0].activities] == [a.act for a in view.plans[0].activities]
+
+
+def test_add_agents_merges_columns():
+    rand = random.Random(2)
+    a = Population()
+    a.agents.append(random_agent('a', rand))
+    b = Population()
+    agent = random_agent('b', rand)
+    agent.attributes['extra'] = 'value'
+    b.agents.append(agent)
+    a.add_agents(b)
+    assert a.get_size()[0] == 2
+    assert 'extra' not in a.agents[0].attributes
+    assert a.agents[1].attributes['extra'] == 'value'
+    assert a.agents[-1].plans[0].activities[1].report() == agent.plans[0].activities[1].report()
+
+
+def test_activity_accepts_seconds_or_strings():
+    from_string = Activity('a', 0, 'home', Point(0, 0), '23:30:15', '01:10:00')
+    from_seconds = Activity('a', 0, 'home', Point(0, 0), 23 * 3600 + 30 * 60 + 15, 3600 + 600)
+    assert from_string.report() == from_seconds.report()
+    assert from_seconds.start_time == '23:30:15'
+    assert from_seconds.duration == 100
+    assert not hasattr(from_seconds, '__dict__')
+
+
+def test_add_plans_matches_agents():
+    rand = random.Random(3)
+    agents = [random_agent(str(i), rand) for i in range(10)]
+    expected = Population()
+    expected.agents.extend(agents)
+
+    population = Population()
+    population.agents.append(agents[0])
+    acts = [act for agent in agents[1:] for act in agent.plans[0].activities]
+    legs = [leg for agent in agents[1:] for leg in agent.plans[0].legs]
+    population.add_plans(
+        [agent.uid for agent in agents[1:]],
+        {'source': 'test', 'car': [agent.attributes['car'] for agent in agents[1:]]},
+        'test',
+        [len(agent.plans[0].activities) for agent in agents[1:]],
+        {
+            'seq': [act.sequence for act in acts],
+            'act': [act.act for act in acts],
+            'x': [act.point.x for act in acts],
+            'y': [act.point.y for act in acts],
+            'start': [act.start_seconds for act in acts],
+            'end': [act.end_seconds for act in acts],
+        },
+        [len(agent.plans[0].legs) for agent in agents[1:]],
+        {
+            'seq': [leg.sequence for leg in legs],
+            'mode': 'car',
+            'ox': [leg.start_loc.x for leg in legs],
+            'oy': [leg.start_loc.y for leg in legs],
+            'dx': [leg.end_loc.x for leg in legs],
+            'dy': [leg.end_loc.y for leg in legs],
+            'start': [leg.start_seconds for leg in legs],
+            'end': [leg.end_seconds for leg in legs],
+            'dist': [leg.dist for leg in legs],
+        },
+    )
+    assert population.get_size() == expected.get_size()
+    for view, expected_view in zip(population.agents, expected.agents):
+        assert view.uid == expected_view.uid
+        assert view.attributes == expected_view.attributes
+        for act, expected_act in zip(view.plans[0].activities, expected_view.plans[0].activities):
+            assert act.report() == expected_act.report()
+        for leg, expected_leg in zip(view.plans[0].legs, expected_view.plans[0].legs):
+            assert leg.report() == expected_leg.report()
+
+
+def test_chunks_merge_to_population():
+    rand = random.Random(4)
+    agents = [random_agent(str(i), rand) for i in range(25)]
+    agents[3].attributes['extra'] = 'value'
+    population = Population()
+    population.agents.extend(agents)
+
+    merged = Population()
+    for chunk in population.chunks(7):
+        assert chunk.get_size()[0] <= 7
+        merged.add_agents(chunk)
+    assert merged.get_size() == population.get_size()
+    for view, expected in zip(merged.agents, population.agents):
+        assert view.uid == expected.uid
+        assert view.attributes == expected.attributes
+        for act, expected_act in zip(view.plans[0].activities, expected.plans[0].activities):
+            assert act.report() == expected_act.report()
+        for leg, expected_leg in zip(view.plans[0].legs, expected.plans[0].legs):
+            assert leg.report() == expected_leg.report()
+
+
+def test_save_load_round_trip(tmp_path):
+    rand = random.Random(5)
+    agents = [random_agent(str(i), rand) for i in range(15)]
+    agents[2].attributes['extra'] = 7
+    population = Population()
+    population.agents.extend(agents)
+    population.records = {'test': {'plans': 15}}
+    path = str(tmp_path / 'population.npz')
+    population.save(path)
+
+    loaded = Population.load(path)
+    assert loaded.get_size() == population.get_size()
+    assert loaded.records == population.records
+    assert loaded.agent_plans == population.agent_plans
+    assert loaded.leg_dist.typecode == population.leg_dist.typecode
+    for view, expected in zip(loaded.agents, population.agents):
+        assert view.uid == expected.uid
+        assert view.attributes == expected.attributes
+        for act, expected_act in zip(view.plans[0].activities, expected.plans[0].activities):
+            assert act.report() == expected_act.report()
+        for leg, expected_leg in zip(view.plans[0].legs, expected.plans[0].legs):
+            assert leg.report() == expected_leg.report()
+    loaded.act_types.append('work')  # categories remain growable
+    assert loaded.act_types[-1] == 'work'
@@ -0,0 +1,17 @@
+import numpy as np
+import pytest
+
+from lps.core import projections
+
+
+def test_transform_round_trip():
+    x = np.array([530000., 545000., np.nan])
+    y = np.array([180000., 170000., 175000.])
+    lon, lat = projections.transform(x, y, 27700)
+    assert np.isnan(lon[2]) and np.isnan(lat[2])
+    assert lon[0] == pytest.approx(-0.128, abs=1e-3)
+    assert lat[0] == pytest.approx(51.504, abs=1e-3)
+    back_x, back_y = projections.transform(lon[:2], lat[:2], projections.WGS84, 27700)
+    assert np.allclose(back_x, x[:2], atol=1e-3)
+    assert np.allclose(back_y, y[:2], atol=1e-3)
+    assert projections.get_transformer(27700, 4326) is projections.get_transformer(27700, 4326)
@@ -0,0 +1,47 @@
+import numpy as np
+
+from lps.core import samplers, generators
+
+
+def test_child_streams_are_reproducible_and_independent():
+    a = samplers.make_rng(1234, 'motion', 'Business', 'M1', 3).random(5)
+    b = samplers.make_rng(samplers.seed_sequence(1234, 'motion', 'Business', 'M1', np.int64(3))).random(5)
+    c = samplers.make_rng(1234, 'motion', 'Business', 'M1', 4).random(5)
+    assert np.array_equal(a, b)
+    assert not np.array_equal(a, c)
+
+
+def test_generators_reproducible_for_seed():
+    dist = generators.FrequencyDistribution([(1, 2), (3, 4), (5, 6)], [0, 1, 3])
+    norm = generators.NormDayDistributionGen(low=7, mean=8, upp=10, sd=1)
+    first = dist.sample(samplers.make_rng(5), 100), norm.sample(samplers.make_rng(5), 100)
+    second = dist.sample(samplers.make_rng(5), 100), norm.sample(samplers.make_rng(5), 100)
+    assert first == second
+    assert (1, 2) not in first[0]
+    assert set(first[1]) <= set(range(7, 11))
+
+
+def test_object_sampler_counts_match_sample():
+    class Config:
+        SAMPLE = 3
+        NOFREQ = False
+        LIMIT = 900
+        DUMMIES = True
+        SEED = 7
+        SOURCE = 'test'
+
+    freq = samplers.make_rng(0).integers(0, 40, 2000)
+    expected = samplers.ObjectSampler(Config)
+    counts = []
+    positions = []
+    for n in freq:
+        sampled = [i for i in range(n) if expected.sample() and expected.sample_count <= Config.LIMIT]
+        counts.append(len(sampled))
+        positions.extend(sampled)
+
+    sampler = samplers.ObjectSampler(Config)
+    first = sampler.sample_counts(freq[:700])
+    second = sampler.sample_counts(freq[700:])
+    assert list(np.concatenate((first[0], second[0]))) == counts
+    assert list(np.concatenate((first[1], second[1]))) == positions
+    assert sampler.sample_count == Config.LIMIT
@@ -0,0 +1,66 @@
+import os
+import pickle
+import numpy as np
+import geopandas as gp
+from shapely.geometry import box
+
+from lps.core import shared, zones, samplers
+
+
+def test_shared_arrays_attach(tmp_path):
+    arrays = {
+        'a': np.arange(10, dtype=np.int32),
+        'b': np.linspace(0, 1, 12).reshape(3, 4),
+        'empty': np.empty(0),
+        'names': np.array(['x', None], dtype=object),
+    }
+    with shared.SharedArrays.publish(arrays, str(tmp_path)) as handle:
+        attached = pickle.loads(pickle.dumps(handle)).attach()
+        for name, values in arrays.items():
+            assert np.array_equal(attached[name], values)
+        assert not attached['b'].flags.writeable
+    assert not os.path.exists(handle.path)
+
+
+def test_shared_zone_index_pickles_as_handle(tmp_path):
+    frame = gp.GeoDataFrame({'zone': range(200)}, geometry=[box(i, 0, i + 1, 1) for i in range(200)]).set_index('zone')
+    index = zones.ZoneIndex.from_geodataframe(frame, epsg=27700)
+    shared_index = index.share(str(tmp_path))
+    try:
+        payload = pickle.dumps(shared_index)
+        assert len(payload) < len(pickle.dumps(index)) / 4
+        attached = pickle.loads(payload)
+        assert attached.epsg == 27700
+        ids = np.array([3, 150, 7])
+        expected = index.sample(ids, samplers.make_rng(2))
+        assert np.array_equal(attached.sample(ids, samplers.make_rng(2)), expected)
+    finally:
+        shared_index.shared.unlink()
+
+
+
+def test_ordered_map_bounds_work_in_flight():
+    from concurrent.futures import ThreadPoolExecutor
+    consumed = []
+
+    def items(n):
+        for item in range(n):
+            consumed.append(item)
+            yield item
+
+    with ThreadPoolExecutor(2) as executor:
+        results = shared.ordered_map(executor, abs, items(100), ahead=4)
+        assert next(results) == 0
+        assert len(consumed) == 4
+        assert list(results) == list(range(1, 100))
+
+        consumed.clear()
+        results = shared.ordered_map(executor, abs, items(100), ahead=4)
+        next(results)
+        results.close()
+        assert len(consumed) == 4
+
+        yielded = []
+        for result in shared.ordered_map(executor, abs, range(10), ahead=3, stop=lambda: len(yielded) == 2):
+            yielded.append(result)
+        assert yielded == [0, 1]
@@ -0,0 +1,94 @@
+import numpy as np
+import geopandas as gp
+from shapely.geometry import Point, Polygon, box
+
+from lps.core import zones, samplers
+
+
+geoms = gp.GeoDataFrame(
+    {'zone': [1, 2, 3]},
+    geometry=[
+        Polygon([(0, 0), (10, 0), (10, 10), (0, 10)], [[(3, 3), (6, 3), (6, 6), (3, 6)]]),  # with hole
+        Polygon([(20, 0), (30, 0), (30, 10), (29, 10), (29, 1), (20, 1)]),  # thin and concave
+        box(40, 0, 41, 1),
+    ]
+).set_index('zone')
+
+
+def test_triangulation_preserves_area():
+    for geom in geoms.geometry:
+        triangles = zones.triangulate_geometry(geom)
+        assert np.isclose(zones.triangle_areas(triangles).sum(), geom.area)
+
+
+def test_index_samples_within_zones():
+    index = zones.ZoneIndex.from_geodataframe(geoms)
+    ids = np.repeat([1, 2, 3], 100)
+    x, y = index.sample(ids, samplers.make_rng(1))
+    for zone_id, px, py in zip(ids, x, y):
+        assert geoms.geometry.loc[zone_id].buffer(1e-9).contains(Point(px, py))
+
+
+def test_index_unknown_zone_defaults_to_central_london():
+    index = zones.ZoneIndex.from_geodataframe(geoms)
+    x, y = index.sample([99], samplers.make_rng(1))
+    assert (x[0], y[0]) == zones.DEFAULT_POINT
+
+
+def test_index_persisted_alongside_source(tmp_path):
+    source = tmp_path / 'zones.shp'
+    source.write_text('')
+    index = zones.load_zone_index(geoms, str(source), 27700, 'zone')
+    path = zones.index_path(str(source), 'zone', 27700)
+    loaded = zones.load_zone_index(geoms, str(source), 27700, 'zone')
+    assert (tmp_path / 'zones.zone.27700.zidx.npz').exists()
+    assert path.endswith('zones.zone.27700.zidx.npz')
+    assert np.array_equal(index.triangles, loaded.triangles)
+    assert np.array_equal(index.ids, loaded.ids)
+
+
+def test_zone_store_persisted_alongside_source(tmp_path, monkeypatch):
+    source = str(tmp_path / 'zones.shp')
+    frame = geoms.reset_index()
+    frame.crs = {'init': 'epsg:27700'}
+    frame.to_file(source)
+    loaded = zones.load_zones(source, 27700, repair=True)
+    union = zones.load_zones_union(source, 27700)
+    assert (tmp_path / 'zones.repaired.27700.zstore.npz').exists()
+    assert (tmp_path / 'zones.union.27700.zstore.npz').exists()
+
+    zones._stores.clear()
+    monkeypatch.setattr(zones.gp, 'read_file', None)  # stores must not re-read the source
+    stored = zones.load_zones(source, 27700, repair=True)
+    assert list(stored.zone) == list(loaded.zone)
+    assert all(a.equals(b) for a, b in zip(stored.geometry, loaded.geometry))
+    assert zones.crs_epsg(stored.crs) == 27700
+    assert zones.load_zones_union(source, 27700).equals(union)
+    assert np.isclose(union.area, geoms.geometry.area.sum())
+
+
+def test_zone_membership_lookup():
+    membership = zones.ZoneMembership([3, 1, 7], [True, False, True])
+    ids = np.array([1, 3, 7, 2, 99, -1])
+    assert list(membership.get(ids)) == [0, 1, 1, -1, -1, -1]
+    assert list(membership.inside(ids)) == [False, True, True, False, False, False]
+    assert list(membership.outside(ids)) == [True, False, False, False, False, False]
+    assert sorted(membership.inside_ids) == [3, 7]
+
+
+def test_zone_membership_persisted_alongside_source(tmp_path):
+    source = str(tmp_path / 'zones.shp')
+    frame = geoms.reset_index()
+    frame.crs = {'init': 'epsg:27700'}
+    frame.to_file(source)
+    filter_source = str(tmp_path / 'filter.shp')
+    filter_frame = gp.GeoDataFrame({'name': ['a']}, geometry=[box(25, 5, 50, 6)], crs={'init': 'epsg:27700'})
+    filter_frame.to_file(filter_source)
+
+    membership = zones.load_zone_membership(source, 27700, 'zone', filter_source)
+    assert (tmp_path / 'zones.zone.in.filter.27700.zmember.npz').exists()
+    assert list(membership.inside([1, 2, 3])) == [False, True, False]
+
+    zones._stores.clear()
+    stored = zones.load_zone_membership(source, 27700, 'zone', filter_source)
+    assert list(stored.get([1, 2, 3])) == [0, 1, 0]
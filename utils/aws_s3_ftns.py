@@ -1,8 +1,14 @@
 import boto3
 import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from botocore.exceptions import BotoCoreError, ClientError
 
 s3 = boto3.client("s3", region_name="eu-west-1")
 
+PART_SIZE = 1 << 23  # bytes per multipart upload part (S3 minimum is 5 MiB, other than the last part)
+
 
 def get_matching_s3_objects(bucket, prefix="", key_pattern=""):
     """
@@ -61,6 +67,146 @@ def create_file(bucket_name, key, content_bytes):
     return s3.put_object(Bucket=bucket_name, Key=key, Body=content_bytes)
 
 
+class MultipartWriter:
+    """
+    Writable binary stream to an S3 object, uploaded as it is written: content is buffered into
+    parts, which are uploaded concurrently (multipart upload) by a pool of threads. Buffered and
+    in flight parts are bounded, so memory use is independent of object size (and objects are not
+    limited to the 5 GB of a single put). Failed part uploads are retried with backoff. Content
+    smaller than a single part is uploaded with a single put. The upload is completed on close, or
+    aborted if an exception is raised within the context. Use as a context manager:
+
+        with MultipartWriter(bucket, key) as stream:
+            stream.write(content)
+    """
+
+    def __init__(self, bucket_name, key, part_size=PART_SIZE, threads=4, retries=3, backoff=0.5, client=None):
+        """
+        :param bucket_name: str
+        :param key: str
+        :param part_size: bytes per part
+        :param threads: number of concurrent part uploads
+        :param retries: number of retries of each part upload
+        :param backoff: seconds before first retry, doubled for each subsequent retry
+        :param client: boto3 S3 client (or stand in), defaults to module client
+        """
+        self.bucket_name = bucket_name
+        self.key = key
+        self.part_size = part_size
+        self.threads = threads
+        self.retries = retries
+        self.backoff = backoff
+        self.client = client or s3
+        self.executor = None
+        self.upload_id = None
+        self.pending = deque()
+        self.parts = []
+        self.buffer = bytearray()
+        self.position = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+    def writable(self):
+        return True
+
+    def tell(self):
+        return self.position
+
+    def flush(self):
+        pass
+
+    def write(self, data):
+        self.buffer += data
+        self.position += len(data)
+        while len(self.buffer) >= self.part_size:
+            self.submit(bytes(self.buffer[:self.part_size]))
+            del self.buffer[:self.part_size]
+        return len(data)
+
+    def submit(self, body):
+        """
+        Queue part for upload, starting the multipart upload if required, and collecting completed
+        parts while too many are queued.
+        :param body: bytes
+        """
+        if self.upload_id is None:
+            response = self.client.create_multipart_upload(Bucket=self.bucket_name, Key=self.key)
+            self.upload_id = response['UploadId']
+            self.executor = ThreadPoolExecutor(self.threads)
+        part_number = len(self.parts) + len(self.pending) + 1
+        self.pending.append(self.executor.submit(self.upload_part, part_number, body))
+        while len(self.pending) > self.threads:
+            self.parts.append(self.pending.popleft().result())
+
+    def upload_part(self, part_number, body):
+        """
+        Upload part, with retries.
+        :param part_number: int, from 1
+        :param body: bytes
+        :return: dict of part number and ETag
+        """
+        for attempt in range(self.retries + 1):
+            try:
+                response = self.client.upload_part(
+                    Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                    PartNumber=part_number, Body=body
+                )
+                return {'PartNumber': part_number, 'ETag': response['ETag']}
+            except (BotoCoreError, ClientError):
+                if attempt == self.retries:
+                    raise
+                time.sleep(self.backoff * 2 ** attempt)
+
+    def close(self):
+        """
+        Upload remaining content and complete upload.
+        """
+        if self.closed:
+            return
+        try:
+            if self.upload_id is None:
+                self.client.put_object(Bucket=self.bucket_name, Key=self.key, Body=bytes(self.buffer))
+            else:
+                if self.buffer:
+                    self.submit(bytes(self.buffer))
+                while self.pending:
+                    self.parts.append(self.pending.popleft().result())
+                self.client.complete_multipart_upload(
+                    Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id,
+                    MultipartUpload={'Parts': self.parts}
+                )
+        except BaseException:
+            self.abort()
+            raise
+        self.buffer = bytearray()
+        self.shutdown()
+
+    def abort(self):
+        """
+        Abort upload (so that no parts are stored).
+        """
+        if self.closed:
+            return
+        for future in self.pending:
+            future.cancel()
+        self.shutdown()
+        if self.upload_id is not None:
+            self.client.abort_multipart_upload(Bucket=self.bucket_name, Key=self.key, UploadId=self.upload_id)
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+        self.closed = True
+
+
 def delete_file(bucket_name, key):
     return s3.delete_object(Bucket=bucket_name, Key=key)
 
@@ -74,6 +220,39 @@ def object_fetch(bucket_name, fileName):
     return s3.get_object(Bucket=bucket_name, Key=fileName)
 
 
+def head_object(bucket_name, key):
+    """
+    :param bucket_name: str
+    :param key: str
+    :return: dict of object metadata, None if object does not exist
+    """
+    try:
+        return s3.head_object(Bucket=bucket_name, Key=key)
+    except ClientError as e:
+        if e.response.get('Error', {}).get('Code') in ('404', 'NoSuchKey', 'NotFound'):
+            return None
+        raise
+
+
+def download_file(bucket_name, key, path, etag=None, chunk_size=1 << 20):
+    """
+    Stream S3 object to local file, in chunks (so that the object is never held in memory).
+    :param bucket_name: str
+    :param key: str
+    :param path: local path
+    :param etag: optional ETag, download fails if the object has since changed
+    :param chunk_size: bytes per chunk
+    :return: None
+    """
+    kwargs = {'Bucket': bucket_name, 'Key': key}
+    if etag:
+        kwargs['IfMatch'] = etag
+    body = s3.get_object(**kwargs)['Body']
+    with open(path, 'wb') as file:
+        for chunk in iter(lambda: body.read(chunk_size), b''):
+            file.write(chunk)
+
+
 def object_exists(bucket_name, key):
     try:
         s3.head_object(Bucket=bucket_name, Key=key)
@@ -1,6 +1,10 @@
 import gzip
 import os
+import threading
 import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from io import BytesIO
 import pandas as pd
 import geopandas as gp
@@ -9,6 +13,15 @@ from halo import Halo
 
 from utils import aws_s3_ftns
 
+GZIP_BLOCK_SIZE = 1 << 22  # bytes of content per gzip member when compressing in parallel
+S3_CACHE_DIR = os.environ.get('LPS_S3_CACHE', os.path.join(os.path.expanduser('~'), '.cache', 'lps', 's3'))
+ETAG_TREE = '.etags'  # cache sub directory of ETags of cached objects
+
+_s3_heads = {}  # S3 location: object metadata (None if missing)
+_s3_listings = {}  # S3 location: listing
+_cache_locks = {}  # local cache path: Lock
+_cache_locks_lock = threading.Lock()
+
 
 def is_s3_location(location):
     return location.lower().startswith("s3://")
@@ -36,19 +49,14 @@ def is_gzip(location):
 
 def file_exists(location):
     if is_s3_location(location):
-        bucket, key = aws_s3_ftns.parse_bucket_and_key_path(location)
-        return aws_s3_ftns.object_exists(bucket, key)
+        return s3_head(location) is not None
     else:
         return os.path.isfile(location)
 
 
 def dir_exists(location):
     if is_s3_location(location):
-        if location[-1] != '/':
-            location = location + '/'
-        bucket, key = aws_s3_ftns.parse_bucket_and_key_path(location)
-        dirs = aws_s3_ftns.list_directories(bucket, key)
-        return any(dirs)
+        return any(list_dir(location))
     else:
         return os.path.exists(location)
 
@@ -57,12 +65,101 @@ def list_dir(location):
     if is_s3_location(location):
         if location[-1] != '/':
             location = location + '/'
-        bucket, key_path = aws_s3_ftns.parse_bucket_and_key_path(location)
-        return aws_s3_ftns.list_directories(bucket, key_path)
+        if location not in _s3_listings:
+            bucket, key_path = aws_s3_ftns.parse_bucket_and_key_path(location)
+            _s3_listings[location] = aws_s3_ftns.list_directories(bucket, key_path)
+        return list(_s3_listings[location])
     else:
         return os.listdir(location)
 
 
+def s3_head(location):
+    """
+    Metadata (including ETag) of S3 object, held for the lifetime of the process, so that
+    repeated existence checks and cache lookups make a single request.
+    :param location: S3 path
+    :return: dict, None if object does not exist
+    """
+    if location not in _s3_heads:
+        bucket, key = aws_s3_ftns.parse_bucket_and_key_path(location)
+        _s3_heads[location] = aws_s3_ftns.head_object(bucket, key)
+    return _s3_heads[location]
+
+
+def local_path(location):
+    """
+    Local path for reading given location. S3 objects are fetched into a local read-through cache
+    (S3_CACHE_DIR, mirroring bucket and key), once per version of the object (by ETag), so that
+    repeated builds do not download inputs again. S3 locations which are not objects are treated as
+    directories, with all objects under the prefix fetched. Shapefiles are fetched with their
+    sidecar (.dbf, .shx, .prj etc.) files. Local locations are returned unchanged.
+    :param location: local or S3 path
+    :return: local path
+    """
+    if not is_s3_location(location):
+        return location
+    bucket, key = aws_s3_ftns.parse_bucket_and_key_path(location.rstrip('/'))
+    head = s3_head(location)
+    if head is None:
+        prefix = key + '/'
+        for obj in aws_s3_ftns.get_matching_s3_objects(bucket, prefix):
+            cache_s3_object(bucket, obj['Key'], obj['ETag'])
+        return s3_cache_path(bucket, key)
+    if is_shp(location):
+        root = os.path.splitext(key)[0] + '.'
+        for obj in aws_s3_ftns.get_matching_s3_objects(bucket, root):
+            if obj['Key'] != key:
+                cache_s3_object(bucket, obj['Key'], obj['ETag'])
+    return cache_s3_object(bucket, key, head['ETag'])
+
+
+def s3_cache_path(bucket, key, tree=''):
+    """
+    :param bucket: str
+    :param key: str
+    :param tree: cache sub directory (eg for ETags)
+    :return: str
+    """
+    return os.path.join(S3_CACHE_DIR, tree, bucket, *key.split('/'))
+
+
+def cache_s3_object(bucket, key, etag):
+    """
+    Fetch S3 object into local cache, unless the cached copy is of the same version (ETag). Objects
+    are downloaded to a temporary file first so that partial downloads are never read.
+    :param bucket: str
+    :param key: str
+    :param etag: str
+    :return: local path
+    """
+    path = s3_cache_path(bucket, key)
+    etag_path = s3_cache_path(bucket, key, ETAG_TREE)
+    with cache_lock(path):  # threads (eg prefetching) wait for, rather than repeat, a download
+        if os.path.exists(path) and os.path.exists(etag_path):
+            with open(etag_path) as file:
+                if file.read() == etag:
+                    return path
+
+        print("\tCaching s3://{}/{} to {}".format(bucket, key, path))
+        create_local_dir(os.path.dirname(path))
+        create_local_dir(os.path.dirname(etag_path))
+        temp_path = '{}.{}.tmp'.format(path, os.getpid())  # worker processes may fetch concurrently
+        aws_s3_ftns.download_file(bucket, key, temp_path, etag=etag)
+        os.replace(temp_path, path)
+        with open(etag_path, 'w') as file:
+            file.write(etag)
+    return path
+
+
+def cache_lock(path):
+    """
+    :param path: local cache path
+    :return: threading Lock for given path
+    """
+    with _cache_locks_lock:
+        return _cache_locks.setdefault(path, threading.Lock())
+
+
 def gzip_content(content):
     gz_body = BytesIO()
     gz = gzip.GzipFile(None, "wb", 9, gz_body)
@@ -88,18 +185,17 @@ def xml_tree(content):
 
 def read_content(location, **kwargs):
     print("\tReading data from location '{}'".format(location))
+    s3_location = is_s3_location(location)
+    location = local_path(location)  # S3 inputs are read through the local cache
     if is_csv(location):
         location_content = pd.read_csv(location, **kwargs)
     elif is_xlsx(location):
         location_content = pd.read_excel(location, **kwargs)
     elif is_shp(location):
         location_content = gp.read_file(location, **kwargs)
-    elif is_s3_location(location):
-        bucket, key = aws_s3_ftns.parse_bucket_and_key_path(location)
-        s3_obj = aws_s3_ftns.object_fetch(bucket, key)
-        location_content = s3_obj["Body"].read()
-        if is_gzip(location):
-            location_content = zlib.decompress(location_content, 16 + zlib.MAX_WBITS)
+    elif s3_location:  # binary content, decompressed as it is read if gzip
+        with (gzip.open(location, "rb") if is_gzip(location) else open(location, "rb")) as content_file:
+            location_content = content_file.read()
     else:
         if is_gzip(location):
             content_file = gzip.open(location, "r")
@@ -114,26 +210,23 @@ def read_content(location, **kwargs):
 def create_local_dir(directory):
     if not os.path.exists(directory):
         print('Creating {}'.format(directory))
-        os.makedirs(directory)
+        os.makedirs(directory, exist_ok=True)  # may be created concurrently
 
 
 def write_content(content, location, **kwargs):
     if is_s3_location(location):
-        bucket, key_path = aws_s3_ftns.parse_bucket_and_key_path(location)
-        print("\tWriting output to S3 (bucket={}, key={})".format(bucket, key_path))
-        if is_gzip(location):
-            binary_content = gzip_content(content)
-        elif is_csv(location):
-            binary_content = content.to_csv(None).encode()
-        elif is_xml(location):
-            binary_content = xml_content(content, **kwargs)
-        else:
-            try:
-                binary_content = content.encode("utf-8")
-            except UnicodeDecodeError as e:
-                # assume the content is already a binary stream
-                binary_content = content
-        aws_s3_ftns.create_file(bucket, key_path, binary_content)
+        with open_output(location) as stream:  # streamed as multipart upload
+            if is_gzip(location):
+                stream.write(content.encode("utf-8"))
+            elif is_csv(location):
+                write_csv(content, stream)
+            elif is_xml(location):
+                stream.write(xml_content(content, **kwargs))
+            elif isinstance(content, str):
+                stream.write(content.encode("utf-8"))
+            else:
+                # assume the content is already binary
+                stream.write(content)
     else:
         with Halo(text="\tWriting output to local file system at {}".format(location), spinner='dots') as spinner:
             create_local_dir(os.path.dirname(location))
@@ -150,3 +243,143 @@ def write_content(content, location, **kwargs):
 
                 spinner.succeed('Content written to {}'.format(location))
                 file.close()
+
+
+@contextmanager
+def open_output(location, compresslevel=9, threads=1):
+    """
+    Open binary output stream for given location, so that content can be written incrementally.
+    Locations ending .gz are gzip compressed as they are written (in parallel blocks if threads > 1).
+    S3 outputs are uploaded as they are written (as a multipart upload, completed on close).
+    :param location: local or S3 path
+    :param compresslevel: gzip compression level
+    :param threads: number of gzip compression threads
+    :return: writable binary file object
+    """
+    if is_s3_location(location):
+        bucket, key_path = aws_s3_ftns.parse_bucket_and_key_path(location)
+        print("\tStreaming output to S3 (bucket={}, key={})".format(bucket, key_path))
+        with aws_s3_ftns.MultipartWriter(bucket, key_path) as upload:
+            if is_gzip(location):
+                with gzip_stream(upload, compresslevel, threads) as stream:
+                    yield stream
+            else:
+                yield upload
+    else:
+        if os.path.dirname(location):
+            create_local_dir(os.path.dirname(location))
+        with open(location, "wb") as file:
+            if is_gzip(location):
+                with gzip_stream(file, compresslevel, threads) as stream:
+                    yield stream
+            else:
+                yield file
+
+
+def write_csv(df, stream, chunk_rows=100000):
+    """
+    Write DataFrame as csv to binary stream, in chunks of rows (so that the full csv is never
+    held in memory).
+    :param df: Pandas DataFrame
+    :param stream: writable binary file object
+    :param chunk_rows: rows per chunk
+    :return: None
+    """
+    for start in range(0, max(len(df), 1), chunk_rows):
+        stream.write(df.iloc[start:start + chunk_rows].to_csv(header=not start).encode())
+
+
+def gzip_stream(fileobj, compresslevel=9, threads=1):
+    """
+    Gzip compressing writer to given binary file object (which is not closed with the writer).
+    :param fileobj: writable binary file object
+    :param compresslevel: gzip compression level
+    :param threads: number of compression threads, single stream gzip if 1
+    :return: GzipFile or ParallelGzipWriter
+    """
+    if threads > 1:
+        return ParallelGzipWriter(fileobj, compresslevel, threads)
+    return gzip.GzipFile(fileobj=fileobj, mode="wb", compresslevel=compresslevel)
+
+
+class ParallelGzipWriter:
+    """
+    Writable binary stream, compressing content to multi-member gzip (as pigz --independent):
+    content is split into blocks, each compressed as a complete gzip member by a pool of threads
+    (zlib releases the GIL while compressing), and members are written in order. Concatenated
+    members are a valid gzip file, decompressed as a single stream by gzip readers (including
+    MATSim). The number of blocks in flight is bounded, so memory use is independent of output size.
+    """
+
+    def __init__(self, fileobj, compresslevel=9, threads=2, block_size=GZIP_BLOCK_SIZE):
+        self.fileobj = fileobj
+        self.compresslevel = compresslevel
+        self.block_size = block_size
+        self.max_pending = 2 * threads
+        self.executor = ThreadPoolExecutor(threads)
+        self.pending = deque()
+        self.buffer = bytearray()
+        self.members = 0
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.executor.shutdown(wait=False)
+            self.closed = True
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.buffer += data
+        while len(self.buffer) >= self.block_size:
+            self.submit(bytes(self.buffer[:self.block_size]))
+            del self.buffer[:self.block_size]
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def submit(self, block):
+        """
+        Queue block for compression, writing completed members (in order) while too many are queued.
+        :param block: bytes
+        """
+        self.pending.append(self.executor.submit(gzip_member, block, self.compresslevel))
+        self.members += 1
+        while len(self.pending) > self.max_pending:
+            self.fileobj.write(self.pending.popleft().result())
+
+    def close(self):
+        """
+        Compress remaining content and write all members (an empty output is written as a single
+        empty member).
+        """
+        if self.closed:
+            return
+        try:
+            if self.buffer or not self.members:
+                self.submit(bytes(self.buffer))
+                self.buffer = bytearray()
+            while self.pending:
+                self.fileobj.write(self.pending.popleft().result())
+        finally:
+            self.executor.shutdown()
+            self.closed = True
+
+
+def gzip_member(block, compresslevel):
+    """
+    Compress block as a complete gzip member (with no file name and zero modified time, so that
+    output is reproducible).
+    :param block: bytes
+    :param compresslevel: gzip compression level
+    :return: bytes
+    """
+    compressor = zlib.compressobj(compresslevel, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    return compressor.compress(block) + compressor.flush()